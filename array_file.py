@@ -0,0 +1,67 @@
+# Binary files of named numpy arrays that load memory mapped.
+# Layout: magic string (8 bytes), format version (uint32), header length (uint32), json header and the arrays at ALIGN aligned
+# offsets. The header holds dtype, shape and offset of every array and any json serializable meta data of the file type.
+# Unlike pickle, loading a file does not execute code, and unlike .npz, the arrays are views into one read-only memory map.
+
+import json
+import numpy as np
+
+
+ALIGN = 64
+
+
+def data_start(header_len, magic):
+    return -(-(len(magic) + 8 + header_len) // ALIGN) * ALIGN
+
+
+def write_array_file(path, magic, version, arrays, meta=None):
+    """
+    Write the arrays (dict name -> array) to path.
+    magic   -- 8 byte string identifying the file type
+    version -- format version of the file type, read_array_file refuses other versions
+    meta    -- json serializable dict stored in the header
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+
+    # byte offsets of the arrays relative to the start of the data, which follows the header at the next aligned offset
+    offsets = {}
+    offset = 0
+    for name, array in arrays.items():
+        offsets[name] = offset
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({'meta': meta or {},
+                         'arrays': {name: {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offsets[name]}
+                                    for name, array in arrays.items()}}).encode()
+
+    with open(path, 'wb') as f:
+        f.write(magic)
+        f.write(np.array([version, len(header)], dtype='<u4').tobytes())
+        f.write(header)
+        start = data_start(len(header), magic)
+        for name, array in arrays.items():
+            f.write(bytes(start + offsets[name] - f.tell()))
+            f.write(array.tobytes())
+
+
+def read_array_file(path, magic, version, mmap=True):
+    """
+    Read a file written by write_array_file and return (arrays, meta).
+    mmap -- map the file read-only into memory instead of reading it, the arrays are views into the mapped file
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(f"{path} is not a {magic.decode()} file")
+        file_version, header_len = np.frombuffer(f.read(8), dtype='<u4').tolist()
+        if file_version != version:
+            raise ValueError(f"{path} has {magic.decode()} format version {file_version}, supported is version {version}")
+        header = json.loads(f.read(header_len))
+    data = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+    start = data_start(header_len, magic)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        offset = start + spec['offset']
+        count = int(np.prod(spec['shape']))
+        arrays[name] = data[offset:offset + count * dtype.itemsize].view(dtype).reshape(spec['shape'])
+    return arrays, header['meta']
@@ -0,0 +1,200 @@
+# Benchmark of graph generation, building ingest and simulation at city scale.
+# Buildings are generated synthetically, such that no OSM download is needed. Every stage is timed and reported as one json line
+# with wall time and peak RSS, e.g. to compare versions or to size cluster jobs:
+#
+#   python benchmark.py --preset salzburg --engine vec --sim-iters 100 --out bench.jsonl
+#
+# Every preset runs in its own process, so the peak RSS of a preset is not inflated by the presets before it.
+
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import contextlib
+import platform
+import resource
+import subprocess
+import multiprocessing
+from pathlib import Path
+import numpy as np
+from gengraph import EpsimGraph
+from epsim import Epsim
+from epsim_vec import EpsimVec
+from read_building_csv import read_building_csv
+from rng_streams import RNGStreams
+
+
+populations = {'small': 20000, 'salzburg': 179614, 'graz': 333049, 'vienna': 1935000}
+
+# bounding boxes (min lon, min lat, max lon, max lat) of the OSM sources in sanity_checks.md, 'small' uses the one of salzburg
+bboxes = {
+    'small': (12.9968, 47.7684, 13.0940, 47.8341),
+    'salzburg': (12.9968, 47.7684, 13.0940, 47.8341),
+    'graz': (15.3762, 47.0232, 15.5045, 47.1240),
+    'vienna': (16.2172, 48.1304, 16.5399, 48.2846)
+}
+
+# synthetic locations: persons per location and tags of the location types
+synthetic_locations = {
+    'supermarket': (2500, ['supermarket']),
+    'shop': (300, ['clothes', 'bakery', 'hairdresser', 'kiosk', 'convenience', 'butcher', 'florist', 'optician', 'chemist', 'books',
+                   'shoes', 'mobile_phone']),
+    'restaurant': (400, ['restaurant', 'cafe', 'fast_food', 'ice_cream', 'biergarten']),
+    'leisure': (1500, ['fitness_centre', 'cinema', 'sports_centre', 'theatre', 'community_centre', 'bowling_alley']),
+    'nightlife': (2000, ['bar', 'pub', 'nightclub'])
+}
+house_sqm_per_person = 45  # between the official values of sanity_checks.md
+
+
+def write_synthetic_buildings_csv(path, n, bbox, seed=0):
+    """
+    Write a buildings csv in the format of osm/extract_buildings.py for a city of n persons within bbox.
+    Houses are scattered around the center with a mix of small houses and apartment buildings, such that the total house area
+    matches house_sqm_per_person; locations are placed uniformly with tags chosen by a skewed distribution.
+    """
+    rng = np.random.default_rng(seed)
+    min_x, min_y, max_x, max_y = bbox
+    center = np.array([(min_x + max_x) / 2, (min_y + max_y) / 2])
+    spread = np.array([(max_x - min_x) / 5, (max_y - min_y) / 5])
+
+    # houses: 70% single and multi family houses (60-250 sqm), 30% apartment buildings (400-3000 sqm)
+    avg_house_sqm = 0.7 * 155 + 0.3 * 1700
+    num_houses = int(n * house_sqm_per_person / avg_house_sqm)
+    apartments = rng.random(num_houses) < 0.3
+    house_sqm = np.where(apartments, rng.integers(400, 3000, num_houses), rng.integers(60, 250, num_houses))
+    house_xy = np.clip(rng.normal(center, spread, (num_houses, 2)), (min_x, min_y), (max_x, max_y))
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['building_type', 'tag', 'longitude', 'latitude', 'sqm'])
+        tags = np.where(apartments, 'apartments', 'house')
+        writer.writerows(zip(['house'] * num_houses, tags, house_xy[:, 0], house_xy[:, 1], house_sqm))
+        for loc_type, (persons_per_loc, loc_tags) in synthetic_locations.items():
+            num_locs = max(int(n / persons_per_loc), 1)
+            tag_weights = 1 / np.arange(1, len(loc_tags) + 1)
+            loc_tag = rng.choice(loc_tags, num_locs, p=tag_weights / tag_weights.sum())
+            loc_xy = rng.uniform((min_x, min_y), (max_x, max_y), (num_locs, 2))
+            loc_sqm = rng.integers(50, 1000, num_locs)
+            writer.writerows(zip([loc_type] * num_locs, loc_tag, loc_xy[:, 0], loc_xy[:, 1], loc_sqm))
+    return num_houses
+
+
+def default_sim_params(sim_iters):
+    # parameters of the examples in epsim_plot.ipynb
+    return dict(sim_iters=sim_iters, num_start_agents=100, perc_immune_agents=0.0, start_weekday=0,
+                p_spread_household_dict={0: 0.1}, p_spread_school_dict={0: 0.01}, p_spread_office_dict={0: 0.01},
+                p_detect_child_dict={0: 0.1}, p_detect_adult_dict={0: 0.3},
+                testing_dict={0: {'pcr': {'p': 0.95, 'weekdays': [2]}, 'antigen': {'p': 0.5, 'weekdays': [0, 4]}}},
+                omicron=False, split_stay_home=False, loc_infec_rate=1.0,
+                avg_visit_times={'supermarket': 20, 'shop': 60, 'restaurant': 90, 'leisure': 120, 'nightlife': 240},
+                need_minutes={'supermarket': 60, 'shop': 120, 'restaurant': 180, 'leisure': 600, 'nightlife': 480},
+                contact_mult={'supermarket': 1, 'shop': 1, 'restaurant': 1, 'leisure': 1, 'nightlife': 1},
+                p_interhh_visit_dict={0: 0.1})
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class BenchmarkRun:
+    def __init__(self, preset, engine, out):
+        """Times stages of one preset and writes a json line per stage to out (file object)"""
+        self.info = {'preset': preset, 'n': populations[preset], 'engine': engine, 'git_revision': git_revision(),
+                     'python': platform.python_version(), 'numpy': np.__version__, 'cpus': os.cpu_count()}
+        self.out = out
+
+
+    def measure(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        wall_time = time.perf_counter() - start
+        record = dict(self.info, stage=stage, wall_time_s=round(wall_time, 4), peak_rss_mb=round(peak_rss_mb(), 1))
+        self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+        print(f"{self.info['preset']} {stage}: {wall_time:.2f} s, peak RSS {record['peak_rss_mb']:.0f} MB", file=sys.stderr)
+        return result
+
+
+def run_preset(preset, engine, sim_iters, runs, data_dir, out_path, seed, verbose=False, vectorized_graph=False, lazy_locations=False):
+    if verbose:
+        run_stages(preset, engine, sim_iters, runs, data_dir, out_path, seed, vectorized_graph, lazy_locations)
+    else:
+        # the benchmarked functions print their progress onto stdout
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run_stages(preset, engine, sim_iters, runs, data_dir, out_path, seed, vectorized_graph, lazy_locations)
+
+
+def run_stages(preset, engine, sim_iters, runs, data_dir, out_path, seed, vectorized_graph=False, lazy_locations=False):
+    with open(out_path, 'a') as out:
+        bench = BenchmarkRun(preset, engine, out)
+        n = populations[preset]
+        streams = RNGStreams(seed)
+
+        csv_path = Path(data_dir) / f"buildings_{preset}_{seed}.csv"
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        if not csv_path.is_file():
+            bench.measure('write_synthetic_buildings_csv', write_synthetic_buildings_csv, csv_path, n, bboxes[preset], seed)
+
+        epsim_graph = bench.measure('EpsimGraph', EpsimGraph, n, 0.5, 0.3, rng=streams.python('graph'),
+                                     vectorized=vectorized_graph)
+        if engine == 'vec':
+            csr_graph = bench.measure('to_csr', epsim_graph.to_csr)
+            sim = bench.measure('EpsimVec', EpsimVec, csr_graph)
+        else:
+            sim = bench.measure('Epsim', Epsim, epsim_graph.household_nbrs, epsim_graph.school_nbrs_standard, epsim_graph.school_nbrs_split,
+                                epsim_graph.office_nbrs, epsim_graph.interhousehold_nbrs)
+        del epsim_graph
+
+        # read_building_csv caches the preprocessed buildings, use an empty cache directory for the cold read
+        cache_dir = Path(data_dir) / f"building_cache_{preset}_{seed}"
+        if cache_dir.is_dir():
+            shutil.rmtree(cache_dir)
+        bench.measure('read_building_csv_cold', read_building_csv, sim, str(csv_path), rng=RNGStreams(seed).python('buildings'),
+                      cache_dir=cache_dir)
+        bench.measure('read_building_csv_cached', read_building_csv, sim, str(csv_path), rng=RNGStreams(seed).python('buildings'),
+                      cache_dir=cache_dir)
+
+        for run in range(runs):
+            bench.measure('run_sim', sim.run_sim, **default_sim_params(sim_iters), seed=[seed, run])
+            if lazy_locations:
+                bench.measure('run_sim_lazy', sim.run_sim, **default_sim_params(sim_iters), seed=[seed, run], lazy_locations=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark graph generation, building ingest and simulation")
+    parser.add_argument('--preset', nargs='+', default=['salzburg'], choices=list(populations.keys()) + ['all'])
+    parser.add_argument('--engine', default='vec', choices=['vec', 'set'], help="EpsimVec or the set based Epsim")
+    parser.add_argument('--sim-iters', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=1, help="number of timed run_sim calls per preset")
+    parser.add_argument('--data-dir', default="bench_data", help="directory of the synthetic buildings csv files")
+    parser.add_argument('--out', default="bench_results.jsonl", help="json lines file the results are appended to")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="show the output of the benchmarked functions")
+    parser.add_argument('--vectorized-graph', action='store_true', help="generate households and offices with EpsimGraph(vectorized=True)")
+    parser.add_argument('--lazy-locations', action='store_true',
+                        help="also time run_sim(lazy_locations=True) with the same seeds after every run_sim (stage run_sim_lazy)")
+    args = parser.parse_args()
+
+    presets = ['salzburg', 'graz', 'vienna'] if 'all' in args.preset else args.preset
+    for preset in presets:
+        # own process per preset, such that peak RSS is measured per preset
+        process = multiprocessing.Process(target=run_preset, args=(preset, args.engine, args.sim_iters, args.runs, args.data_dir,
+                                                                    args.out, args.seed, args.verbose, args.vectorized_graph,
+                                                                    args.lazy_locations))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            sys.exit(process.exitcode)
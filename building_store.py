@@ -0,0 +1,180 @@
+# Columnar store of the buildings of osm/extract_buildings.py.
+# Every building is one row of the typed arrays type (index into types), tag (index into tags), x, y (longitude, latitude) and sqm.
+# Stores extracted from OSM also hold the OSM element of every building (osm_type index into OSM_TYPES, osm_id), which
+# osm/update_buildings.py uses to replace the buildings of changed elements.
+# Stores are written as array file (see array_file.py) and load memory mapped, usually with the rows in Hilbert order of their
+# coordinates, such that nearby buildings are adjacent in memory. Convert a buildings csv with:
+#
+#   python building_store.py buildings.csv buildings.buildings
+
+import sys
+import csv
+import numpy as np
+from array_file import write_array_file, read_array_file
+
+
+BUILDING_STORE_MAGIC = b"EPSIMBST"
+BUILDING_STORE_VERSION = 1
+BUILDING_STORE_SUFFIX = ".buildings"
+CSV_FIELDS = ['building_type', 'tag', 'longitude', 'latitude', 'sqm']
+OSM_TYPES = ['node', 'way']
+
+
+def dictionary_encode(values):
+    """Return the distinct values in order of their first occurrence and the index of every value in them"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return [], np.empty(0, dtype=np.int64)
+    distinct, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return distinct[order].tolist(), rank[inverse.ravel()]
+
+
+def hilbert_index(x, y, bits=16):
+    """Return the index of every point on a Hilbert curve through the 2^bits x 2^bits grid over the bounding box of the points"""
+    n = 1 << bits
+    def grid_coords(v):
+        extent = v.max() - v.min() if len(v) > 0 else 0
+        return ((v - v.min()) / extent * (n - 1)).astype(np.int64) if extent > 0 else np.zeros(len(v), dtype=np.int64)
+    xi = grid_coords(np.asarray(x, dtype=np.float64))
+    yi = grid_coords(np.asarray(y, dtype=np.float64))
+    d = np.zeros(len(xi), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (xi & s) > 0
+        ry = (yi & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant, such that the curve is continuous
+        flip = ~ry & rx
+        xi = np.where(flip, n - 1 - xi, xi)
+        yi = np.where(flip, n - 1 - yi, yi)
+        xi, yi = np.where(~ry, yi, xi), np.where(~ry, xi, yi)
+        s >>= 1
+    return d
+
+
+class BuildingStore:
+    def __init__(self, types, tags, type, tag, x, y, sqm, osm_type=None, osm_id=None):
+        """
+        types    -- list of building types (house, supermarket, ...), type holds the index of the type of every building
+        tags     -- list of tags, tag holds the index of the tag of every building
+        x, y     -- float64 arrays of longitude and latitude
+        sqm      -- int32 array of the area
+        osm_type -- uint8 array of the index into OSM_TYPES of the element of every building, None if unknown
+        osm_id   -- int64 array of the id of the element of every building, None if unknown
+        """
+        self.types = list(types)
+        self.tags = list(tags)
+        self.type = type
+        self.tag = tag
+        self.x = x
+        self.y = y
+        self.sqm = sqm
+        self.osm_type = osm_type
+        self.osm_id = osm_id
+
+
+    def __len__(self):
+        return len(self.type)
+
+
+    @classmethod
+    def from_columns(cls, building_types, tags, x, y, sqm, osm_types=None, osm_ids=None):
+        """
+        Create a store from columns of building type strings, tag strings, coordinates and areas, in row order, and optionally
+        of the OSM element type strings (node, way) and ids.
+        """
+        types, type_ids = dictionary_encode(building_types)
+        tag_names, tag_ids = dictionary_encode(tags)
+        osm_type = None if osm_types is None else np.array([OSM_TYPES.index(t) for t in osm_types], dtype=np.uint8)
+        osm_id = None if osm_ids is None else np.asarray(osm_ids, dtype=np.int64)
+        return cls(types, tag_names, type_ids.astype(np.uint8), tag_ids.astype(np.int32), np.asarray(x, dtype=np.float64),
+                   np.asarray(y, dtype=np.float64), np.asarray(sqm, dtype=np.int32), osm_type, osm_id)
+
+
+    @classmethod
+    def concat(cls, stores):
+        """Return the rows of the stores one after another in one store, the osm ids are kept if all stores have them"""
+        store = cls.from_columns(np.concatenate([np.array(s.types, dtype=object)[s.type] for s in stores]),
+                                 np.concatenate([np.array(s.tags, dtype=object)[s.tag] for s in stores]),
+                                 np.concatenate([s.x for s in stores]), np.concatenate([s.y for s in stores]),
+                                 np.concatenate([s.sqm for s in stores]))
+        if all(s.osm_type is not None for s in stores):
+            store.osm_type = np.concatenate([s.osm_type for s in stores])
+            store.osm_id = np.concatenate([s.osm_id for s in stores])
+        return store
+
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read a buildings csv (building_type,tag,longitude,latitude,sqm), the rows keep their order"""
+        with open(path) as f:
+            csvreader = csv.reader(f)
+            fields = next(csvreader)
+            assert(fields == CSV_FIELDS)
+            columns = list(zip(*csvreader)) or [()] * len(CSV_FIELDS)
+        building_types, tags, x, y, sqm = columns
+        return cls.from_columns(building_types, tags, np.array(x, dtype=np.float64), np.array(y, dtype=np.float64),
+                                np.array(sqm, dtype=np.int32))
+
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_FIELDS)
+            writer.writerows(zip(np.array(self.types, dtype=object)[self.type], np.array(self.tags, dtype=object)[self.tag],
+                                 self.x.tolist(), self.y.tolist(), self.sqm.tolist()))
+
+
+    def take(self, rows):
+        return BuildingStore(self.types, self.tags, self.type[rows], self.tag[rows], self.x[rows], self.y[rows], self.sqm[rows],
+                             None if self.osm_type is None else self.osm_type[rows],
+                             None if self.osm_id is None else self.osm_id[rows])
+
+
+    def sorted_spatially(self):
+        """Return the store with the rows in Hilbert order of their coordinates"""
+        return self.take(np.argsort(hilbert_index(self.x, self.y), kind='stable'))
+
+
+    def rows_of_type(self, building_type):
+        if building_type not in self.types:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.type == self.types.index(building_type))
+
+
+    def save(self, path):
+        arrays = {'type': self.type, 'tag': self.tag, 'x': self.x, 'y': self.y, 'sqm': self.sqm}
+        if self.osm_type is not None:
+            arrays['osm_type'] = self.osm_type
+            arrays['osm_id'] = self.osm_id
+        write_array_file(path, BUILDING_STORE_MAGIC, BUILDING_STORE_VERSION, arrays, {'types': self.types, 'tags': self.tags})
+
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        arrays, meta = read_array_file(path, BUILDING_STORE_MAGIC, BUILDING_STORE_VERSION, mmap)
+        return cls(meta['types'], meta['tags'], arrays['type'], arrays['tag'], arrays['x'], arrays['y'], arrays['sqm'],
+                   arrays.get('osm_type'), arrays.get('osm_id'))
+
+
+def is_building_store(path):
+    with open(path, 'rb') as f:
+        return f.read(len(BUILDING_STORE_MAGIC)) == BUILDING_STORE_MAGIC
+
+
+def read_buildings(path):
+    """Return the buildings of a building store file or of a buildings csv as BuildingStore"""
+    return BuildingStore.load(path) if is_building_store(path) else BuildingStore.from_csv(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python building_store.py buildings_csv building_store")
+        exit(0)
+
+    store = BuildingStore.from_csv(sys.argv[1]).sorted_spatially()
+    store.save(sys.argv[2])
+    print(f"{len(store)} buildings written to {sys.argv[2]}")
@@ -0,0 +1,55 @@
+# Checkpoints of simulation runs in progress.
+# A checkpoint holds the complete state at the beginning of a round: agent states, quarantine counters, random generator states
+# and the per round information of the rounds before. It can be resumed with run_sim(resume_from=checkpoint, ...), also several
+# times with different parameters from that round onward, to fork one simulated prefix into several scenarios.
+# Both engines continue exactly like the run the checkpoint was taken from.
+
+import json
+import numpy as np
+from recorder import RunRecorder
+
+
+class Checkpoint:
+    def __init__(self, rnd, num_agent_states, state, quarantine_counter, rng_state, prefix):
+        """
+        rnd                -- round at which the simulation continues
+        num_agent_states   -- number of agent states of the run (depends on omicron)
+        state              -- uint8 array with the state of every agent id, ids that are no agents have the last state
+        quarantine_counter -- int8 array with the quarantine counter of every agent id, -1: not quarantined
+        rng_state          -- dict of the states of the random generators of the run
+        prefix             -- RunRecorder with the per round information of the rounds 0..rnd-1
+        """
+        self.rnd = rnd
+        self.num_agent_states = num_agent_states
+        self.state = state
+        self.quarantine_counter = quarantine_counter
+        self.rng_state = rng_state
+        self.prefix = prefix
+
+
+    def save(self, path):
+        np.savez_compressed(path, rnd=self.rnd, num_agent_states=self.num_agent_states, state=self.state,
+                            quarantine_counter=self.quarantine_counter, rng_state=json.dumps(self.rng_state),
+                            metrics=self.prefix.metrics, states=self.prefix.states)
+
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            prefix = RunRecorder()
+            prefix.metrics = data['metrics']
+            prefix.states = data['states']
+            return cls(int(data['rnd']), int(data['num_agent_states']), data['state'], data['quarantine_counter'],
+                       json.loads(str(data['rng_state'])), prefix)
+
+
+    def info_per_rnd(self):
+        return self.prefix.to_info_per_rnd()
+
+
+def make_prefix(info_per_rnd, num_agent_states):
+    prefix = RunRecorder()
+    prefix.start_run(len(info_per_rnd), num_agent_states)
+    for rnd, info in enumerate(info_per_rnd):
+        prefix.record(rnd, info)
+    return prefix
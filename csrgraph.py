@@ -0,0 +1,225 @@
+# Compressed sparse row (CSR) representation of the neighbor graphs used by Epsim.
+# For every edge type the neighbors of agent a are indices[indptr[a]:indptr[a+1]], agent ids are the node ids of EpsimGraph.
+# Which agent takes part in which graph (e.g. is a school child) is stored in one role bitmask per agent.
+# CSRGraph.save() writes all arrays to one binary graph file, which CSRGraph.load() memory maps, such that worker processes
+# opening the same file share its pages instead of holding a copy of the graph each.
+
+import itertools
+from collections.abc import Mapping
+import numpy as np
+from array_file import write_array_file, read_array_file
+
+
+# agent role bits
+ROLE_AGENT = 1  # node id is an agent (all agents have a household entry)
+ROLE_CHILD = 2  # child attending a school class (standard or split)
+ROLE_ADULT = 4  # adult (all adults have an office entry)
+ROLE_SCHOOL_STANDARD = 8
+ROLE_SCHOOL_SPLIT_0 = 16
+ROLE_SCHOOL_SPLIT_1 = 32
+ROLE_INTERHOUSEHOLD = 64  # agent has interhousehold relatives
+
+EDGE_TYPES = ['household', 'school_standard', 'school_split_0', 'school_split_1', 'office', 'interhousehold']
+
+# role bit of the agents that have an entry in the neighbor dict of an edge type
+EDGE_TYPE_ROLES = {
+    'household': ROLE_AGENT,
+    'school_standard': ROLE_SCHOOL_STANDARD,
+    'school_split_0': ROLE_SCHOOL_SPLIT_0,
+    'school_split_1': ROLE_SCHOOL_SPLIT_1,
+    'office': ROLE_ADULT,
+    'interhousehold': ROLE_INTERHOUSEHOLD
+}
+
+
+GRAPH_FILE_MAGIC = b"EPSIMCSR"
+GRAPH_FILE_VERSION = 1
+
+
+def concat_ranges(starts, counts):
+    """Return the concatenation of the ranges starts[i]..starts[i]+counts[i]-1"""
+    total = int(counts.sum())
+    # start of its range plus the offset within its range
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+
+def gather_nbrs(indptr, indices, agents):
+    """Return the concatenated neighbors of all given agents"""
+    starts = indptr[agents]
+    counts = indptr[agents + 1] - starts
+    if counts.sum() == 0:
+        return np.empty(0, dtype=indices.dtype)
+    return indices[concat_ranges(starts, counts)]
+
+
+def entries_roles(entries, num_ids):
+    """Return the role bitmask of every agent id, given the arrays of the agents with an entry by edge type"""
+    roles = np.zeros(num_ids, dtype=np.uint8)
+    for edge_type, agents in entries.items():
+        roles[agents] |= EDGE_TYPE_ROLES[edge_type]
+    roles[(roles & (ROLE_SCHOOL_STANDARD | ROLE_SCHOOL_SPLIT_0 | ROLE_SCHOOL_SPLIT_1)) != 0] |= ROLE_CHILD
+    return roles
+
+
+def nbrs_roles(nbrs_dicts, num_ids):
+    """Return the role bitmask of every agent id, given the neighbor dicts by edge type"""
+    return entries_roles({edge_type: np.fromiter(nbrs_dict.keys(), dtype=np.int64, count=len(nbrs_dict))
+                          for edge_type, nbrs_dict in nbrs_dicts.items()}, num_ids)
+
+
+def nbrs_to_csr(nbrs_dict, num_ids):
+    """Convert a dict of neighbor sets to CSR arrays (indptr, indices) over the ids 0..num_ids-1, with every row sorted"""
+    agents = np.fromiter(nbrs_dict.keys(), dtype=np.int64, count=len(nbrs_dict))
+    degrees = np.fromiter((len(nbrs) for nbrs in nbrs_dict.values()), dtype=np.int64, count=len(nbrs_dict))
+    dict_indptr = np.zeros(len(nbrs_dict) + 1, dtype=np.int64)
+    np.cumsum(degrees, out=dict_indptr[1:])
+    dict_indices = np.fromiter(itertools.chain.from_iterable(nbrs_dict.values()), dtype=np.int32, count=dict_indptr[-1])
+
+    # rows are in dict order, reorder them by agent id
+    counts = np.zeros(num_ids, dtype=np.int64)
+    counts[agents] = degrees
+    indptr = np.zeros(num_ids + 1, dtype=np.int32)
+    np.cumsum(counts, out=indptr[1:])
+    indices = gather_nbrs(dict_indptr, dict_indices, np.argsort(agents, kind='stable'))
+    # sort the neighbors within every row, such that the rows do not depend on the iteration order of the neighbor sets
+    indices = indices[np.lexsort((indices, np.repeat(np.arange(num_ids), counts)))]
+    return indptr, indices
+
+
+def edges_to_csr(src, dst, num_ids):
+    """Convert the directed edges src -> dst to CSR arrays (indptr, indices) over the ids 0..num_ids-1, with every row sorted"""
+    indptr = np.zeros(num_ids + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=num_ids), out=indptr[1:])
+    # sorting the combined keys is much faster than a lexsort of (dst, src)
+    keys = np.sort(src.astype(np.int64) * num_ids + dst)
+    return indptr, (keys % num_ids).astype(np.int32)
+
+
+def clique_edges(members, sizes):
+    """Return the edges (src, dst) of consecutive cliques of the given sizes in the members array, without self loops"""
+    sizes = np.asarray(sizes, dtype=np.int64)
+    member_size = np.repeat(sizes, sizes)
+    # every member position is paired with all positions of its clique
+    src = np.repeat(np.arange(len(member_size)), member_size)
+    dst = concat_ranges(np.repeat(np.cumsum(sizes) - sizes, sizes), member_size)
+    other = src != dst
+    return members[src[other]], members[dst[other]]
+
+
+class CSRNbrs(Mapping):
+    """Read-only dict-like view of one edge type of a CSRGraph, such that Epsim can use it in place of a neighbor dict"""
+    def __init__(self, graph, edge_type):
+        self.graph = graph
+        self.indptr = graph.indptr[edge_type]
+        self.indices = graph.indices[edge_type]
+        self.roles = graph.roles
+        self.role = EDGE_TYPE_ROLES[edge_type]
+        self.agents = np.flatnonzero(self.roles & self.role)
+
+
+    def row(self, agent):
+        """Return the neighbors of agent as list, an agent without an entry has an empty row"""
+        return self.indices[self.indptr[agent]:self.indptr[agent + 1]].tolist()
+
+
+    def gather(self, agents):
+        """Return the concatenated neighbors of the given agents (int array), agents without an entry have an empty row"""
+        return gather_nbrs(self.indptr, self.indices, agents)
+
+
+    def __getitem__(self, agent):
+        if agent not in self:
+            raise KeyError(agent)
+        return self.indices[self.indptr[agent]:self.indptr[agent + 1]].tolist()
+
+
+    def __contains__(self, agent):
+        return 0 <= agent < len(self.roles) and bool(self.roles[agent] & self.role)
+
+
+    def __iter__(self):
+        return iter(self.agents.tolist())
+
+
+    def __len__(self):
+        return len(self.agents)
+
+
+class CSRGraph:
+    def __init__(self, indptr, indices, roles):
+        """
+        Neighbor graphs of all edge types in CSR format.
+
+        indptr  -- dict of int32 row pointer arrays of length num_ids+1 per edge type
+        indices -- dict of int32 neighbor arrays per edge type
+        roles   -- uint8 array of role bits per agent id
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.roles = roles
+        self.num_ids = len(roles)
+
+
+    @classmethod
+    def from_nbrs(cls, household_nbrs, school_nbrs_standard, school_nbrs_split, office_nbrs, interhousehold_nbrs):
+        """Create a CSRGraph from the neighbor dicts of EpsimGraph"""
+        nbrs_dicts = {
+            'household': household_nbrs,
+            'school_standard': school_nbrs_standard,
+            'school_split_0': school_nbrs_split[0],
+            'school_split_1': school_nbrs_split[1],
+            'office': office_nbrs,
+            'interhousehold': interhousehold_nbrs
+        }
+        num_ids = max(household_nbrs.keys()) + 1
+        roles = nbrs_roles(nbrs_dicts, num_ids)
+
+        indptr = {}
+        indices = {}
+        for edge_type, nbrs_dict in nbrs_dicts.items():
+            indptr[edge_type], indices[edge_type] = nbrs_to_csr(nbrs_dict, num_ids)
+        return cls(indptr, indices, roles)
+
+
+    def csr(self, edge_type):
+        return self.indptr[edge_type], self.indices[edge_type]
+
+
+    def nbrs(self, edge_type):
+        """Return a dict-like view of the neighbors of the given edge type"""
+        return CSRNbrs(self, edge_type)
+
+
+    def gather_nbrs(self, edge_type, agents):
+        return gather_nbrs(self.indptr[edge_type], self.indices[edge_type], agents)
+
+
+    def agents_with_role(self, role):
+        return np.flatnonzero(self.roles & role)
+
+
+    def nbytes(self):
+        return self.roles.nbytes + sum(a.nbytes for a in self.indptr.values()) + sum(a.nbytes for a in self.indices.values())
+
+
+    def save(self, path):
+        """
+        Write the graph to a binary graph file (see array_file.py) with the arrays roles, indptr_<edge type> and
+        indices_<edge type>, all edge types incl. interhousehold are written.
+        """
+        arrays = {'roles': self.roles}
+        for edge_type in EDGE_TYPES:
+            arrays['indptr_' + edge_type] = self.indptr[edge_type]
+            arrays['indices_' + edge_type] = self.indices[edge_type]
+        write_array_file(path, GRAPH_FILE_MAGIC, GRAPH_FILE_VERSION, arrays, {'num_ids': self.num_ids, 'edge_types': EDGE_TYPES})
+
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a graph file written by save().
+        mmap -- map the file read-only into memory instead of reading it, the arrays are views into the mapped file
+        """
+        arrays, meta = read_array_file(path, GRAPH_FILE_MAGIC, GRAPH_FILE_VERSION, mmap)
+        return cls({edge_type: arrays['indptr_' + edge_type] for edge_type in meta['edge_types']},
+                   {edge_type: arrays['indices_' + edge_type] for edge_type in meta['edge_types']}, arrays['roles'])
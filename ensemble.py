@@ -0,0 +1,107 @@
+# Monte Carlo ensembles: run many replicates of EpsimVec.run_sim for many parameter combinations in a process pool.
+# The prepared world (graph, households and locations) is placed in shared memory once and every worker attaches to it read-only,
+# instead of pickling the world or regenerating it per run.
+
+import os
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from epsim_vec import EpsimVec
+
+
+class SharedWorld:
+    def __init__(self, sim):
+        """
+        Copy the world arrays of a prepared EpsimVec into shared memory blocks.
+        Use as context manager or call close() to free the shared memory.
+        """
+        self.loc_types = sim.location_table.loc_types
+        self.shms = []
+        self.spec = {}  # array name -> (shared memory name, shape, dtype)
+        for name, array in sim.world_arrays().items():
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            self.shms.append(shm)
+            self.spec[name] = (shm.name, array.shape, array.dtype.str)
+
+
+    def close(self):
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_world(spec, loc_types):
+    """Attach to the shared memory blocks of a SharedWorld and create a simulation on top of them without copying"""
+    shms = []
+    arrays = {}
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        shms.append(shm)
+        arrays[name] = array
+    sim = EpsimVec.from_world_arrays(arrays, loc_types)
+    sim.shms = shms  # keep the shared memory blocks mapped as long as the simulation lives
+    return sim
+
+
+# simulation of the worker process, created once by the pool initializer
+worker_sim = None
+worker_print_output = False
+
+
+def init_worker(spec, loc_types, print_output):
+    global worker_sim, worker_print_output
+    worker_sim = attach_world(spec, loc_types)
+    worker_print_output = print_output
+
+
+def run_job(job):
+    i, run, sim_params = job
+    if worker_print_output:
+        info_per_rnd = worker_sim.run_sim(**sim_params)
+    else:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            info_per_rnd = worker_sim.run_sim(**sim_params)
+    return i, run, info_per_rnd
+
+
+def run_ensemble(sim, param_combis, num_runs, num_processes=None, print_output=False, seed=None):
+    """
+    Run num_runs replicates for every parameter combination in a process pool and yield (i, run, info_per_rnd) as soon as a run
+    finishes, where i is the index of the parameter combination in param_combis.
+
+    sim            -- prepared EpsimVec (graph and, if locations are simulated, read_building_csv), shared by all runs
+    param_combis   -- list of dicts with the keyword arguments of run_sim
+    num_runs       -- number of replicates per parameter combination
+    num_processes  -- number of worker processes, default: number of cpus
+    print_output   -- print the output of run_sim in the workers
+    seed           -- seed of the ensemble, None: random. Run number r of every parameter combination gets the seed (seed, r),
+                      so the results are deterministic regardless of the scheduling and the parameter combinations are compared
+                      with common random numbers. A 'seed' in the parameters of a combination takes precedence.
+    """
+    jobs = [(i, run, sim_params if seed is None else dict({'seed': [seed, run]}, **sim_params))
+            for i, sim_params in enumerate(param_combis) for run in range(num_runs)]
+    with SharedWorld(sim) as world:
+        with multiprocessing.Pool(num_processes, initializer=init_worker, initargs=(world.spec, world.loc_types, print_output)) as pool:
+            for result in pool.imap_unordered(run_job, jobs):
+                yield result
+
+
+def run_ensemble_per_param_combi(sim, param_combis, num_runs, num_processes=None, print_output=False, seed=None):
+    """Run an ensemble like run_ensemble and return the list of runs per parameter combination, in the order of param_combis"""
+    runs = [[None] * num_runs for i in range(len(param_combis))]
+    for i, run, info_per_rnd in run_ensemble(sim, param_combis, num_runs, num_processes, print_output, seed):
+        runs[i][run] = info_per_rnd
+    return runs
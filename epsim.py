@@ -4,7 +4,11 @@
 import sys
 import random
 import math
+import numpy as np
 from pathlib import Path
+from csrgraph import CSRGraph, CSRNbrs, nbrs_roles, gather_nbrs, ROLE_CHILD, ROLE_ADULT, ROLE_SCHOOL_STANDARD
+from checkpoint import Checkpoint, make_prefix
+from rng_streams import RNGStreams, make_streams
 
 
 def chunks(lst, n):
@@ -21,6 +25,23 @@ def tuple2dict(tpl, nestings):
     return dct
 
 
+def value_at_round(rnd_dict, rnd):
+    """Return the value of a round dependent parameter dict (round -> value) that is valid in round rnd"""
+    return rnd_dict[max(r for r in rnd_dict if r <= rnd)]
+
+
+def sorted_nbrs(nbrs_dict):
+    """Return a copy of a neighbor dict with the agents and the neighbors of every agent in sorted order"""
+    return {agent: sorted(nbrs_dict[agent]) for agent in sorted(nbrs_dict)}
+
+
+def ids_mask(ids, num_ids):
+    """Return a boolean mask over the ids 0..num_ids-1 which is True for the given collection of ids"""
+    mask = np.zeros(num_ids, dtype=bool)
+    mask[np.fromiter(ids, dtype=np.int64, count=len(ids))] = True
+    return mask
+
+
 class Location:
     def __init__(self, loc_type, tag, x, y, sqm):
         self.loc_type = loc_type
@@ -28,90 +49,400 @@ class Location:
         self.x = x
         self.y = y
         self.sqm = sqm
-        self.infec_minutes = 0
-        self.visits = []
+        self.idx = None  # index in the LocationTable
 
 
-    def register_visit(self, e, agent_id):
-        visit_time = e.avg_visit_times[self.loc_type]
-        visit_prob = e.need_minutes[self.loc_type] / (visit_time * 7)  # minutes per week / (average visit time * days in the week)
+class LocationTable:
+    def __init__(self, locations):
+        """
+        Struct of arrays of all locations, with the locations of each location type stored consecutively.
+        Visits are recorded as flat (agent, location) index arrays and the infections of all locations are computed at once.
 
-        if random.random() < visit_prob:
-            if agent_id in e.quarantined.keys():
-                return
-            if agent_id in e.agents_in_state[0]:
-                self.visits.append((agent_id, visit_time))
-                return
-            infectious_agent = False
-            for s in e.states_infectious:
-                infectious_agent |= agent_id in e.agents_in_state[s]
-            if infectious_agent:
-                self.infec_minutes += visit_time
-                return
+        locations -- dict of Location lists per location type, the Location.idx of every location is set to its table index
+        """
+        self.loc_types = list(locations.keys())
+        locs = [loc for loc_type in self.loc_types for loc in locations[loc_type]]
+        for idx, loc in enumerate(locs):
+            loc.idx = idx
+        self.num_locs = len(locs)
+        self.type = np.array([self.loc_types.index(loc.loc_type) for loc in locs], dtype=np.int8)
+        self.sqm = np.array([loc.sqm for loc in locs], dtype=np.float64)
+        self.rate = np.zeros(self.num_locs)  # infection rate per visited minute and infectious minute
+        self.infec_minutes = np.zeros(self.num_locs)
+        self.visit_agents = []
+        self.visit_locs = []
+        self.visit_minutes = []
+
+
+    @classmethod
+    def from_arrays(cls, loc_types, loc_type, sqm):
+        """Create a LocationTable from the location type index and sqm arrays of another LocationTable"""
+        table = cls({})
+        table.loc_types = list(loc_types)
+        table.num_locs = len(sqm)
+        table.type = loc_type
+        table.sqm = sqm
+        table.rate = np.zeros(table.num_locs)
+        table.infec_minutes = np.zeros(table.num_locs)
+        return table
+
+
+    def set_rates(self, loc_infec_rate, contact_mult):
+        # loc_infec_rate: infection rate for 1 infectious person, and 1 susceptible person within 13sqm for 8h
+        minutes_opened = 12*60
+        type_contact_mult = np.array([contact_mult[loc_type] for loc_type in self.loc_types], dtype=np.float64)
+        self.rate = type_contact_mult[self.type] * (loc_infec_rate / (8*60/13)) * (1.0 / minutes_opened) / self.sqm
 
 
-    def spread(self, e):
-        minutes_opened = 12*60
+    def clear_visits(self):
+        self.visit_agents = []
+        self.visit_locs = []
+        self.visit_minutes = []
+        self.infec_minutes[:] = 0
 
-        # e.loc_infec_rate: infection rate for 1 infectious person, and 1 susceptible person within 13sqm for 8h
-        # "1.0" is a place holder for visit[1] (visited minutes)
-        base_rate = e.contact_mult[self.loc_type] * (e.loc_infec_rate / (8*60/13)) * (1.0 / minutes_opened) * (self.infec_minutes / self.sqm)
 
-        infected_agents = set()
-        for visit in self.visits:
-            agent = visit[0]
-            if agent in e.agents_in_state[0]:
-                infec_prob = visit[1] * base_rate
-                if random.random() < infec_prob:
-                    e.agents_in_state[0].remove(agent)
-                    infected_agents.add(agent)
-        
-        # clear for next round
-        self.visits = []
-        self.infec_minutes = 0
+    def register_visits(self, agents, locs, minutes):
+        """Register visits of susceptible agents"""
+        self.visit_agents.append(np.asarray(agents, dtype=np.int64))
+        self.visit_locs.append(np.asarray(locs, dtype=np.int64))
+        self.visit_minutes.append(np.asarray(minutes, dtype=np.float64))
 
-        return infected_agents
+
+    def register_infectious_visits(self, locs, minutes):
+        self.infec_minutes += np.bincount(locs, weights=minutes, minlength=self.num_locs)
+
+
+    def spread(self, rng):
+        """
+        Spread the infection from the registered infectious minutes to the registered susceptible visits and clear all visits.
+        Return a dict with the array of infected agents per location type.
+        """
+        agents = np.concatenate(self.visit_agents) if self.visit_agents else np.empty(0, dtype=np.int64)
+        locs = np.concatenate(self.visit_locs) if self.visit_locs else np.empty(0, dtype=np.int64)
+        minutes = np.concatenate(self.visit_minutes) if self.visit_minutes else np.empty(0)
+
+        infec_prob = minutes * self.rate[locs] * self.infec_minutes[locs]
+        infected = rng.random(len(agents)) < infec_prob
+        agents = agents[infected]
+        types = self.type[locs[infected]]
+
+        # every agent visits at most one location per type, an agent infected in several location types counts for the first type
+        order = np.argsort(types, kind='stable')
+        agents, types = agents[order], types[order]
+        _, first = np.unique(agents, return_index=True)
+        agents, types = agents[first], types[first]
+
+        self.clear_visits()  # clear for next round
+
+        return {loc_type: agents[types == t] for t, loc_type in enumerate(self.loc_types)}
 
 
 class Epsim:
-    def __init__(self, household_nbrs, school_nbrs_standard, school_nbrs_split, office_nbrs, interhousehold_nbrs):
+    def __init__(self, household_nbrs, school_nbrs_standard=None, school_nbrs_split=None, office_nbrs=None, interhousehold_nbrs=None):
+        """
+        household_nbrs -- dict of household neighbors per agent or a CSRGraph, which contains the neighbors of all types.
+                          When a CSRGraph is given, the other neighbor arguments are omitted. CSRNbrs views (e.g. of
+                          EpsimGraph(..., vectorized=True)) are taken as the CSRGraph they belong to.
+        """
+        if isinstance(household_nbrs, CSRNbrs):
+            household_nbrs = household_nbrs.graph
         self.agents_in_state = []
-        self.household_nbrs = household_nbrs
-        self.school_nbrs_standard = school_nbrs_standard
-        self.school_nbrs_split = school_nbrs_split
-        self.office_nbrs = office_nbrs
-        self.interhousehold_nbrs = interhousehold_nbrs
+        if isinstance(household_nbrs, CSRGraph):
+            self.csr_graph = household_nbrs
+            self.household_nbrs = self.csr_graph.nbrs('household')
+            self.school_nbrs_standard = self.csr_graph.nbrs('school_standard')
+            self.school_nbrs_split = [self.csr_graph.nbrs('school_split_0'), self.csr_graph.nbrs('school_split_1')]
+            self.office_nbrs = self.csr_graph.nbrs('office')
+            self.interhousehold_nbrs = self.csr_graph.nbrs('interhousehold')
+        else:
+            # neighbors are sorted once, such that the random draws of a run do not depend on the order of the neighbor sets
+            self.csr_graph = None
+            self.household_nbrs = sorted_nbrs(household_nbrs)
+            self.school_nbrs_standard = sorted_nbrs(school_nbrs_standard)
+            self.school_nbrs_split = [sorted_nbrs(nbrs_dict) for nbrs_dict in school_nbrs_split]
+            self.office_nbrs = sorted_nbrs(office_nbrs)
+            self.interhousehold_nbrs = sorted_nbrs(interhousehold_nbrs)
+        self.interhousehold_agents = sorted(self.interhousehold_nbrs.keys())  # agents that may visit their relatives
         self.households = self.determine_clusters(self.household_nbrs)
         print(f"household_nbrs: {len(self.household_nbrs)}, school_nbrs_standard: {len(self.school_nbrs_standard)}, " \
               + f"school_nbrs_split: {len(self.school_nbrs_split[0])} {len(self.school_nbrs_split[1])}, "\
               + f"office_nbrs: {len(self.office_nbrs)}, households: {len(self.households)}")
         self.locations = {'supermarket': [], 'shop': [], 'restaurant': [], 'leisure': [], 'nightlife': []}  # locations of location type
+        self.location_table = LocationTable(self.locations)
         self.house_households = []  # households of houses
         self.house_visit_locs = []  # visit locations of location type of house
+        self.house_visit_loc_idx = {}  # LocationTable indices of the visit locations of every house per location type (houses x k)
+        self.visit_agents = np.empty(0, dtype=np.int64)  # agents living in a house
+        self.visit_agent_house = np.empty(0, dtype=np.int64)  # house of every agent in visit_agents
+        self.num_ids = max(self.household_nbrs.keys()) + 1  # agent ids are not necessarily continuous
+        if self.csr_graph is not None:
+            self.roles = self.csr_graph.roles
+        else:
+            self.roles = nbrs_roles({'household': self.household_nbrs, 'school_standard': self.school_nbrs_standard,
+                                     'school_split_0': self.school_nbrs_split[0], 'school_split_1': self.school_nbrs_split[1],
+                                     'office': self.office_nbrs, 'interhousehold': self.interhousehold_nbrs}, self.num_ids)
+        self.streams = RNGStreams()  # random number streams of the current run, see run_sim(seed=...)
+        self.profiler = None  # PhaseProfiler of the current run, see run_sim(profiler=...)
+        self.lazy_locations = False  # see run_sim(lazy_locations=...)
+        self.lazy_max_reachable = 0.25  # spread_locations_lazy draws all visits of a type if more houses may reach an infectious location
+
+
+    @classmethod
+    def from_graph_file(cls, path, mmap=True):
+        """
+        Create the simulation from a graph file written by EpsimGraph.write_graph_file() or CSRGraph.save().
+        mmap -- map the graph read-only into memory, processes loading the same file share its pages
+        """
+        return cls(CSRGraph.load(path, mmap))
 
 
-    def spread(self, nbrs_dict, infectious_agents, prob):
+    # The random draws are made in the order of the sorted agent ids and their sorted neighbors, since the iteration order of a set
+    # depends on how it was built (e.g. a world loaded from the cache), such that the same seed gives the same run.
+
+    def infectious_nbrs(self, nbrs_dict, infectious_agents):
+        """Return the list of the neighbors of all infectious agents, in the order of the sorted infectious agents"""
+        if isinstance(nbrs_dict, CSRNbrs):
+            if len(infectious_agents) < 20:
+                # the array operations of gather have a fixed overhead, a few rows are sliced one by one
+                return [nbr for agent in sorted(infectious_agents) for nbr in nbrs_dict.row(agent)]
+            # whole array access to the CSR graph, instead of one row lookup per agent
+            agents = np.fromiter(infectious_agents, dtype=np.int64, count=len(infectious_agents))
+            return nbrs_dict.gather(np.sort(agents)).tolist()
+        return [nbr for agent in sorted(infectious_agents) if agent in nbrs_dict for nbr in nbrs_dict[agent]]
+
+
+    def spread(self, nbrs_dict, infectious_agents, prob, rng=random):
+        if self.profiler is not None:
+            return self.spread_profiled(nbrs_dict, infectious_agents, prob, rng)
         infected_agents = set()
-        for infectious_agent in infectious_agents:
-            if infectious_agent in nbrs_dict:
-                for nbr in nbrs_dict[infectious_agent]:
-                    if nbr in self.agents_in_state[0]:
-                        if random.random() < prob:
-                            self.agents_in_state[0].remove(nbr)
-                            infected_agents.add(nbr)
+        susceptible_agents = self.agents_in_state[0]
+        for nbr in self.infectious_nbrs(nbrs_dict, infectious_agents):
+            if nbr in susceptible_agents:
+                if rng.random() < prob:
+                    susceptible_agents.remove(nbr)
+                    infected_agents.add(nbr)
         return infected_agents
 
 
-    def test_agents(self, agents, prob):
-        return {agent for agent in agents if random.random() < prob}
+    def spread_profiled(self, nbrs_dict, infectious_agents, prob, rng):
+        # spread with the work counters of the profiler, kept apart such that the loop of spread has no overhead without profiler
+        infected_agents = set()
+        susceptible_agents = self.agents_in_state[0]
+        nbrs = self.infectious_nbrs(nbrs_dict, infectious_agents)
+        num_draws = 0
+        for nbr in nbrs:
+            if nbr in susceptible_agents:
+                num_draws += 1
+                if rng.random() < prob:
+                    susceptible_agents.remove(nbr)
+                    infected_agents.add(nbr)
+        self.profiler.count('edges_examined', len(nbrs))
+        self.profiler.count('random_draws', num_draws)
+        return infected_agents
+
+
+    def test_agents(self, agents, prob, rng=random):
+        if self.profiler is not None:
+            self.profiler.count('random_draws', len(agents))
+        return {agent for agent in sorted(agents) if rng.random() < prob}
+
+
+    def detect_agents(self, agents, prob, rng=random):
+        if self.profiler is not None:
+            self.profiler.count('random_draws', len(agents))
+        return {agent for agent in sorted(agents) if rng.random() < prob}
 
 
-    def detect_agents(self, agents, prob):
-        return {agent for agent in agents if random.random() < prob}
+    def draw_type_visits(self, loc_type, rows, rng):
+        """
+        Draw the visits of the agents visit_agents[rows] (None: all) to the locations of one type for one round: with the
+        probability given by its needed minutes, every agent visits one of the favourite locations of its house.
+        Return flat arrays of the visiting agents, the visited locations and the visit minutes.
+        """
+        house_visit_loc_idx = self.house_visit_loc_idx[loc_type]
+        visit_time = self.avg_visit_times[loc_type]
+        visit_prob = self.need_minutes[loc_type] / (visit_time * 7)  # minutes per week / (average visit time * days in the week)
+        num_agents = len(self.visit_agents) if rows is None else len(rows)
+        visiting = rng.random(num_agents) < visit_prob
+        visiting_rows = np.flatnonzero(visiting) if rows is None else rows[visiting]
+        # pick random location from favourite locations
+        choice = rng.integers(house_visit_loc_idx.shape[1], size=len(visiting_rows))
+        if self.profiler is not None:
+            self.profiler.count('random_draws', num_agents + len(choice))
+        return (self.visit_agents[visiting_rows], house_visit_loc_idx[self.visit_agent_house[visiting_rows], choice],
+                np.full(len(choice), visit_time, dtype=np.float64))
+
+
+    def draw_visits(self):
+        """
+        Draw the visits of all agents for one round, see draw_type_visits.
+        Return flat arrays of the visiting agents, the visited locations and the visit minutes.
+        """
+        visit_agents = []
+        visit_locs = []
+        visit_minutes = []
+        rng = self.streams.numpy('locations')
+        for loc_type in self.house_visit_loc_idx:
+            agents, locs, minutes = self.draw_type_visits(loc_type, None, rng)
+            visit_agents.append(agents)
+            visit_locs.append(locs)
+            visit_minutes.append(minutes)
+        if not visit_agents:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(visit_agents), np.concatenate(visit_locs), np.concatenate(visit_minutes)
+
+
+    def init_visit_index(self):
+        """
+        Index the favourite locations of the houses for lazy_locations: the houses with location l among their favourite
+        locations are loc_houses[1][loc_houses[0][l]:loc_houses[0][l+1]], the rows of visit_agents living in house h are
+        house_rows[1][house_rows[0][h]:house_rows[0][h+1]] and agent_row holds the row of every agent id (-1: no house).
+        """
+        num_houses = max([len(idx) for idx in self.house_visit_loc_idx.values()] + [1])
+        locs = np.concatenate([idx.ravel() for idx in self.house_visit_loc_idx.values()] + [np.empty(0, dtype=np.int64)])
+        houses = np.concatenate([np.repeat(np.arange(len(idx)), idx.shape[1]) for idx in self.house_visit_loc_idx.values()]
+                                + [np.empty(0, dtype=np.int64)])
+        pairs = np.unique(locs.astype(np.int64) * num_houses + houses)  # distinct (location, house) pairs, sorted by location
+        loc_indptr = np.zeros(self.location_table.num_locs + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs // num_houses, minlength=self.location_table.num_locs), out=loc_indptr[1:])
+        self.loc_houses = (loc_indptr, pairs % num_houses)
+        self.loc_num_houses = np.diff(loc_indptr)
+
+        house_indptr = np.zeros(num_houses + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.visit_agent_house, minlength=num_houses), out=house_indptr[1:])
+        self.house_rows = (house_indptr, np.argsort(self.visit_agent_house, kind='stable'))
+        self.agent_row = np.full(self.num_ids, -1, dtype=np.int64)
+        self.agent_row[self.visit_agents] = np.arange(len(self.visit_agents))
+        # masks of spread_locations_lazy to collect distinct houses and rows, they are all False between the calls
+        self.house_mask = np.zeros(num_houses, dtype=bool)
+        self.row_mask = np.zeros(len(self.visit_agents), dtype=bool)
+
+
+    def spread_locations_lazy(self, infectious_agents, is_susceptible):
+        """
+        Draw only the visits that can cause or receive an infection and spread the infection within the locations.
+        First the visits of the infectious agents are drawn, then the visits of the susceptible agents of the houses that have a
+        location with infectious minutes among their favourite locations. All other susceptible agents can only visit locations
+        without infectious minutes, where the infection probability is 0, so the infections are distributed as with draw_visits.
+        When the infectious locations of a type are favourite locations of more than lazy_max_reachable of the houses (counted
+        with repetition), the visits of all susceptible agents to that type are drawn, as finding the houses would cost more.
+        Only the visits of locations with infectious minutes are registered in either case.
+        infectious_agents -- array of the non-quarantined infectious agents
+        is_susceptible    -- function that returns a boolean mask of the given agents, which are non-quarantined and susceptible
+        Return a dict with the array of infected agents per location type.
+        """
+        rng = self.streams.numpy('locations')
+        table = self.location_table
+        rows = self.agent_row[infectious_agents]
+        rows = rows[rows >= 0]
+        num_visits = 0
+        for loc_type in self.house_visit_loc_idx:
+            _, locs, minutes = self.draw_type_visits(loc_type, rows, rng)
+            table.register_infectious_visits(locs, minutes)
+            num_visits += len(locs)
+
+        # rows of the agents of the houses with a location with infectious minutes per type, checked for susceptibility at once,
+        # None: all rows, since many houses reach an infectious location and gathering them would cost more than drawing all visits
+        infectious_locs = np.flatnonzero(table.infec_minutes > 0)
+        type_rows = []
+        for loc_type in self.house_visit_loc_idx:
+            type_locs = infectious_locs[table.type[infectious_locs] == table.loc_types.index(loc_type)]
+            if self.loc_num_houses[type_locs].sum() > self.lazy_max_reachable * len(self.house_mask):
+                type_rows.append(None)
+                continue
+            houses = gather_nbrs(*self.loc_houses, type_locs)
+            self.house_mask[houses] = True
+            houses = np.flatnonzero(self.house_mask)
+            self.house_mask[houses] = False
+            type_rows.append(gather_nbrs(*self.house_rows, houses))
+        if any(rows is None for rows in type_rows):
+            rows = np.arange(len(self.visit_agents))
+        else:
+            for rows in type_rows:
+                self.row_mask[rows] = True
+            rows = np.flatnonzero(self.row_mask)
+            self.row_mask[rows] = False
+        susceptible = np.zeros(len(self.visit_agents), dtype=bool)
+        susceptible[rows] = is_susceptible(self.visit_agents[rows])
+
+        num_susceptible = 0
+        for loc_type, rows in zip(self.house_visit_loc_idx, type_rows):
+            rows = np.flatnonzero(susceptible) if rows is None else rows[susceptible[rows]]
+            agents, locs, minutes = self.draw_type_visits(loc_type, rows, rng)
+            infecting = table.infec_minutes[locs] > 0  # visits of other locations cannot infect
+            table.register_visits(agents[infecting], locs[infecting], minutes[infecting])
+            num_susceptible += np.count_nonzero(infecting)
+        if self.profiler is not None:
+            self.profiler.count('visits_registered', num_susceptible + num_visits)
+            self.profiler.enter('location_spread')
+            self.profiler.count('random_draws', num_susceptible)
+        return table.spread(rng)
+
+
+    def spread_locations(self, quarantined):
+        """
+        Register visits of all agents at their favourite locations and spread the infection within the locations.
+        With lazy_locations only the visits that can matter are drawn, see spread_locations_lazy.
+        quarantined -- boolean mask over the agent ids of the quarantined agents
+        """
+        if self.lazy_locations:
+            susceptible_agents = self.agents_in_state[0]
+            infectious_agents = np.sort(np.fromiter(self.infectious_agents, dtype=np.int64, count=len(self.infectious_agents)))
+            def is_susceptible(agents):
+                if len(agents) < len(susceptible_agents) // 4:  # a few agents are looked up in the set, else a mask over all ids
+                    return np.array([agent in susceptible_agents for agent in agents.tolist()], dtype=bool) & ~quarantined[agents]
+                return ids_mask(susceptible_agents, self.num_ids)[agents] & ~quarantined[agents]
+            infected = self.spread_locations_lazy(infectious_agents[~quarantined[infectious_agents]], is_susceptible)
+        else:
+            visit_agents, visit_locs, visit_minutes = self.draw_visits()
+            visit_quarantined = quarantined[visit_agents]
+            susceptible = ids_mask(self.agents_in_state[0], self.num_ids)[visit_agents] & ~visit_quarantined
+            infectious = ids_mask(self.infectious_agents, self.num_ids)[visit_agents] & ~visit_quarantined  # non-quarantined infectious agents
+            self.location_table.register_visits(visit_agents[susceptible], visit_locs[susceptible], visit_minutes[susceptible])
+            self.location_table.register_infectious_visits(visit_locs[infectious], visit_minutes[infectious])
+            if self.profiler is not None:
+                num_susceptible = np.count_nonzero(susceptible)
+                self.profiler.count('visits_registered', num_susceptible + np.count_nonzero(infectious))
+                self.profiler.enter('location_spread')
+                self.profiler.count('random_draws', num_susceptible)
+            infected = self.location_table.spread(self.streams.numpy('locations'))
+
+        infected_in_location = {}
+        for loc_type, infected_agents in infected.items():
+            infected_in_location[loc_type] = set(infected_agents.tolist())
+            self.agents_in_state[0] -= infected_in_location[loc_type]
+        return infected_in_location
+
+
+    def reset_quarantine(self):
+        # quarantine is tracked as agent -> round of admission, with the agents additionally bucketed by their release round modulo 10
+        # (release-day buckets), such that admissions and releases only touch the changed agents
+        self.quarantined = {}
+        self.quarantine_buckets = [set() for i in range(10)]
+        self.is_quarantined = np.zeros(self.num_ids, dtype=bool)
+
+
+    def release_quarantined(self, rnd):
+        """Release the agents in quarantine for 10 rounds, i.e. the agents admitted in round rnd - 10"""
+        bucket = self.quarantine_buckets[rnd % 10]
+        for agent in bucket:
+            del self.quarantined[agent]
+        self.is_quarantined[np.fromiter(bucket, dtype=np.int64, count=len(bucket))] = False
+        bucket.clear()
 
 
-    def quarantine_agent(self, agent):
-        self.quarantined[agent] = 0
+    def admit_quarantine(self, agent, rnd):
+        """Record the admission of agent in round rnd, without touching the infectious sets of the round"""
+        if agent in self.quarantined:
+            # quarantine starts again, the agent moves to the bucket of its new release round
+            self.quarantine_buckets[self.quarantined[agent] % 10].discard(agent)
+        self.quarantined[agent] = rnd
+        self.quarantine_buckets[rnd % 10].add(agent)
+        self.is_quarantined[agent] = True
+
+
+    def quarantine_agent(self, agent, rnd):
+        self.admit_quarantine(agent, rnd)
         self.infectious_agents.discard(agent)
         self.infectious_adult_agents.discard(agent)
         self.infectious_child_agents.discard(agent)
@@ -120,14 +451,16 @@ class Epsim:
         self.infectious_interhousehold_adult_agents.discard(agent)
 
 
-    def quarantine_agents_with_household(self, agents):
+    def quarantine_agents_with_household(self, agents, rnd):
         quarantined_agents = set()
         for agent in agents:
-            self.quarantine_agent(agent)
+            self.quarantine_agent(agent, rnd)
             quarantined_agents.add(agent)
             for nbr in self.household_nbrs[agent]:
-                self.quarantine_agent(nbr)
+                self.quarantine_agent(nbr, rnd)
                 quarantined_agents.add(nbr)
+        if self.profiler is not None:
+            self.profiler.count('agents_quarantined', len(quarantined_agents))
         return quarantined_agents
 
     
@@ -142,16 +475,67 @@ class Epsim:
 
     
     def is_adult_agent(self, agent):
-        return agent in self.office_nbrs
+        return bool(self.roles[agent] & ROLE_ADULT)
 
 
     def is_child_agent(self, agent):
-        return agent in self.school_nbrs_standard or agent in self.school_nbrs_split[0] or agent in self.school_nbrs_split[1]
+        return bool(self.roles[agent] & ROLE_CHILD)
+
+
+    def select_role(self, agents, role):
+        """Return the set of the given agents that have the role bit"""
+        agents = np.fromiter(agents, dtype=np.int64, count=len(agents))
+        return set(agents[(self.roles[agents] & role) != 0].tolist())
+
+
+    def init_infectious_sets(self):
+        # infectious agents incl. the quarantined ones and their child, adult and standard class subsets,
+        # maintained by update_infectious_sets as the agents change their state
+        self.all_infectious = set().union(*(self.agents_in_state[s] for s in self.states_infectious))
+        self.all_infectious_children = self.select_role(self.all_infectious, ROLE_CHILD)
+        self.all_infectious_adults = self.select_role(self.all_infectious, ROLE_ADULT)
+        self.all_infectious_children_standard = self.select_role(self.all_infectious_children, ROLE_SCHOOL_STANDARD)
+
+
+    def update_infectious_sets(self, entering, leaving):
+        """Add the agents which became infectious and remove the ones which are not infectious anymore"""
+        for infectious_set in (self.all_infectious, self.all_infectious_children, self.all_infectious_adults,
+                               self.all_infectious_children_standard):
+            infectious_set -= leaving
+        self.all_infectious |= entering
+        entering_children = self.select_role(entering, ROLE_CHILD)
+        self.all_infectious_children |= entering_children
+        self.all_infectious_adults |= self.select_role(entering, ROLE_ADULT)
+        self.all_infectious_children_standard |= self.select_role(entering_children, ROLE_SCHOOL_STANDARD)
+
+
+    def make_checkpoint(self, rnd, info_per_rnd):
+        """Return a Checkpoint of the run at the beginning of round rnd"""
+        state = np.full(self.num_ids, self.num_agent_states - 1, dtype=np.uint8)
+        for s, agents in enumerate(self.agents_in_state):
+            state[np.fromiter(agents, dtype=np.int64, count=len(agents))] = s
+        quarantine_counter = np.full(self.num_ids, -1, dtype=np.int8)
+        quarantine_counter[list(self.quarantined.keys())] = [rnd - admission_rnd for admission_rnd in self.quarantined.values()]
+        return Checkpoint(rnd, self.num_agent_states, state, quarantine_counter, self.streams.get_state(),
+                          make_prefix(info_per_rnd, self.num_agent_states))
+
+
+    def restore_checkpoint(self, checkpoint):
+        """Restore the run state of a Checkpoint and return the info_per_rnd of the rounds before it"""
+        self.agents_in_state = [set(np.flatnonzero(checkpoint.state == s).tolist()) for s in range(self.num_agent_states - 1)]
+        self.reset_quarantine()
+        quarantined_agents = np.flatnonzero(checkpoint.quarantine_counter >= 0)
+        for agent, counter in zip(quarantined_agents.tolist(), checkpoint.quarantine_counter[quarantined_agents].tolist()):
+            self.admit_quarantine(agent, checkpoint.rnd - counter)  # the infectious sets are built when the run starts
+        self.streams.set_state(checkpoint.rng_state)
+        return checkpoint.info_per_rnd()
 
 
     def run_sim(self, sim_iters, num_start_agents, perc_immune_agents, start_weekday, p_spread_household_dict, p_spread_school_dict,
                 p_spread_office_dict, p_detect_child_dict, p_detect_adult_dict, testing_dict, omicron, split_stay_home,
-                loc_infec_rate, avg_visit_times, need_minutes, contact_mult, p_interhh_visit_dict, print_progress=False):
+                loc_infec_rate, avg_visit_times, need_minutes, contact_mult, p_interhh_visit_dict, print_progress=False,
+                recorder=None, checkpoint_rnds=None, resume_from=None, seed=None,
+                profiler=None, lazy_locations=False):
         """
         Run the epidemic simulation with the given parameters.
 
@@ -178,6 +562,18 @@ class Epsim:
         contact_mult            -- infection rate multiplier per location
         p_interhh_visit_dict    -- probability for a person to visit their interhousehold family
         print_progress          -- print simulation statistics every round onto the console
+        recorder                -- optional RunRecorder (recorder.py), which records the per round information into arrays
+        checkpoint_rnds         -- rounds at whose beginning a Checkpoint (checkpoint.py) is taken, stored in self.checkpoints by round
+        resume_from             -- Checkpoint to resume the simulation from, num_start_agents and perc_immune_agents are ignored.
+                                   All other parameters apply from the round of the checkpoint onward, such that resuming one
+                                   checkpoint with different parameters forks the simulation into several scenarios.
+        seed                    -- seed of the random number streams of the run (int or RNGStreams, see rng_streams.py), None: random.
+                                   Runs with the same seed but different parameters use common random numbers.
+        profiler                -- optional PhaseProfiler (profiler.py), which records wall time and work counters per phase and round
+        lazy_locations          -- draw only the location visits of the infectious agents and of the susceptible agents that may visit
+                                   a location with infectious minutes, and register only the visits of locations with infectious
+                                   minutes, which gives statistically the same infections in locations with less work (see
+                                   spread_locations_lazy). The random numbers differ from the full evaluation.
         """
 
         # input conversion
@@ -202,8 +598,16 @@ class Epsim:
         if 0 not in p_interhh_visit_dict: raise ValueError("p_interhh_visit_dict must cointain value for round 0")
         if 0 not in testing_dict: raise ValueError("testing_dict must cointain value for round 0")
 
+        self.streams = make_streams(seed)
+        seeding_rng = self.streams.python('seeding')
+        household_rng = self.streams.python('household')
+        testing_rng = self.streams.python('testing')
+        office_rng = self.streams.python('office')
+        school_rng = self.streams.python('school')
+        interhousehold_rng = self.streams.python('interhousehold')
+
         self.agents_in_state = []
-        self.agents_in_state.append({agent for agent in self.household_nbrs.keys()})
+        self.agents_in_state.append(set(self.household_nbrs))
         n = len(self.agents_in_state[0])
 
         # agent states
@@ -223,48 +627,62 @@ class Epsim:
         self.avg_visit_times = avg_visit_times
         self.need_minutes = need_minutes
         self.contact_mult = contact_mult
-
-        # set immune agents
-        children = list(self.school_nbrs_standard.keys()) + list(self.school_nbrs_split[0].keys()) + list(self.school_nbrs_split[1].keys())
-        adults = list(self.office_nbrs.keys())
-        if isinstance(perc_immune_agents, float):
-            for agent in random.sample(self.agents_in_state[0], int(perc_immune_agents * n)):
-                self.agents_in_state[0].remove(agent)
-        elif isinstance(perc_immune_agents, dict):
-            if 'households' in perc_immune_agents:
-                immune_households = random.sample(self.households, int(perc_immune_agents['households'] * len(self.households)))
-                for cluster in immune_households:
-                    for agent in cluster:
-                        self.agents_in_state[0].remove(agent)
-            if 'adults' in perc_immune_agents:
-                immune_adults = random.sample(adults, int(perc_immune_agents['adults'] * len(adults)))
-                for agent in immune_adults:
+        self.location_table.set_rates(loc_infec_rate, contact_mult)
+        self.location_table.clear_visits()
+        self.lazy_locations = lazy_locations
+        if lazy_locations:
+            self.init_visit_index()
+
+        if resume_from is None:
+            # set immune agents
+            children = list(self.school_nbrs_standard) + list(self.school_nbrs_split[0]) + list(self.school_nbrs_split[1])
+            adults = list(self.office_nbrs)
+            if isinstance(perc_immune_agents, float):
+                for agent in seeding_rng.sample(sorted(self.agents_in_state[0]), int(perc_immune_agents * n)):
                     self.agents_in_state[0].remove(agent)
-            if 'children' in perc_immune_agents:
-                immune_children = random.sample(children, int(perc_immune_agents['children'] * len(children)))
-                for agent in immune_children:
-                    self.agents_in_state[0].remove(agent)
-        else:
-            raise ValueError("perc_immune_agents has wrong format")
+            elif isinstance(perc_immune_agents, dict):
+                if 'households' in perc_immune_agents:
+                    immune_households = seeding_rng.sample(self.households, int(perc_immune_agents['households'] * len(self.households)))
+                    for cluster in immune_households:
+                        for agent in cluster:
+                            self.agents_in_state[0].remove(agent)
+                if 'adults' in perc_immune_agents:
+                    immune_adults = seeding_rng.sample(adults, int(perc_immune_agents['adults'] * len(adults)))
+                    for agent in immune_adults:
+                        self.agents_in_state[0].remove(agent)
+                if 'children' in perc_immune_agents:
+                    immune_children = seeding_rng.sample(children, int(perc_immune_agents['children'] * len(children)))
+                    for agent in immune_children:
+                        self.agents_in_state[0].remove(agent)
+            else:
+                raise ValueError("perc_immune_agents has wrong format")
 
-        num_start_immune = n - len(self.agents_in_state[0])
+            num_start_immune = n - len(self.agents_in_state[0])
         
-        # set starting agents
-        if isinstance(num_start_agents, int):
-            num_start_agents = [int(num_start_agents / (self.num_agent_states - 2))] * (self.num_agent_states - 2)
-        if not isinstance(num_start_agents, list) and len(num_start_agents) != self.num_agent_states - 2:  # w/o suceptible and immune
-            raise ValueError("num_start_agents has wrong format")
-        for s, num_agents in enumerate(num_start_agents, 1):
-            for agent in random.sample(self.agents_in_state[0], num_agents):
-                self.agents_in_state[0].remove(agent)
-                self.agents_in_state[s].add(agent)
-
-        # print simulation info
-        print(f"starting simulation with n={n}, num_start_agents={num_start_agents}, perc_immune_agents={perc_immune_agents}, " \
-              + f"start_weekday={start_weekday}, sim_iters={sim_iters}, " + f"p_spread_household_dict={p_spread_household_dict}, " \
-              + f"p_spread_school_dict={p_spread_school_dict}, p_spread_office={p_spread_office_dict}, " \
-              + f"p_detect_child_dict={p_detect_child_dict}, p_detect_adult_dict={p_detect_adult_dict}, testing_dict={testing_dict}")
-        print(f"start immune: {num_start_immune}")
+            # set starting agents
+            if isinstance(num_start_agents, int):
+                num_start_agents = [int(num_start_agents / (self.num_agent_states - 2))] * (self.num_agent_states - 2)
+            if not isinstance(num_start_agents, list) and len(num_start_agents) != self.num_agent_states - 2:  # w/o suceptible and immune
+                raise ValueError("num_start_agents has wrong format")
+            for s, num_agents in enumerate(num_start_agents, 1):
+                for agent in seeding_rng.sample(sorted(self.agents_in_state[0]), num_agents):
+                    self.agents_in_state[0].remove(agent)
+                    self.agents_in_state[s].add(agent)
+
+            # print simulation info
+            print(f"starting simulation with n={n}, num_start_agents={num_start_agents}, perc_immune_agents={perc_immune_agents}, " \
+                  + f"start_weekday={start_weekday}, sim_iters={sim_iters}, " + f"p_spread_household_dict={p_spread_household_dict}, " \
+                  + f"p_spread_school_dict={p_spread_school_dict}, p_spread_office={p_spread_office_dict}, " \
+                  + f"p_detect_child_dict={p_detect_child_dict}, p_detect_adult_dict={p_detect_adult_dict}, testing_dict={testing_dict}")
+            print(f"start immune: {num_start_immune}, seed: {self.streams.seed}")
+        else:
+            if resume_from.num_agent_states != self.num_agent_states:
+                raise ValueError("resume_from was taken from a simulation with a different omicron setting")
+            info_per_rnd = self.restore_checkpoint(resume_from)
+            print(f"resuming simulation at round {resume_from.rnd} with n={n}, sim_iters={sim_iters}, " \
+                  + f"p_spread_household_dict={p_spread_household_dict}, p_spread_school_dict={p_spread_school_dict}, " \
+                  + f"p_spread_office={p_spread_office_dict}, p_detect_child_dict={p_detect_child_dict}, " \
+                  + f"p_detect_adult_dict={p_detect_adult_dict}, testing_dict={testing_dict}")
 
         if print_progress:
             print("the following information represents the number of agents per round for:")
@@ -272,13 +690,38 @@ class Epsim:
                   "infected_by_children, infected_by_adults, quarantined_by_detection, quarantined_by_test, infected_in_location]")
 
         # initialize simulation variables
+        start_rnd = 0 if resume_from is None else resume_from.rnd
+        if resume_from is None:
+            info_per_rnd = []
+            self.reset_quarantine()
+        if recorder is not None:
+            recorder.start_run(sim_iters, self.num_agent_states)
+            for rnd, info in enumerate(info_per_rnd):
+                recorder.record(rnd, info)
+        self.checkpoints = {}
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.start_run(sim_iters)
+        self.init_infectious_sets()
         num_state_infected_and_immune_per_rnd = []
-        info_per_rnd = []
-        self.quarantined = {}
+
+        # parameter values valid at the start round, they get updated during the simulation
+        p_spread_household = value_at_round(p_spread_household_dict, start_rnd)
+        p_spread_office = value_at_round(p_spread_office_dict, start_rnd)
+        p_spread_school = value_at_round(p_spread_school_dict, start_rnd)
+        p_detect_child = value_at_round(p_detect_child_dict, start_rnd)
+        p_detect_adult = value_at_round(p_detect_adult_dict, start_rnd)
+        testing = value_at_round(testing_dict, start_rnd)
+        p_interhh_visit = value_at_round(p_interhh_visit_dict, start_rnd)
 
         # run simulation
-        for rnd in range(sim_iters):
+        for rnd in range(start_rnd, sim_iters):
             weekday = (rnd + start_weekday) % 7
+            if profiler is not None:
+                profiler.start_round(rnd)
+
+            if checkpoint_rnds is not None and rnd in checkpoint_rnds:
+                self.checkpoints[rnd] = self.make_checkpoint(rnd, info_per_rnd)
 
             if rnd in p_spread_household_dict: p_spread_household = p_spread_household_dict[rnd]
             if rnd in p_spread_office_dict: p_spread_office = p_spread_office_dict[rnd]
@@ -318,61 +761,69 @@ class Epsim:
                 }
                 for i in range(rnd, sim_iters):
                     info_per_rnd.append(info)
+                if recorder is not None:
+                    recorder.record_end(rnd, info)
+                if profiler is not None:
+                    profiler.end_round()
                 break
 
-            self.visiting_relatives = {node for node in self.interhousehold_nbrs.keys() if random.random() < p_interhh_visit}
+            self.visiting_relatives = {node for node in self.interhousehold_agents if interhousehold_rng.random() < p_interhh_visit}
+            if profiler is not None:
+                profiler.count('random_draws', len(self.interhousehold_agents))
 
-            # compute infectious agents for this round
-            self.infectious_agents = set()
-            for s in self.states_infectious:
-                self.infectious_agents |= self.agents_in_state[s]
-            self.infectious_adult_agents = self.infectious_agents & self.office_nbrs.keys()
-            self.infectious_child_agents = self.infectious_agents & (self.school_nbrs_standard.keys() | self.school_nbrs_split[0].keys() \
-                                                                     | self.school_nbrs_split[1].keys())
-            self.infectious_child_agents_standard = self.infectious_child_agents & self.school_nbrs_standard.keys()
+            # agents in quarantine for 10 rounds get released
+            self.release_quarantined(rnd)
+
+            # infectious agents for this round, split between quarantined and non-quarantined infectious agents
+            self.infectious_agents = set(self.all_infectious)
+            self.quarantined_infectious_adult_agents = {agent for agent in self.all_infectious_adults if agent in self.quarantined}
+            self.quarantined_infectious_child_agents = {agent for agent in self.all_infectious_children if agent in self.quarantined}
+            self.infectious_adult_agents = self.all_infectious_adults.difference(self.quarantined)
+            self.infectious_child_agents = self.all_infectious_children.difference(self.quarantined)
+            self.infectious_child_agents_standard = self.all_infectious_children_standard.difference(self.quarantined)
             self.infectious_interhousehold_child_agents = self.infectious_child_agents & self.visiting_relatives
             self.infectious_interhousehold_adult_agents = self.infectious_adult_agents & self.visiting_relatives
 
-            # agents in quarantine for 10 rounds get released
-            self.quarantined = {agent: counter for (agent, counter) in self.quarantined.items() if counter < 10}
-
-            # split between quarantined and non-quarantined infectious agents
-            self.quarantined_infectious_adult_agents = self.quarantined.keys() & self.infectious_adult_agents
-            self.quarantined_infectious_child_agents = self.quarantined.keys() & self.infectious_child_agents
-            self.infectious_adult_agents = self.infectious_adult_agents - self.quarantined.keys()
-            self.infectious_child_agents = self.infectious_child_agents - self.quarantined.keys()
-            self.infectious_child_agents_standard = self.infectious_child_agents_standard - self.quarantined.keys()
-            self.infectious_interhousehold_child_agents = self.infectious_interhousehold_child_agents - self.quarantined.keys()
-            self.infectious_interhousehold_adult_agents = self.infectious_interhousehold_adult_agents - self.quarantined.keys()
+            if profiler is not None:
+                profiler.enter('household')
 
             # spreading, testing and detection
             # spread in household (quarantined agents only spread in household)
-            infected_in_household_by_children = self.spread(self.household_nbrs, self.quarantined_infectious_child_agents, p_spread_household)
-            infected_in_household_by_adults = self.spread(self.household_nbrs, self.quarantined_infectious_adult_agents, p_spread_household)
+            infected_in_household_by_children = self.spread(self.household_nbrs, self.quarantined_infectious_child_agents, p_spread_household, household_rng)
+            infected_in_household_by_adults = self.spread(self.household_nbrs, self.quarantined_infectious_adult_agents, p_spread_household, household_rng)
 
-            infected_in_household_by_children |= self.spread(self.household_nbrs, self.infectious_child_agents, p_spread_household)
-            infected_in_household_by_adults |= self.spread(self.household_nbrs, self.infectious_adult_agents, p_spread_household)
+            infected_in_household_by_children |= self.spread(self.household_nbrs, self.infectious_child_agents, p_spread_household, household_rng)
+            infected_in_household_by_adults |= self.spread(self.household_nbrs, self.infectious_adult_agents, p_spread_household, household_rng)
 
             infected_in_household = infected_in_household_by_children | infected_in_household_by_adults
 
+            if profiler is not None:
+                profiler.enter('testing')
+
             # test children on monday, wednesday and friday and if they test positive, them and their households get quarantined
             quarantined_by_test = set()
             for testing_type, testing_params in testing.items():
                 if weekday in testing_params['weekdays']:
                     if omicron and testing_type == 'pcr':
-                        pos_tested_children = self.test_agents(self.infectious_child_agents & self.agents_in_state[2], testing_params['p'])
+                        pos_tested_children = self.test_agents(self.infectious_child_agents & self.agents_in_state[2], testing_params['p'], testing_rng)
                     else:
-                        pos_tested_children = self.test_agents(self.infectious_child_agents, testing_params['p'])
-                    quarantined_by_test = self.quarantine_agents_with_household(pos_tested_children)
+                        pos_tested_children = self.test_agents(self.infectious_child_agents, testing_params['p'], testing_rng)
+                    quarantined_by_test = self.quarantine_agents_with_household(pos_tested_children, rnd)
+
+            if profiler is not None:
+                profiler.enter('office')
 
             # spread in office only during weekdays
             infected_in_office = set()
             quarantined_by_detection_in_office = set()
             if weekday in [0, 1, 2, 3, 4]:
-                infected_in_office = self.spread(self.office_nbrs, self.infectious_adult_agents, p_spread_office)
+                infected_in_office = self.spread(self.office_nbrs, self.infectious_adult_agents, p_spread_office, office_rng)
                 # with p_detect_adult an infection of a adult gets detected (shows symtoms) and it and its household gets quarantined
-                detected_in_office = self.detect_agents(infected_in_office, p_detect_adult)
-                quarantined_by_detection_in_office = self.quarantine_agents_with_household(detected_in_office)
+                detected_in_office = self.detect_agents(infected_in_office, p_detect_adult, office_rng)
+                quarantined_by_detection_in_office = self.quarantine_agents_with_household(detected_in_office, rnd)
+
+            if profiler is not None:
+                profiler.enter('school')
 
             # spread in school only during weekdays
             infeced_in_school_standard = set()
@@ -382,10 +833,10 @@ class Epsim:
             if weekday in [0, 1, 2, 3, 4]:
                 # handle standard classes
                 if len(self.school_nbrs_standard) > 0:
-                    infeced_in_school_standard = self.spread(self.school_nbrs_standard, self.infectious_child_agents, p_spread_school)
+                    infeced_in_school_standard = self.spread(self.school_nbrs_standard, self.infectious_child_agents, p_spread_school, school_rng)
                     # with p_detect_child an infection of a child gets detected (shows symtoms) and it and its household gets quarantined
-                    detected_in_school_standard = self.detect_agents(infeced_in_school_standard, p_detect_child)
-                    quarantined_by_detection_in_school_standard = self.quarantine_agents_with_household(detected_in_school_standard)
+                    detected_in_school_standard = self.detect_agents(infeced_in_school_standard, p_detect_child, school_rng)
+                    quarantined_by_detection_in_school_standard = self.quarantine_agents_with_household(detected_in_school_standard, rnd)
 
                 # handle alternating split classes
                 if len(self.school_nbrs_split[0]) > 0:
@@ -394,32 +845,29 @@ class Epsim:
                     else:
                         current_half = rnd % 2  # alternate halfs of class
                     infected_in_school_split = self.spread(self.school_nbrs_split[current_half], self.infectious_child_agents, 
-                                                           p_spread_school)
-                    detected_in_school_split = self.detect_agents(infected_in_school_split, p_detect_child)
-                    quarantined_by_detection_in_school_split = self.quarantine_agents_with_household(detected_in_school_split)
+                                                           p_spread_school, school_rng)
+                    detected_in_school_split = self.detect_agents(infected_in_school_split, p_detect_child, school_rng)
+                    quarantined_by_detection_in_school_split = self.quarantine_agents_with_household(detected_in_school_split, rnd)
 
             infected_in_school = infeced_in_school_standard | infected_in_school_split
             quarantined_by_detection_in_school = quarantined_by_detection_in_school_standard | quarantined_by_detection_in_school_split
 
+            if profiler is not None:
+                profiler.enter('interhousehold')
+
             # spread in interhouseholds (visits to relatives) only once every 30 days
-            infected_in_interhousehold_by_children = self.spread(self.interhousehold_nbrs, self.infectious_interhousehold_child_agents, p_spread_household)
-            infected_in_interhousehold_by_adults = self.spread(self.interhousehold_nbrs, self.infectious_interhousehold_adult_agents, p_spread_household)
+            infected_in_interhousehold_by_children = self.spread(self.interhousehold_nbrs, self.infectious_interhousehold_child_agents, p_spread_household, interhousehold_rng)
+            infected_in_interhousehold_by_adults = self.spread(self.interhousehold_nbrs, self.infectious_interhousehold_adult_agents, p_spread_household, interhousehold_rng)
             infected_in_interhousehold = infected_in_interhousehold_by_children | infected_in_interhousehold_by_adults
 
-            # register visits
-            for h, house in enumerate(self.house_households):
-                for loc_type, visit_locs in self.house_visit_locs[h].items():
-                    for hh in house:
-                        for agent in self.households[hh]:
-                            visit_loc = random.choice(visit_locs)  # pick random location from favourite locations
-                            visit_loc.register_visit(self, agent)
-
-            # spread in locations
-            infected_in_location = {}
-            for loc_type, locs in self.locations.items():
-                infected_in_location[loc_type] = set()
-                for loc in locs:
-                    infected_in_location[loc_type] |= loc.spread(self)
+            if profiler is not None:
+                profiler.enter('visit_registration')
+
+            # register visits and spread in locations
+            infected_in_location = self.spread_locations(self.is_quarantined)
+
+            if profiler is not None:
+                profiler.enter('state_advance')
 
             infected_by_children = infected_in_household_by_children | infected_in_interhousehold_by_children | infected_in_school  # does not count infections in locations
             infected_by_adults = infected_in_household_by_adults | infected_in_interhousehold_by_adults | infected_in_office  # does not count infections in locations
@@ -427,17 +875,15 @@ class Epsim:
             for loc_type, infec_in_loc in infected_in_location.items():
                 infected |= infec_in_loc
             quarantined_by_detection = quarantined_by_detection_in_office | quarantined_by_detection_in_school
-            infected_children = {agent for agent in infected if self.is_child_agent(agent)}
-            infected_adults = {agent for agent in infected if self.is_adult_agent(agent)}
+            infected_children = self.select_role(infected, ROLE_CHILD)
+            infected_adults = self.select_role(infected, ROLE_ADULT)
 
             # all infected agents increase their state every round, agents in final state get removed
+            leaving_infectious = self.agents_in_state[max(self.states_infectious)]
             for s in reversed(range(2, len(self.agents_in_state))):
                 self.agents_in_state[s] = self.agents_in_state[s - 1]
             self.agents_in_state[1] = infected
-
-            # increase quarantine counter for every quarantined agent
-            for quarantined_agent in self.quarantined:
-                self.quarantined[quarantined_agent] += 1
+            self.update_infectious_sets(self.agents_in_state[min(self.states_infectious)], leaving_infectious)
 
             # info tracking: what happened during the day
             info = {
@@ -460,6 +906,10 @@ class Epsim:
                 'infected_in_nightlife': len(infected_in_location['nightlife'])
             }
             info_per_rnd.append(info)
+            if recorder is not None:
+                recorder.record(rnd, info)
+            if profiler is not None:
+                profiler.end_round()
             if print_progress:
                 print(f"{rnd}:\t{list(info.values())}")
 
@@ -0,0 +1,511 @@
+# Vectorized variant of the epidemic simulation in epsim.py.
+# Agent states are kept in one integer array indexed by agent id and every spread phase is evaluated with bulk Bernoulli draws
+# over the edges of all infectious agents at once, instead of per neighbor set operations.
+
+import numpy as np
+from epsim import Epsim, LocationTable, tuple2dict, value_at_round
+from checkpoint import Checkpoint, make_prefix
+from rng_streams import RNGStreams, make_streams
+from csrgraph import CSRGraph, gather_nbrs, EDGE_TYPES, ROLE_AGENT, ROLE_CHILD, ROLE_ADULT, ROLE_INTERHOUSEHOLD
+
+
+NEWLY_INFECTED = 255  # marks agents infected during the current round, they move to state 1 at the end of the round
+
+
+class EpsimVec(Epsim):
+    def __init__(self, household_nbrs, school_nbrs_standard=None, school_nbrs_split=None, office_nbrs=None, interhousehold_nbrs=None):
+        """
+        Epidemic simulation on the same graph as Epsim, but with a NumPy state engine.
+        run_sim takes the same parameters and returns the same info_per_rnd as Epsim.run_sim.
+        The graph is given either as neighbor dicts or as CSRGraph, neighbor dicts are converted to a CSRGraph.
+        """
+        super().__init__(household_nbrs, school_nbrs_standard, school_nbrs_split, office_nbrs, interhousehold_nbrs)
+        if self.csr_graph is None:
+            self.csr_graph = CSRGraph.from_nbrs(self.household_nbrs, self.school_nbrs_standard, self.school_nbrs_split,
+                                                self.office_nbrs, self.interhousehold_nbrs)
+
+        # households as CSR arrays: agents of household h are households_agents[households_indptr[h]:households_indptr[h+1]]
+        self.households_indptr = np.zeros(len(self.households) + 1, dtype=np.int64)
+        np.cumsum([len(household) for household in self.households], out=self.households_indptr[1:])
+        self.households_agents = np.fromiter((agent for household in self.households for agent in household), dtype=np.int64,
+                                             count=self.households_indptr[-1])
+        self.init_agent_arrays()
+
+
+    @classmethod
+    def from_world_arrays(cls, arrays, loc_types):
+        """
+        Create a simulation from the arrays of world_arrays, without copying them and without recomputing households and
+        visit locations. The arrays are only read, such that they can reside in shared or memory mapped memory.
+        """
+        sim = cls.__new__(cls)
+        sim.csr_graph = CSRGraph({edge_type: arrays['indptr_' + edge_type] for edge_type in EDGE_TYPES},
+                                 {edge_type: arrays['indices_' + edge_type] for edge_type in EDGE_TYPES}, arrays['roles'])
+        sim.household_nbrs = sim.csr_graph.nbrs('household')
+        sim.school_nbrs_standard = sim.csr_graph.nbrs('school_standard')
+        sim.school_nbrs_split = [sim.csr_graph.nbrs('school_split_0'), sim.csr_graph.nbrs('school_split_1')]
+        sim.office_nbrs = sim.csr_graph.nbrs('office')
+        sim.interhousehold_nbrs = sim.csr_graph.nbrs('interhousehold')
+        sim.households = None  # only needed to prepare the world, run_sim uses households_indptr and households_agents
+        sim.households_indptr = arrays['households_indptr']
+        sim.households_agents = arrays['households_agents']
+        sim.agents_in_state = []
+        sim.locations = {loc_type: [] for loc_type in loc_types}  # Location objects are only needed to prepare the world
+        sim.location_table = LocationTable.from_arrays(loc_types, arrays['loc_type'], arrays['loc_sqm'])
+        sim.house_households = []
+        sim.house_visit_locs = []
+        sim.house_visit_loc_idx = {loc_type: arrays['house_visit_loc_idx_' + loc_type] for loc_type in loc_types
+                                   if 'house_visit_loc_idx_' + loc_type in arrays}
+        sim.visit_agents = arrays['visit_agents']
+        sim.visit_agent_house = arrays['visit_agent_house']
+        sim.num_ids = sim.csr_graph.num_ids
+        sim.streams = RNGStreams()
+        sim.profiler = None
+        sim.init_agent_arrays()
+        return sim
+
+
+    def world_arrays(self):
+        """
+        Return the arrays of the prepared world (graph, households, locations and visit locations) by name,
+        from_world_arrays recreates the simulation from them.
+        """
+        arrays = {'roles': self.csr_graph.roles}
+        for edge_type in EDGE_TYPES:
+            arrays['indptr_' + edge_type], arrays['indices_' + edge_type] = self.csr_graph.csr(edge_type)
+        arrays['households_indptr'] = self.households_indptr
+        arrays['households_agents'] = self.households_agents
+        arrays['loc_type'] = self.location_table.type
+        arrays['loc_sqm'] = self.location_table.sqm
+        for loc_type, house_visit_loc_idx in self.house_visit_loc_idx.items():
+            arrays['house_visit_loc_idx_' + loc_type] = house_visit_loc_idx
+        arrays['visit_agents'] = self.visit_agents
+        arrays['visit_agent_house'] = self.visit_agent_house
+        return arrays
+
+
+    def init_agent_arrays(self):
+        self.agent_ids = self.csr_graph.agents_with_role(ROLE_AGENT)
+
+        self.household_csr = self.csr_graph.csr('household')
+        self.school_standard_csr = self.csr_graph.csr('school_standard')
+        self.school_split_csr = [self.csr_graph.csr('school_split_0'), self.csr_graph.csr('school_split_1')]
+        self.office_csr = self.csr_graph.csr('office')
+        self.interhousehold_csr = self.csr_graph.csr('interhousehold')
+
+        self.is_adult = (self.csr_graph.roles & ROLE_ADULT) != 0
+        self.is_child = (self.csr_graph.roles & ROLE_CHILD) != 0
+        self.interhousehold_agents = self.csr_graph.agents_with_role(ROLE_INTERHOUSEHOLD)
+
+
+    def spread(self, csr, infectious_mask, prob, rng):
+        nbrs = gather_nbrs(*csr, np.flatnonzero(infectious_mask))
+        if self.profiler is not None:
+            self.profiler.count('edges_examined', len(nbrs))
+        nbrs = nbrs[self.state[nbrs] == 0]
+        if self.profiler is not None:
+            self.profiler.count('random_draws', len(nbrs))
+        # an agent with m infectious neighbors gets m independent chances to be infected, as in Epsim.spread
+        infected_agents = np.unique(nbrs[rng.random(len(nbrs)) < prob])
+        self.state[infected_agents] = NEWLY_INFECTED
+        return infected_agents
+
+
+    def select_agents(self, agents, prob, rng):
+        if self.profiler is not None:
+            self.profiler.count('random_draws', len(agents))
+        return agents[rng.random(len(agents)) < prob]
+
+
+    def quarantine_agents_with_household(self, agents, rnd):
+        quarantined_agents = np.union1d(agents, gather_nbrs(*self.household_csr, agents))
+        self.quarantine_release[quarantined_agents] = rnd + 10  # agents in quarantine for 10 rounds get released
+        for mask in self.infectious_masks:
+            mask[quarantined_agents] = False
+        if self.profiler is not None:
+            self.profiler.count('agents_quarantined', len(quarantined_agents))
+        return quarantined_agents
+
+
+    def spread_locations(self, quarantined):
+        """Register visits of all agents at their favourite locations and spread the infection within the locations"""
+        if self.lazy_locations:
+            infectious_agents = np.flatnonzero(self.is_infectious_state[self.state] & ~quarantined)
+            infected_in_location = self.spread_locations_lazy(infectious_agents,
+                                                              lambda agents: (self.state[agents] == 0) & ~quarantined[agents])
+        else:
+            visit_agents, visit_locs, visit_minutes = self.draw_visits()
+            visit_state = self.state[visit_agents]
+            susceptible = (visit_state == 0) & ~quarantined[visit_agents]
+            infectious = self.is_infectious_state[visit_state] & ~quarantined[visit_agents]
+            self.location_table.register_visits(visit_agents[susceptible], visit_locs[susceptible], visit_minutes[susceptible])
+            self.location_table.register_infectious_visits(visit_locs[infectious], visit_minutes[infectious])
+            if self.profiler is not None:
+                num_susceptible = np.count_nonzero(susceptible)
+                self.profiler.count('visits_registered', num_susceptible + np.count_nonzero(infectious))
+                self.profiler.enter('location_spread')
+                self.profiler.count('random_draws', num_susceptible)
+            infected_in_location = self.location_table.spread(self.streams.numpy('locations'))
+        for infected_agents in infected_in_location.values():
+            self.state[infected_agents] = NEWLY_INFECTED
+        return infected_in_location
+
+
+    def make_checkpoint(self, rnd, info_per_rnd):
+        """Return a Checkpoint of the run at the beginning of round rnd"""
+        quarantine_counter = np.full(self.num_ids, -1, dtype=np.int8)
+        quarantined = self.quarantine_release > rnd
+        quarantine_counter[quarantined] = rnd - self.quarantine_release[quarantined] + 10
+        return Checkpoint(rnd, self.num_agent_states, self.state.copy(), quarantine_counter, self.streams.get_state(),
+                          make_prefix(info_per_rnd, self.num_agent_states))
+
+
+    def restore_checkpoint(self, checkpoint):
+        """Restore the run state of a Checkpoint and return the info_per_rnd of the rounds before it"""
+        self.state = checkpoint.state.copy()
+        quarantined = checkpoint.quarantine_counter >= 0
+        self.quarantine_release = np.zeros(self.num_ids, dtype=np.int64)
+        self.quarantine_release[quarantined] = checkpoint.rnd - checkpoint.quarantine_counter[quarantined] + 10
+        self.streams.set_state(checkpoint.rng_state)
+        return checkpoint.info_per_rnd()
+
+
+    def run_sim(self, sim_iters, num_start_agents, perc_immune_agents, start_weekday, p_spread_household_dict, p_spread_school_dict,
+                p_spread_office_dict, p_detect_child_dict, p_detect_adult_dict, testing_dict, omicron, split_stay_home,
+                loc_infec_rate, avg_visit_times, need_minutes, contact_mult, p_interhh_visit_dict, print_progress=False,
+                recorder=None, checkpoint_rnds=None, resume_from=None, seed=None,
+                profiler=None, lazy_locations=False):
+        """Run the epidemic simulation with the given parameters, see Epsim.run_sim"""
+
+        # input conversion
+        if isinstance(perc_immune_agents, tuple): perc_immune_agents = tuple2dict(perc_immune_agents, 1)
+        if isinstance(p_spread_household_dict, tuple): p_spread_household_dict = tuple2dict(p_spread_household_dict, 1)
+        if isinstance(p_spread_school_dict, tuple): p_spread_school_dict = tuple2dict(p_spread_school_dict, 1)
+        if isinstance(p_spread_office_dict, tuple): p_spread_office_dict = tuple2dict(p_spread_office_dict, 1)
+        if isinstance(p_detect_child_dict, tuple): p_detect_child_dict = tuple2dict(p_detect_child_dict, 1)
+        if isinstance(p_detect_adult_dict, tuple): p_detect_adult_dict = tuple2dict(p_detect_adult_dict, 1)
+        if isinstance(testing_dict, tuple): testing_dict = tuple2dict(testing_dict, 3)
+        if isinstance(loc_infec_rate, tuple): loc_infec_rate = tuple2dict(loc_infec_rate, 1)
+        if isinstance(avg_visit_times, tuple): avg_visit_times = tuple2dict(avg_visit_times, 1)
+        if isinstance(need_minutes, tuple): need_minutes = tuple2dict(need_minutes, 1)
+        if isinstance(contact_mult, tuple): contact_mult = tuple2dict(contact_mult, 1)
+        if isinstance(p_interhh_visit_dict, tuple): p_interhh_visit_dict = tuple2dict(p_interhh_visit_dict, 1)
+
+        if 0 not in p_spread_household_dict: raise ValueError("p_spread_household_dict must cointain value for round 0")
+        if 0 not in p_spread_school_dict: raise ValueError("p_spread_school_dict must cointain value for round 0")
+        if 0 not in p_spread_office_dict: raise ValueError("p_spread_office_dict must cointain value for round 0")
+        if 0 not in p_detect_child_dict: raise ValueError("p_detect_child_dict must cointain value for round 0")
+        if 0 not in p_detect_adult_dict: raise ValueError("p_detect_adult_dict must cointain value for round 0")
+        if 0 not in p_interhh_visit_dict: raise ValueError("p_interhh_visit_dict must cointain value for round 0")
+        if 0 not in testing_dict: raise ValueError("testing_dict must cointain value for round 0")
+
+        n = len(self.agent_ids)
+
+        self.streams = make_streams(seed)
+        seeding_rng = self.streams.numpy('seeding')
+        household_rng = self.streams.numpy('household')
+        testing_rng = self.streams.numpy('testing')
+        office_rng = self.streams.numpy('office')
+        school_rng = self.streams.numpy('school')
+        interhousehold_rng = self.streams.numpy('interhousehold')
+
+        # agent states, the last state (recovered/immune) also holds all ids that are no agents
+        if omicron:
+            self.num_agent_states = 4
+            self.states_exposed = set()
+            self.states_infectious = {1, 2}
+        else:
+            self.num_agent_states = 7
+            self.states_exposed = {1, 2, 3}
+            self.states_infectious = {4, 5}
+        removed = self.num_agent_states - 1
+        self.is_infectious_state = np.zeros(256, dtype=bool)
+        self.is_infectious_state[list(self.states_infectious)] = True
+
+        self.loc_infec_rate = loc_infec_rate
+        self.avg_visit_times = avg_visit_times
+        self.need_minutes = need_minutes
+        self.contact_mult = contact_mult
+        self.location_table.set_rates(loc_infec_rate, contact_mult)
+        self.location_table.clear_visits()
+        self.lazy_locations = lazy_locations
+        if lazy_locations:
+            self.init_visit_index()
+
+        if resume_from is None:
+            self.state = np.full(self.num_ids, removed, dtype=np.uint8)
+            self.state[self.agent_ids] = 0
+
+            # set immune agents
+            if isinstance(perc_immune_agents, float):
+                self.state[seeding_rng.choice(self.agent_ids, int(perc_immune_agents * n), replace=False)] = removed
+            elif isinstance(perc_immune_agents, dict):
+                if 'households' in perc_immune_agents:
+                    num_households = len(self.households_indptr) - 1
+                    immune_households = seeding_rng.choice(num_households, int(perc_immune_agents['households'] * num_households), replace=False)
+                    self.state[gather_nbrs(self.households_indptr, self.households_agents, immune_households)] = removed
+                if 'adults' in perc_immune_agents:
+                    adults = np.flatnonzero(self.is_adult)
+                    self.state[seeding_rng.choice(adults, int(perc_immune_agents['adults'] * len(adults)), replace=False)] = removed
+                if 'children' in perc_immune_agents:
+                    children = np.flatnonzero(self.is_child)
+                    self.state[seeding_rng.choice(children, int(perc_immune_agents['children'] * len(children)), replace=False)] = removed
+            else:
+                raise ValueError("perc_immune_agents has wrong format")
+
+            num_start_immune = n - np.count_nonzero(self.state == 0)
+
+            # set starting agents
+            if isinstance(num_start_agents, int):
+                num_start_agents = [int(num_start_agents / (self.num_agent_states - 2))] * (self.num_agent_states - 2)
+            if not isinstance(num_start_agents, list) and len(num_start_agents) != self.num_agent_states - 2:  # w/o suceptible and immune
+                raise ValueError("num_start_agents has wrong format")
+            for s, num_agents in enumerate(num_start_agents, 1):
+                self.state[seeding_rng.choice(np.flatnonzero(self.state == 0), num_agents, replace=False)] = s
+
+            # print simulation info
+            print(f"starting simulation with n={n}, num_start_agents={num_start_agents}, perc_immune_agents={perc_immune_agents}, " \
+                  + f"start_weekday={start_weekday}, sim_iters={sim_iters}, " + f"p_spread_household_dict={p_spread_household_dict}, " \
+                  + f"p_spread_school_dict={p_spread_school_dict}, p_spread_office={p_spread_office_dict}, " \
+                  + f"p_detect_child_dict={p_detect_child_dict}, p_detect_adult_dict={p_detect_adult_dict}, testing_dict={testing_dict}")
+            print(f"start immune: {num_start_immune}, seed: {self.streams.seed}")
+        else:
+            if resume_from.num_agent_states != self.num_agent_states:
+                raise ValueError("resume_from was taken from a simulation with a different omicron setting")
+            info_per_rnd = self.restore_checkpoint(resume_from)
+            print(f"resuming simulation at round {resume_from.rnd} with n={n}, sim_iters={sim_iters}, " \
+                  + f"p_spread_household_dict={p_spread_household_dict}, p_spread_school_dict={p_spread_school_dict}, " \
+                  + f"p_spread_office={p_spread_office_dict}, p_detect_child_dict={p_detect_child_dict}, " \
+                  + f"p_detect_adult_dict={p_detect_adult_dict}, testing_dict={testing_dict}")
+
+        if print_progress:
+            print("the following information represents the number of agents per round for:")
+            print("[(states), infected, infected_in_household, infected_in_school, infected_in_office, infected_in_interhousehold, " \
+                  "infected_by_children, infected_by_adults, quarantined_by_detection, quarantined_by_test, infected_in_location]")
+
+        # initialize simulation variables
+        start_rnd = 0 if resume_from is None else resume_from.rnd
+        if resume_from is None:
+            info_per_rnd = []
+            self.quarantine_release = np.zeros(self.num_ids, dtype=np.int64)  # agent is quarantined while rnd < quarantine_release
+        if recorder is not None:
+            recorder.start_run(sim_iters, self.num_agent_states)
+            for rnd, info in enumerate(info_per_rnd):
+                recorder.record(rnd, info)
+        self.checkpoints = {}
+        self.profiler = profiler
+        if profiler is not None:
+            profiler.start_run(sim_iters)
+        empty = np.empty(0, dtype=np.int64)
+
+        # parameter values valid at the start round, they get updated during the simulation
+        p_spread_household = value_at_round(p_spread_household_dict, start_rnd)
+        p_spread_office = value_at_round(p_spread_office_dict, start_rnd)
+        p_spread_school = value_at_round(p_spread_school_dict, start_rnd)
+        p_detect_child = value_at_round(p_detect_child_dict, start_rnd)
+        p_detect_adult = value_at_round(p_detect_adult_dict, start_rnd)
+        testing = value_at_round(testing_dict, start_rnd)
+        p_interhh_visit = value_at_round(p_interhh_visit_dict, start_rnd)
+
+        # run simulation
+        for rnd in range(start_rnd, sim_iters):
+            weekday = (rnd + start_weekday) % 7
+            if profiler is not None:
+                profiler.start_round(rnd)
+
+            if checkpoint_rnds is not None and rnd in checkpoint_rnds:
+                self.checkpoints[rnd] = self.make_checkpoint(rnd, info_per_rnd)
+
+            if rnd in p_spread_household_dict: p_spread_household = p_spread_household_dict[rnd]
+            if rnd in p_spread_office_dict: p_spread_office = p_spread_office_dict[rnd]
+            if rnd in p_spread_school_dict: p_spread_school = p_spread_school_dict[rnd]
+            if rnd in p_detect_child_dict: p_detect_child = p_detect_child_dict[rnd]
+            if rnd in p_detect_adult_dict: p_detect_adult = p_detect_adult_dict[rnd]
+            if rnd in testing_dict: testing = testing_dict[rnd]
+            if rnd in p_interhh_visit_dict: p_interhh_visit = p_interhh_visit_dict[rnd]
+
+            # info tracking: number of agents per state at beginning of the day
+            num_agents_per_state = list(np.bincount(self.state, minlength=removed)[:removed])
+            num_agents_per_state.append(n - sum(num_agents_per_state))
+
+            # end simulation when no new infections can occur anymore
+            sim_end = True
+            for s in (self.states_infectious | self.states_exposed):
+                sim_end &= num_agents_per_state[s] == 0
+            if sim_end:
+                info = {
+                    'states': tuple(int(num_agents_per_state[s]) for s in range(self.num_agent_states)),
+                    'infected': 0,
+                    'infected_in_household': 0,
+                    'infected_in_school': 0,
+                    'infected_in_office': 0,
+                    'infected_in_interhousehold': 0,
+                    'infected_by_children': 0,
+                    'infected_children': 0,
+                    'infected_by_adults': 0,
+                    'infected_adults': 0,
+                    'quarantined_by_detection': 0,
+                    'quarantined_by_test': 0,
+                    'infected_in_supermarket': 0,
+                    'infected_in_shop': 0,
+                    'infected_in_restaurant': 0,
+                    'infected_in_leisure': 0,
+                    'infected_in_nightlife': 0
+                }
+                for i in range(rnd, sim_iters):
+                    info_per_rnd.append(info)
+                if recorder is not None:
+                    recorder.record_end(rnd, info)
+                if profiler is not None:
+                    profiler.end_round()
+                break
+
+            visiting_relatives = np.zeros(self.num_ids, dtype=bool)
+            visiting_relatives[self.select_agents(self.interhousehold_agents, p_interhh_visit, interhousehold_rng)] = True
+
+            # compute infectious agents for this round, split between quarantined and non-quarantined infectious agents
+            quarantined = self.quarantine_release > rnd
+            infectious = self.is_infectious_state[self.state]
+            infectious_adult = infectious & self.is_adult
+            infectious_child = infectious & self.is_child
+            quarantined_infectious_adult = infectious_adult & quarantined
+            quarantined_infectious_child = infectious_child & quarantined
+            infectious_adult &= ~quarantined
+            infectious_child &= ~quarantined
+            infectious_interhousehold_child = infectious_child & visiting_relatives
+            infectious_interhousehold_adult = infectious_adult & visiting_relatives
+            # masks of non-quarantined infectious agents, agents get removed from them when they are quarantined
+            self.infectious_masks = [infectious_adult, infectious_child, infectious_interhousehold_child, infectious_interhousehold_adult]
+
+            if profiler is not None:
+                profiler.enter('household')
+
+            # spreading, testing and detection
+            # spread in household (quarantined agents only spread in household)
+            infected_in_household_by_children = self.spread(self.household_csr, quarantined_infectious_child, p_spread_household, household_rng)
+            infected_in_household_by_adults = self.spread(self.household_csr, quarantined_infectious_adult, p_spread_household, household_rng)
+
+            infected_in_household_by_children = np.union1d(infected_in_household_by_children,
+                                                           self.spread(self.household_csr, infectious_child, p_spread_household, household_rng))
+            infected_in_household_by_adults = np.union1d(infected_in_household_by_adults,
+                                                         self.spread(self.household_csr, infectious_adult, p_spread_household, household_rng))
+
+            infected_in_household = np.union1d(infected_in_household_by_children, infected_in_household_by_adults)
+
+            if profiler is not None:
+                profiler.enter('testing')
+
+            # test children on the testing weekdays and if they test positive, them and their households get quarantined
+            quarantined_by_test = empty
+            for testing_type, testing_params in testing.items():
+                if weekday in testing_params['weekdays']:
+                    if omicron and testing_type == 'pcr':
+                        tested_children = np.flatnonzero(infectious_child & (self.state == 2))
+                    else:
+                        tested_children = np.flatnonzero(infectious_child)
+                    pos_tested_children = self.select_agents(tested_children, testing_params['p'], testing_rng)
+                    quarantined_by_test = self.quarantine_agents_with_household(pos_tested_children, rnd)
+
+            if profiler is not None:
+                profiler.enter('office')
+
+            # spread in office only during weekdays
+            infected_in_office = empty
+            quarantined_by_detection_in_office = empty
+            if weekday in [0, 1, 2, 3, 4]:
+                infected_in_office = self.spread(self.office_csr, infectious_adult, p_spread_office, office_rng)
+                # with p_detect_adult an infection of a adult gets detected (shows symtoms) and it and its household gets quarantined
+                detected_in_office = self.select_agents(infected_in_office, p_detect_adult, office_rng)
+                quarantined_by_detection_in_office = self.quarantine_agents_with_household(detected_in_office, rnd)
+
+            if profiler is not None:
+                profiler.enter('school')
+
+            # spread in school only during weekdays
+            infected_in_school_standard = empty
+            infected_in_school_split = empty
+            quarantined_by_detection_in_school_standard = empty
+            quarantined_by_detection_in_school_split = empty
+            if weekday in [0, 1, 2, 3, 4]:
+                # handle standard classes
+                if len(self.school_nbrs_standard) > 0:
+                    infected_in_school_standard = self.spread(self.school_standard_csr, infectious_child, p_spread_school, school_rng)
+                    # with p_detect_child an infection of a child gets detected (shows symtoms) and it and its household gets quarantined
+                    detected_in_school_standard = self.select_agents(infected_in_school_standard, p_detect_child, school_rng)
+                    quarantined_by_detection_in_school_standard = self.quarantine_agents_with_household(detected_in_school_standard, rnd)
+
+                # handle alternating split classes
+                if len(self.school_nbrs_split[0]) > 0:
+                    if split_stay_home:
+                        current_half = 0  # half 0 always goes to school, while half 1 stays home
+                    else:
+                        current_half = rnd % 2  # alternate halfs of class
+                    infected_in_school_split = self.spread(self.school_split_csr[current_half], infectious_child, p_spread_school, school_rng)
+                    detected_in_school_split = self.select_agents(infected_in_school_split, p_detect_child, school_rng)
+                    quarantined_by_detection_in_school_split = self.quarantine_agents_with_household(detected_in_school_split, rnd)
+
+            infected_in_school = np.union1d(infected_in_school_standard, infected_in_school_split)
+            quarantined_by_detection_in_school = np.union1d(quarantined_by_detection_in_school_standard,
+                                                            quarantined_by_detection_in_school_split)
+
+            if profiler is not None:
+                profiler.enter('interhousehold')
+
+            # spread in interhouseholds (visits to relatives)
+            infected_in_interhousehold_by_children = self.spread(self.interhousehold_csr, infectious_interhousehold_child, p_spread_household, interhousehold_rng)
+            infected_in_interhousehold_by_adults = self.spread(self.interhousehold_csr, infectious_interhousehold_adult, p_spread_household, interhousehold_rng)
+            infected_in_interhousehold = np.union1d(infected_in_interhousehold_by_children, infected_in_interhousehold_by_adults)
+
+            if profiler is not None:
+                profiler.enter('visit_registration')
+
+            # register visits and spread in locations
+            infected_in_location = self.spread_locations(self.quarantine_release > rnd)
+
+            if profiler is not None:
+                profiler.enter('state_advance')
+
+            # infection sets are disjoint, since every agent can only be infected once per round
+            num_infected_by_children = len(infected_in_household_by_children) + len(infected_in_interhousehold_by_children) \
+                                       + len(infected_in_school)  # does not count infections in locations
+            num_infected_by_adults = len(infected_in_household_by_adults) + len(infected_in_interhousehold_by_adults) \
+                                     + len(infected_in_office)  # does not count infections in locations
+            infected = self.state == NEWLY_INFECTED
+            quarantined_by_detection = np.union1d(quarantined_by_detection_in_office, quarantined_by_detection_in_school)
+
+            # all infected agents increase their state every round, agents in final state get removed
+            self.state[(self.state >= 1) & (self.state < removed)] += 1
+            self.state[infected] = 1
+
+            # info tracking: what happened during the day
+            info = {
+                'states': tuple(int(num_agents_per_state[s]) for s in range(self.num_agent_states)),
+                'infected': int(np.count_nonzero(infected)),
+                'infected_in_household': len(infected_in_household),
+                'infected_in_school': len(infected_in_school),
+                'infected_in_office': len(infected_in_office),
+                'infected_in_interhousehold': len(infected_in_interhousehold),
+                'infected_by_children': num_infected_by_children,
+                'infected_children': int(np.count_nonzero(infected & self.is_child)),
+                'infected_by_adults': num_infected_by_adults,
+                'infected_adults': int(np.count_nonzero(infected & self.is_adult)),
+                'quarantined_by_detection': len(quarantined_by_detection),
+                'quarantined_by_test': len(quarantined_by_test),
+                'infected_in_supermarket': len(infected_in_location['supermarket']),
+                'infected_in_shop': len(infected_in_location['shop']),
+                'infected_in_restaurant': len(infected_in_location['restaurant']),
+                'infected_in_leisure': len(infected_in_location['leisure']),
+                'infected_in_nightlife': len(infected_in_location['nightlife'])
+            }
+            info_per_rnd.append(info)
+            if recorder is not None:
+                recorder.record(rnd, info)
+            if profiler is not None:
+                profiler.end_round()
+            if print_progress:
+                print(f"{rnd}:\t{list(info.values())}")
+
+        total_infected = sum(info_per_rnd[-1]['states'][1:])
+        print(f"infected: {total_infected}")
+        print()
+        return info_per_rnd
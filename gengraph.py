@@ -3,6 +3,7 @@ import random
 import math
 import numpy as np
 from pathlib import Path
+from csrgraph import CSRGraph, EDGE_TYPES, edges_to_csr, clique_edges, concat_ranges, entries_roles
 
 
 def chunks(lst, n):
@@ -11,8 +12,64 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 
+def chunk_sizes(length, n):
+    """Return the sizes of the chunks that chunks() yields for a list of the given length"""
+    sizes = [n] * (length // n)
+    if length % n:
+        sizes.append(length % n)
+    return sizes
+
+
+# 8-neighborhood of a grid cell
+stencil = [(di, dj) for di in (-1, 0, 1) for dj in (-1, 0, 1) if (di, dj) != (0, 0)]
+
+
+def grid_nbrs(grids, skip):
+    """
+    Return the 8-neighborhood adjacency of the nodes in grids (classes x l x l array) as dict node -> set of nbrs.
+    skip -- nodes at (i, j) with (i+j) % 2 == skip are left out, skip={0,1} gives the two halves of split classes, skip>=2 has no effect
+    """
+    num_classes, l, _ = grids.shape
+    i, j = np.indices((l, l))
+    active = ((i + j) % 2 != skip).ravel()
+    # stencil applied to the cell indices of one grid, invalid: outside of the grid or skipped
+    nbr_i = i.ravel()[:, np.newaxis] + np.array([di for di, _ in stencil])
+    nbr_j = j.ravel()[:, np.newaxis] + np.array([dj for _, dj in stencil])
+    inside = (nbr_i >= 0) & (nbr_i < l) & (nbr_j >= 0) & (nbr_j < l)
+    nbr_cells = np.where(inside, nbr_i * l + nbr_j, 0)
+    valid = inside & active[nbr_cells]
+
+    # every cell of all grids at once, its nbrs are the (classes x valid nbrs) columns of the flattened grids
+    flat = grids.reshape(num_classes, l*l)
+    adjlist = {}
+    for cell in np.flatnonzero(active).tolist():
+        nbrs = flat[:, nbr_cells[cell][valid[cell]]]
+        adjlist.update(zip(flat[:, cell].tolist(), map(set, nbrs.tolist())))
+    return adjlist
+
+
+def grid_edges(grids, skip):
+    """Return the adjacency of grid_nbrs as edges (src, dst) and the nodes that have an entry in it (incl. the ones without nbrs)"""
+    num_classes, l, _ = grids.shape
+    i, j = np.indices((l, l))
+    active = ((i + j) % 2 != skip).ravel()
+    nbr_i = i.ravel()[:, np.newaxis] + np.array([di for di, _ in stencil])
+    nbr_j = j.ravel()[:, np.newaxis] + np.array([dj for _, dj in stencil])
+    inside = (nbr_i >= 0) & (nbr_i < l) & (nbr_j >= 0) & (nbr_j < l)
+    nbr_cells = np.where(inside, nbr_i * l + nbr_j, 0)
+    valid = inside & active[nbr_cells]
+
+    # (cell, nbr cell) pairs of one grid, applied to the columns of all flattened grids at once
+    cells = np.flatnonzero(active)
+    src_cells = np.repeat(cells, valid[cells].sum(axis=1))
+    dst_cells = nbr_cells[cells][valid[cells]]
+    flat = grids.reshape(num_classes, l*l)
+    return flat[:, src_cells].ravel(), flat[:, dst_cells].ravel(), flat[:, cells].ravel()
+
+
 class EpsimGraph:
-    def __init__(self, n, sigma_office, perc_split_classes, print_progress=False):
+    def __init__(self, n, sigma_office, perc_split_classes, print_progress=False, rng=None, vectorized=False,
+                 class_grid_size=5):
         """
         Generate a graph for epidemic simulation with the given parameters such that approx.:
         Children        23%
@@ -23,6 +80,12 @@ class EpsimGraph:
         n -- number of nodes in the graph (approx. due to rounding errors)
         sigma_office -- determines the distribution of adults to the offices
         perc_split_classes -- percentage of school classes that are split in half and alternate a shared classroom every day
+        rng -- random.Random of the graph generation (e.g. RNGStreams.python('graph')), None: global random module
+        vectorized -- generate households and offices with cluster sizes computed upfront and random choices drawn as arrays,
+                      instead of merging clusters node by node. The graph has the same distributions, but is a different sample.
+                      The edges are emitted as CSR arrays without building neighbor dicts: household_nbrs, school_nbrs_standard,
+                      school_nbrs_split, office_nbrs and interhousehold_nbrs are read-only CSRNbrs views of self.csr_graph.
+        class_grid_size -- school classes are class_grid_size*class_grid_size grids of children
         """
         self.n = n
         n_parents_children = int(self.n * 0.55)
@@ -39,6 +102,12 @@ class EpsimGraph:
         self.office_nbrs = {}
         self.interhousehold_nbrs = {}
         self.print_progress = print_progress
+        self.rng = random if rng is None else rng
+        self.vectorized = vectorized
+        self.class_grid_size = class_grid_size
+        self.csr_graph = None
+        self.edges = {edge_type: [] for edge_type in EDGE_TYPES}  # vectorized: edge arrays (src, dst) per edge type
+        self.entries = {edge_type: [] for edge_type in EDGE_TYPES}  # vectorized: arrays of the nodes with an entry per edge type
 
         self.create_graph()
     
@@ -128,12 +197,69 @@ class EpsimGraph:
         print(f"{office_nbrs_path} written")
 
 
+    def to_csr(self):
+        """Return all neighbor graphs as one CSRGraph, which can be passed to Epsim directly"""
+        if self.csr_graph is not None:
+            return self.csr_graph
+        return CSRGraph.from_nbrs(self.household_nbrs, self.school_nbrs_standard, self.school_nbrs_split, self.office_nbrs,
+                                  self.interhousehold_nbrs)
+
+
+    def write_graph_file(self, path):
+        """Write all neighbor graphs incl. interhousehold to a binary graph file, see Epsim.from_graph_file()"""
+        self.to_csr().save(path)
+        print(f"{path} written")
+
+
     def create_graph(self):
         if self.print_progress:
             print(f"creating graph with k={self.k}, sigma_office={self.sigma_office}")
+        if self.vectorized:
+            self.create_households_vectorized()
+        else:
+            self.create_households()
+        self.create_school_classes()
+        if self.vectorized:
+            self.create_offices_vectorized()
+            self.create_csr_graph()
+        else:
+            self.create_offices()
+
+
+    def add_edges(self, edge_type, src, dst, entries):
+        """Add the edges src -> dst and the nodes with an entry (incl. the ones without nbrs) of the vectorized generation"""
+        self.edges[edge_type].append((src, dst))
+        self.entries[edge_type].append(entries)
+
+
+    def create_csr_graph(self):
+        """Convert the edges of the vectorized generation to self.csr_graph and set the neighbor attributes to views of it"""
+        num_ids = self.id_bump
+        indptr = {}
+        indices = {}
+        entries = {}
+        for edge_type in EDGE_TYPES:
+            empty = np.empty(0, dtype=np.int64)
+            src = np.concatenate([src for src, _ in self.edges[edge_type]] + [empty])
+            dst = np.concatenate([dst for _, dst in self.edges[edge_type]] + [empty])
+            indptr[edge_type], indices[edge_type] = edges_to_csr(src, dst, num_ids)
+            entries[edge_type] = np.concatenate(self.entries[edge_type] + [empty])
+        self.edges = {edge_type: [] for edge_type in EDGE_TYPES}
+        self.entries = {edge_type: [] for edge_type in EDGE_TYPES}
+
+        self.csr_graph = CSRGraph(indptr, indices, entries_roles(entries, num_ids))
+        self.household_nbrs = self.csr_graph.nbrs('household')
+        self.school_nbrs_standard = self.csr_graph.nbrs('school_standard')
+        self.school_nbrs_split = [self.csr_graph.nbrs('school_split_0'), self.csr_graph.nbrs('school_split_1')]
+        self.office_nbrs = self.csr_graph.nbrs('office')
+        self.interhousehold_nbrs = self.csr_graph.nbrs('interhousehold')
+
+
+    def create_households(self):
+        if self.print_progress:
             print("randomly cluster children and parent nodes, such that there are child-parent pairs")
         children2parents = list(self.adult_nodes)
-        random.shuffle(children2parents)
+        self.rng.shuffle(children2parents)
         for child_node, parent_node in enumerate(children2parents):
             self.household_nbrs[child_node] = {parent_node}
             self.household_nbrs[parent_node] = {child_node}
@@ -142,7 +268,7 @@ class EpsimGraph:
         if self.print_progress:
             print("parents: 1/2 no change, 1/4 merge 2, 1/8 merge 3, ...")
         parents_shuffle = list(self.adult_nodes)
-        random.shuffle(parents_shuffle)
+        self.rng.shuffle(parents_shuffle)
         parents_splits = []
         divisor = 2
         len_sum = 0
@@ -174,7 +300,7 @@ class EpsimGraph:
             self.adult_nodes.add(new_node)
             self.household_nbrs[new_node] = set()
             # interhousehold
-            rel_node = random.choice(children_parent_nodes)
+            rel_node = self.rng.choice(children_parent_nodes)
             relatives = self.household_nbrs[rel_node] | {rel_node}
             self.interhousehold_nbrs[new_node] = relatives
             for rel in relatives:
@@ -190,7 +316,7 @@ class EpsimGraph:
             self.adult_nodes.add(new_pair_node)
             self.household_nbrs[new_pair_node] = {new_node}
             # interhousehold
-            rel_node = random.choice(children_parent_nodes)
+            rel_node = self.rng.choice(children_parent_nodes)
             relatives = self.household_nbrs[rel_node] | {rel_node}
             self.interhousehold_nbrs[new_node] = relatives
             self.interhousehold_nbrs[new_pair_node] = relatives
@@ -198,72 +324,118 @@ class EpsimGraph:
                 self.interhousehold_nbrs[rel] = {new_node, new_pair_node}
         self.id_bump += num_pairs * 2
 
+
+    def create_households_vectorized(self):
+        """Create the same household structure as create_households, with all random choices drawn at once"""
+        rng = np.random.default_rng(self.rng.getrandbits(64))
+        k = self.k
+        if self.print_progress:
+            print("households: child-parent pairs, parents: 1/2 no change, 1/4 merge 2, 1/8 merge 3, ..., duplicate (vectorized)")
+
+        # random child-parent pairs: parent k + i has child child_of_parent[i]
+        child_of_parent = rng.permutation(k)
+
+        # shuffled parents are split into 1/2 groups of 1, 1/4 groups of 2, 1/8 groups of 3, ... of which the first parent is kept
+        group_sizes = []
+        divisor = 2
+        merge_size = 1
+        len_sum = 0
+        while len_sum < k:
+            split_len = min(int(math.ceil(k / divisor)), k - len_sum)
+            group_sizes += chunk_sizes(split_len, merge_size)
+            len_sum += split_len
+            divisor *= 2
+            merge_size += 1
+        group_sizes = np.array(group_sizes, dtype=np.int64)
+        num_families = len(group_sizes)
+        parents = k + rng.permutation(k)
+        kept = parents[np.cumsum(group_sizes) - group_sizes]
+
+        # every kept parent gets a duplicate, ids are assigned in the order of the kept parents
+        duplicates = np.empty(num_families, dtype=np.int64)
+        duplicates[np.argsort(kept)] = self.id_bump + np.arange(num_families)
+        self.id_bump += num_families
+
+        # family: kept parent, its duplicate and the children of all parents of the group
+        family_sizes = group_sizes + 2
+        family_starts = np.cumsum(family_sizes) - family_sizes
+        members = np.empty(family_sizes.sum(), dtype=np.int64)
+        is_child = np.ones(len(members), dtype=bool)
+        is_child[family_starts] = False
+        is_child[family_starts + 1] = False
+        members[family_starts] = kept
+        members[family_starts + 1] = duplicates
+        members[is_child] = child_of_parent[parents - k]
+
+        for node in np.setdiff1d(parents, kept).tolist():
+            self.nodes.pop(node)
+        self.nodes.update(dict.fromkeys(duplicates.tolist(), True))
+        self.adult_nodes = set(kept.tolist()) | set(duplicates.tolist())
+
+        # adults: add adult singles and adults in pairs (node and node + num_pairs)
+        num_singles = int(self.n * 0.17)
+        num_pairs = int(self.n * 0.28 / 2)
+        singles = np.arange(self.id_bump, self.id_bump + num_singles)
+        pairs = np.arange(self.id_bump + num_singles, self.id_bump + num_singles + num_pairs)
+        self.adult_nodes.update(range(self.id_bump, self.id_bump + num_singles + num_pairs * 2))
+        self.id_bump += num_singles + num_pairs * 2
+        self.add_edges('household', *clique_edges(members, family_sizes), members)
+        self.add_edges('household', np.concatenate((pairs, pairs + num_pairs)), np.concatenate((pairs + num_pairs, pairs)),
+                       np.concatenate((singles, pairs, pairs + num_pairs)))
+
+        # interhousehold: every single and pair (linker) visits the family of a uniformly chosen family member,
+        # every family member visits the last linker that has chosen its family
+        member_family = np.repeat(np.arange(num_families), family_sizes)
+        linked_family = member_family[rng.integers(len(members), size=num_singles + num_pairs)]
+        linker_sizes = np.concatenate((np.ones(num_singles, dtype=np.int64), np.full(num_pairs, 2, dtype=np.int64)))
+        linker_starts = np.cumsum(linker_sizes) - linker_sizes
+        linker_nodes = np.concatenate((singles, np.column_stack((pairs, pairs + num_pairs)).ravel()))
+        node_family = np.repeat(linked_family, linker_sizes)
+        self.add_edges('interhousehold', np.repeat(linker_nodes, family_sizes[node_family]),
+                       members[concat_ranges(family_starts[node_family], family_sizes[node_family])], linker_nodes)
+
+        families, last_reversed = np.unique(linked_family[::-1], return_index=True)
+        member_linker = np.repeat(len(linked_family) - 1 - last_reversed, family_sizes[families])
+        family_members = members[concat_ranges(family_starts[families], family_sizes[families])]
+        self.add_edges('interhousehold', np.repeat(family_members, linker_sizes[member_linker]),
+                       linker_nodes[concat_ranges(linker_starts[member_linker], linker_sizes[member_linker])], family_members)
+
+
+    def create_school_classes(self):
         # children: k/l^2 many l*l grids, randomly place l^2 nodes on grid, cluster 8-neighborhood
         # perc_split_classes of grids (school classes) are divided into 2, with a sparser grid
-        l = 5
+        l = self.class_grid_size
         if self.print_progress:
             print(f"children: {self.k}/{l}^2 many {l}*{l} grids, randomly place {l}^2 nodes on grid, cluster 8-nbrhood")
             print(f"{self.perc_split_classes*100:.0f}% of grids (school classes) are divided into 2, with a sparser grid")
         children_shuffle = list(self.child_nodes)
-        random.shuffle(children_shuffle)
-        children_splits = list(chunks(children_shuffle, l*l))
-        if len(children_splits[-1]) != l*l:  # skip remainder
-            children_splits = children_splits[:-1]
-
-        def make_grid(skip, splits):
-            adjlist = {}
-
-            for children_split in splits:
-                grid = np.reshape(children_split, (l, l))
-
-                for i, j in np.ndindex(grid.shape):
-                    node = grid[i][j]
-                    nbrs = []
-
-                    # skip nodes where (i+j) % 2 == skip 
-                    # running with skip={1,2} gives split classes, while skip>=2 has no effect
-                    if (i + j) % 2 == skip:
-                        continue
-
-                    def addUnlessSkip(i,j):
-                        if (i + j) % 2 != skip:
-                            nbrs.append(grid[i][j])
-
-                    if i > 0:
-                        addUnlessSkip(i-1,j)
-                        if j > 0:
-                            addUnlessSkip(i-1,j-1)
-                        if j < l - 1:
-                            addUnlessSkip(i-1,j+1)
-                        
-                    if j > 0:
-                        addUnlessSkip(i,j-1)
-                    if j < l - 1:
-                        addUnlessSkip(i,j+1)
-
-                    if i < l - 1:
-                        addUnlessSkip(i+1,j)
-                        if j > 0:
-                            addUnlessSkip(i+1,j-1)
-                        if j < l - 1:
-                            addUnlessSkip(i+1,j+1)
-
-                    adjlist[node] = set(nbrs)
-            return adjlist
-
-        brkpnt = int(len(children_splits) * self.perc_split_classes)
-        self.school_nbrs_split = [make_grid(x, children_splits[:brkpnt]) for x in {0,1}]
-        self.school_nbrs_standard = make_grid(2, children_splits[brkpnt:])
+        self.rng.shuffle(children_shuffle)
+        num_classes = len(children_shuffle) // (l*l)  # skip remainder
+        grids = np.reshape(children_shuffle[:num_classes * l*l], (num_classes, l, l))
+        brkpnt = int(num_classes * self.perc_split_classes)
+        if self.vectorized:
+            for edge_type, class_grids, skip in [('school_split_0', grids[:brkpnt], 0), ('school_split_1', grids[:brkpnt], 1),
+                                                 ('school_standard', grids[brkpnt:], 2)]:
+                self.add_edges(edge_type, *grid_edges(class_grids, skip))
+            num_split = sum(len(entries) for edge_type in ['school_split_0', 'school_split_1'] for entries in self.entries[edge_type])
+            num_standard = sum(len(entries) for entries in self.entries['school_standard'])
+        else:
+            self.school_nbrs_split = [grid_nbrs(grids[:brkpnt], x) for x in {0,1}]
+            self.school_nbrs_standard = grid_nbrs(grids[brkpnt:], 2)
+            num_split = len(self.school_nbrs_split[0]) + len(self.school_nbrs_split[1])
+            num_standard = len(self.school_nbrs_standard)
         if self.print_progress:
-            print(f"{len(self.school_nbrs_split[0]) + len(self.school_nbrs_split[1])} children in split classes, " \
-                + f"{len(self.school_nbrs_standard)} children in standard classes ({len(children_shuffle)} total, break: {brkpnt})")
+            print(f"{num_split} children in split classes, " \
+                + f"{num_standard} children in standard classes ({len(children_shuffle)} total, break: {brkpnt})")
 
+
+    def create_offices(self):
         # adults: cluster 1-sigma_office no change, sigma_office*1/2 cluster 2 nodes, sigma_office*1/4 cluster 3 nodes, 
         # sigma_office*1/8 cluster 4 nodes, sigma_office*1/8 cluster 5 nodes
         if self.print_progress:
             print(f"adults: cluster 1-{self.sigma_office} no change, {self.sigma_office}*1/2 cluster 2, {self.sigma_office}*1/4 cluster 3, ...")
         adults_shuffle = list(self.adult_nodes)
-        random.shuffle(adults_shuffle)
+        self.rng.shuffle(adults_shuffle)
         adults_splits = []
         divisor = 2
         cap = 16
@@ -293,3 +465,31 @@ class EpsimGraph:
                     nbrs.remove(node)
                     self.office_nbrs[node] = nbrs
             cluster_size += 1
+
+
+    def create_offices_vectorized(self):
+        """Create the same office structure as create_offices, with all random choices drawn at once"""
+        rng = np.random.default_rng(self.rng.getrandbits(64))
+        num_adults = len(self.adult_nodes)
+        if self.print_progress:
+            print(f"adults: cluster 1-{self.sigma_office} no change, {self.sigma_office}*1/2 cluster 2, {self.sigma_office}*1/4 cluster 3, ... (vectorized)")
+        adults = rng.permutation(np.fromiter(self.adult_nodes, dtype=np.int64, count=num_adults))
+
+        # split sizes as in create_offices: 1-sigma_office without office nbrs, then sigma_office*1/2 in clusters of 2, ...
+        num_alone = min(int(math.ceil(num_adults * (1 - self.sigma_office))), num_adults)
+        cluster_sizes = []
+        divisor = 2
+        cap = 16
+        cluster_size = 2
+        len_sum = num_alone
+        while len_sum < num_adults:
+            split_len = min(int(math.ceil(num_adults * self.sigma_office / divisor)), num_adults - len_sum)
+            cluster_sizes += chunk_sizes(split_len, cluster_size)
+            len_sum += split_len
+            cluster_size += 1
+            divisor *= 2
+            if divisor > cap:
+                cluster_sizes += chunk_sizes(num_adults - len_sum, cluster_size)
+                break
+
+        self.add_edges('office', *clique_edges(adults[num_alone:], cluster_sizes), adults)
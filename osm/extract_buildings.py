@@ -1,125 +1,612 @@
+import os
+import json
 import xml.etree.ElementTree as ET
+from array import array
 from parse_osm import *
 import numpy as np
-import csv
-
-
-def write_line(f, cat, tag, x, y, sqm):
-    f.write(f"{cat},{tag},{x},{y},{sqm}\n")
-
-
-def extract_houses(root, node_list, outpath):
-    # https://wiki.openstreetmap.org/wiki/Key:building
-    house_building_types = ['yes', 'apartments', 'detached', 'house', 'residential', 'semidetached_house', 'terrace', 'dormitory']
-    with open(outpath, 'a') as f:
-        for c1 in root:
-            if c1.tag == 'way':
-                tags = get_tags(c1)
-                building_tag = tags.get('building')
-                if building_tag in house_building_types:
-                    if not (tags.get('man_made') or tags.get('amenity') or tags.get('layer')):  # filter out other structures
-                        p = get_polygon_from_way(c1, node_list)
-                        if p:
-                            x, y, sqm = get_polygon_x_y_sqm(p)
-                            if building_tag == 'yes':
-                                if sqm > 50 and sqm < 400:  # filter out very small and large unspecified buildings
-                                    write_line(f, 'house', building_tag, x, y, sqm)
-                            else:
-                                if 'building:levels' in tags and tags['building:levels'].isnumeric():
-                                    levels = int(tags['building:levels'])
-                                else:
-                                    levels = 1
-                                write_line(f, 'house', building_tag, x, y, sqm * levels)
-
-
-def extract_shops(root, node_list, outpath):
+import argparse
+import multiprocessing
+from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from building_store import BuildingStore, BUILDING_STORE_SUFFIX
+from array_file import write_array_file, read_array_file
+from csrgraph import gather_nbrs
+
+
+class CsvWriter:
+    def __init__(self, path):
+        self.f = open(path, 'w')
+        self.f.write("building_type,tag,longitude,latitude,sqm\n")
+
+
+    def write_line(self, cat, tag, x, y, sqm, element=None):
+        self.f.write(f"{cat},{tag},{x},{y},{sqm}\n")
+
+
+    def close(self):
+        self.f.close()
+
+
+class BuildingStoreWriter:
+    def __init__(self, path):
+        """
+        Collect the buildings in columns and write them in Hilbert order as building store (see building_store.py) on close,
+        with the OSM elements of the buildings if they are known for all of them.
+        """
+        self.path = path
+        self.columns = ([], [], [], [], [])
+        self.elements = []
+
+
+    def write_line(self, cat, tag, x, y, sqm, element=None):
+        for column, value in zip(self.columns, (cat, tag, float(x), float(y), int(sqm))):
+            column.append(value)
+        self.elements.append(element)
+
+
+    def store(self):
+        """Return the buildings written so far in write order"""
+        if None in self.elements:
+            return BuildingStore.from_columns(*self.columns)
+        osm_types, osm_ids = zip(*self.elements) if self.elements else ((), ())
+        return BuildingStore.from_columns(*self.columns, osm_types, osm_ids)
+
+
+    def close(self):
+        self.store().sorted_spatially().save(self.path)
+
+
+def open_output(outpath):
+    """Return the writer of the output file, building store for the suffix .buildings, else csv"""
+    return BuildingStoreWriter(outpath) if outpath.endswith(BUILDING_STORE_SUFFIX) else CsvWriter(outpath)
+
+
+# https://wiki.openstreetmap.org/wiki/Key:building
+house_building_types = ['yes', 'apartments', 'detached', 'house', 'residential', 'semidetached_house', 'terrace', 'dormitory']
+
+# https://wiki.openstreetmap.org/wiki/Key:amenity
+# https://wiki.openstreetmap.org/wiki/Key:leisure
+restaurant_tags = ['biergarten', 'cafe', 'fast_food', 'food_court', 'ice_cream', 'restaurant']
+nightlife_tags = ['bar', 'pub', 'nightclub', 'stripclub', 'swingerclub', 'brothel']
+entertainment_tags = ['arts_centre', 'casino', 'cinema', 'community_centre', 'conference_centre', 'events_venue', 'gambling',
+                      'social_centre', 'theatre']
+leisure_tags = ['adult_gaming_centre', 'amusement_arcade', 'bowling_alley', 'dance', 'escape_game', 'fitness_centre', 'hackerspace',
+                'sauna', 'sports_centre', 'sports_hall']
+
+
+class PolygonBatch:
+    def __init__(self, out, size=65536):
+        """
+        Collects the rows of the extract_*_element functions in element order and writes them to out, polygons are measured
+        batchwise with calc_polygons_x_y_sqm when size polygons are pending and on flush.
+        """
+        self.out = out
+        self.size = size
+        self.pending = []  # (vertices, row function, element) of a polygon or (None, row, element)
+        self.num_polygons = 0
+        self.element = None
+
+
+    def start_element(self, c1):
+        """Set the OSM element (type, id) of the following rows"""
+        self.element = (c1.tag, int(c1.attrib['id'])) if 'id' in c1.attrib else None  # e.g. bounds
+
+
+    def write_line(self, cat, tag, x, y, sqm):
+        self.pending.append((None, (cat, tag, x, y, sqm), self.element))
+
+
+    def add(self, vertices, row):
+        """Add a polygon, row(x, y, sqm) returns the row of the polygon with its centroid and area, or None to skip it"""
+        self.pending.append((vertices, row, self.element))
+        self.num_polygons += 1
+        if self.num_polygons >= self.size:
+            self.flush()
+
+
+    def flush(self):
+        x, y, sqm = calc_polygons_x_y_sqm([vertices for vertices, _, _ in self.pending if vertices is not None])
+        x, y, sqm = x.tolist(), y.tolist(), sqm.tolist()
+        i = 0
+        for vertices, item, element in self.pending:
+            if vertices is not None:
+                item = item(x[i], y[i], sqm[i])
+                i += 1
+            if item is not None:
+                self.out.write_line(*item, element)
+        self.pending = []
+        self.num_polygons = 0
+
+
+# The extract_*_element functions write the buildings of one OSM element c1 with its tags to a PolygonBatch, after
+# start_element(c1) of the batch, get_vertices() returns the polygon of a way as array of its nodes.
+
+def extract_house_element(c1, tags, get_vertices, out):
+    if c1.tag == 'way':
+        building_tag = tags.get('building')
+        if building_tag in house_building_types:
+            if not (tags.get('man_made') or tags.get('amenity') or tags.get('layer')):  # filter out other structures
+                vertices = get_vertices()
+                if vertices is not None:
+                    if building_tag == 'yes':
+                        def row(x, y, sqm):
+                            if sqm > 50 and sqm < 400:  # filter out very small and large unspecified buildings
+                                return 'house', building_tag, x, y, sqm
+                            return None
+                    else:
+                        if 'building:levels' in tags and tags['building:levels'].isnumeric():
+                            levels = int(tags['building:levels'])
+                        else:
+                            levels = 1
+                        def row(x, y, sqm):
+                            return 'house', building_tag, x, y, sqm * levels
+                    out.add(vertices, row)
+
+
+def extract_shop_element(c1, tags, get_vertices, out):
     # https://wiki.openstreetmap.org/wiki/Key:shop
     # [1] https://de.statista.com/statistik/daten/studie/289775/umfrage/verkaufsflaeche-je-filiale-der-unternehmen-im-lebensmittelhandel-in-oesterreich/
     # [2] https://de.statista.com/statistik/daten/studie/297045/umfrage/verkaufsflaeche-der-groessten-lebensmittelhaendler-in-oesterreich/
     # [3] https://de.statista.com/statistik/daten/studie/895728/umfrage/verkaufsflaeche-im-stationaeren-einzelhandel-in-oesterreich/
     # [4] https://de.statista.com/statistik/daten/studie/283959/umfrage/unternehmen-im-einzelhandel-in-oesterreich/
     # [5] https://de.statista.com/statistik/daten/studie/1191398/umfrage/shopgroesse-in-ausgewaehlten-staedten-und-einkaufsstrassen-in-oesterreich/
-    with open(outpath, 'a') as f:
-        for c1 in root:
-            tags = get_tags(c1)
-            if tags.get('shop'):
-                shop_tag = tags['shop']
-                if c1.tag == 'way':
-                    p = get_polygon_from_way(c1, node_list)
-                    if not p:
-                        continue
-                    sqm = int(calc_geom_area(p))
-                    x = p.centroid.x
-                    y = p.centroid.y
-                elif c1.tag == 'node':
-                    x = c1.attrib['lon']
-                    y = c1.attrib['lat']
-                    if shop_tag == 'supermarket':
-                        sqm = 525  # default sqm for supermarket: avg in Austria ~700sqm [1][2], but should be smaller for urban regions
-                    else:
-                        sqm = 114  # default sqm for shop: avg in Austria ~368sqm [3][4], in Salzburg 114sqm [5]
-                else:
-                    continue
-                if shop_tag == 'supermarket':
-                    write_line(f, 'supermarket', shop_tag, x, y, sqm)
-                else:
-                    write_line(f, 'shop', shop_tag, x, y, sqm)
-
-
-def extract_leisure(root, node_list, outpath):
-    # https://wiki.openstreetmap.org/wiki/Key:amenity
-    # https://wiki.openstreetmap.org/wiki/Key:leisure
-    restaurant_tags = ['biergarten', 'cafe', 'fast_food', 'food_court', 'ice_cream', 'restaurant']
-    nightlife_tags = ['bar', 'pub', 'nightclub', 'stripclub', 'swingerclub', 'brothel']
-    entertainment_tags = ['arts_centre', 'casino', 'cinema', 'community_centre', 'conference_centre', 'events_venue', 'gambling',
-                          'social_centre', 'theatre']
-    leisure_tags = ['adult_gaming_centre', 'amusement_arcade', 'bowling_alley', 'dance', 'escape_game', 'fitness_centre', 'hackerspace',
-                    'sauna', 'sports_centre', 'sports_hall']
-    with open(outpath, 'a') as f:
-        for c1 in root:
-            tags = get_tags(c1)
-            amenity_tag = tags.get('amenity')
-            leisure_tag = tags.get('leisure')
-            if amenity_tag or leisure_tag:
-                if c1.tag == 'way':
-                    p = get_polygon_from_way(c1, node_list)
-                    if not p:
-                        continue
-                    sqm = int(calc_geom_area(p))
-                    x = p.centroid.x
-                    y = p.centroid.y
-                elif c1.tag == 'node':
-                    x = c1.attrib['lon']
-                    y = c1.attrib['lat']
-                    sqm = 500  # default sqm
-                else:
-                    continue
-                if amenity_tag in restaurant_tags:
-                    write_line(f, 'restaurant', amenity_tag, x, y, sqm)
-                elif amenity_tag in nightlife_tags:
-                    write_line(f, 'nightlife', amenity_tag, x, y, sqm)
-                elif leisure_tag in nightlife_tags:
-                    write_line(f, 'nightlife', leisure_tag, x, y, sqm)
-                elif amenity_tag in entertainment_tags and tags.get('access') != 'private':
-                    write_line(f, 'leisure', amenity_tag, x, y, sqm)
-                elif leisure_tag in leisure_tags and tags.get('access') != 'private':
-                    write_line(f, 'leisure', leisure_tag, x, y, sqm)
+    if tags.get('shop'):
+        shop_tag = tags['shop']
+        cat = 'supermarket' if shop_tag == 'supermarket' else 'shop'
+        if c1.tag == 'way':
+            vertices = get_vertices()
+            if vertices is not None:
+                out.add(vertices, lambda x, y, sqm: (cat, shop_tag, x, y, sqm))
+        elif c1.tag == 'node':
+            if shop_tag == 'supermarket':
+                sqm = 525  # default sqm for supermarket: avg in Austria ~700sqm [1][2], but should be smaller for urban regions
+            else:
+                sqm = 114  # default sqm for shop: avg in Austria ~368sqm [3][4], in Salzburg 114sqm [5]
+            out.write_line(cat, shop_tag, c1.attrib['lon'], c1.attrib['lat'], sqm)
 
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("usage: python extract_buildings.py osm_file outfile")
-        exit(0)
+def leisure_category(tags):
+    """Return the location type and tag of the amenity and leisure tags, None if it is no location"""
+    amenity_tag = tags.get('amenity')
+    leisure_tag = tags.get('leisure')
+    if amenity_tag in restaurant_tags:
+        return 'restaurant', amenity_tag
+    elif amenity_tag in nightlife_tags:
+        return 'nightlife', amenity_tag
+    elif leisure_tag in nightlife_tags:
+        return 'nightlife', leisure_tag
+    elif amenity_tag in entertainment_tags and tags.get('access') != 'private':
+        return 'leisure', amenity_tag
+    elif leisure_tag in leisure_tags and tags.get('access') != 'private':
+        return 'leisure', leisure_tag
+    return None
+
+
+def extract_leisure_element(c1, tags, get_vertices, out):
+    if tags.get('amenity') or tags.get('leisure'):
+        category = leisure_category(tags)
+        if c1.tag == 'way':
+            vertices = get_vertices()
+            if vertices is not None and category is not None:
+                out.add(vertices, lambda x, y, sqm: (*category, x, y, sqm))
+        elif c1.tag == 'node' and category is not None:
+            out.write_line(*category, c1.attrib['lon'], c1.attrib['lat'], 500)  # default sqm
+
+
+def extract_houses(root, node_list, out):
+    batch = PolygonBatch(out)
+    for c1 in root:
+        batch.start_element(c1)
+        extract_house_element(c1, get_tags(c1), lambda: get_vertices_from_way(c1, node_list), batch)
+    batch.flush()
+
+
+def extract_shops(root, node_list, out):
+    batch = PolygonBatch(out)
+    for c1 in root:
+        batch.start_element(c1)
+        extract_shop_element(c1, get_tags(c1), lambda: get_vertices_from_way(c1, node_list), batch)
+    batch.flush()
+
+
+def extract_leisure(root, node_list, out):
+    batch = PolygonBatch(out)
+    for c1 in root:
+        batch.start_element(c1)
+        extract_leisure_element(c1, get_tags(c1), lambda: get_vertices_from_way(c1, node_list), batch)
+    batch.flush()
+
+
+WAY_INDEX_MAGIC = b"EPSIMWAY"
+WAY_INDEX_VERSION = 1
+way_index_tag_keys = ['building', 'shop', 'amenity', 'leisure']
+
+
+def may_be_building(tags):
+    # the extract_*_element functions only write elements with any of these tags
+    return any(key in tags for key in way_index_tag_keys)
+
+
+class WayIndex:
+    def __init__(self, ids, indptr, refs, tags):
+        """
+        Node ids and tags of the ways that may be buildings, which update_buildings.py needs to extract a way again when its
+        nodes change. The nodes of the way ids[i] are refs[indptr[i]:indptr[i+1]] and its tags are tags[i], ids are sorted.
+        """
+        self.ids = ids
+        self.indptr = indptr
+        self.refs = refs
+        self.tags = tags
+
 
-    tree = ET.parse(sys.argv[1])
-    outpath = sys.argv[2]
+    @classmethod
+    def from_ways(cls, ways):
+        """Create the index of the ways that may be buildings from a list of (way id, node ids, tags) of ways"""
+        ways = sorted((way for way in ways if may_be_building(way[2])), key=lambda way: way[0])
+        indptr = np.zeros(len(ways) + 1, dtype=np.int64)
+        np.cumsum([len(refs) for _, refs, _ in ways], out=indptr[1:])
+        refs = np.fromiter((ref for _, way_refs, _ in ways for ref in way_refs), dtype=np.int64, count=indptr[-1])
+        return cls(np.array([way_id for way_id, _, _ in ways], dtype=np.int64), indptr, refs, [tags for _, _, tags in ways])
 
-    root = tree.getroot()
-    node_list = build_node_list(root)
 
-    with open(outpath, 'w') as f:
-        f.write("building_type,tag,longitude,latitude,sqm\n")
+    def __len__(self):
+        return len(self.ids)
+
+
+    def element(self, i):
+        """Return way i as OSM way element"""
+        way = ET.Element('way', id=str(self.ids[i]))
+        for ref in self.refs[self.indptr[i]:self.indptr[i + 1]].tolist():
+            ET.SubElement(way, 'nd', ref=str(ref))
+        for k, v in self.tags[i].items():
+            ET.SubElement(way, 'tag', k=k, v=v)
+        return way
+
+
+    def elements(self):
+        return [self.element(i) for i in range(len(self))]
+
+
+    def take(self, rows):
+        """Return the index of the ways rows, in this order"""
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(np.diff(self.indptr)[rows], out=indptr[1:])
+        return WayIndex(self.ids[rows], indptr, gather_nbrs(self.indptr, self.refs, rows), [self.tags[i] for i in rows.tolist()])
+
+
+    def replace_ways(self, way_ids, ways):
+        """Return the index without the ways way_ids and with the ways of a list of (way id, node ids, tags), e.g. the changed ways"""
+        new = WayIndex.from_ways(ways)
+        both = WayIndex(np.concatenate((self.ids, new.ids)), np.concatenate((self.indptr, self.indptr[-1] + new.indptr[1:])),
+                        np.concatenate((self.refs, new.refs)), self.tags + new.tags)
+        rows = np.concatenate((np.flatnonzero(~np.isin(self.ids, way_ids)), len(self) + np.arange(len(new))))
+        return both.take(rows[np.argsort(both.ids[rows], kind='stable')])
+
+
+    def ways_with_nodes(self, node_ids):
+        """Return the ids of the ways with any of the given nodes"""
+        has_node = np.isin(self.refs, node_ids)
+        return np.unique(np.repeat(self.ids, np.diff(self.indptr))[has_node])
+
+
+    def save(self, path):
+        write_array_file(path, WAY_INDEX_MAGIC, WAY_INDEX_VERSION, {'ids': self.ids, 'indptr': self.indptr, 'refs': self.refs},
+                         {'tags': self.tags})
+
+
+    @classmethod
+    def load(cls, path):
+        arrays, meta = read_array_file(path, WAY_INDEX_MAGIC, WAY_INDEX_VERSION, mmap=False)
+        return cls(arrays['ids'], arrays['indptr'], arrays['refs'], meta['tags'])
+
+
+class WayIndexWriter:
+    chunk_size = 1 << 16  # ways buffered before they are appended to the temporary files
+
+    def __init__(self, path):
+        """
+        Write the ways that may be buildings to a WayIndex file at path while they are parsed. The ways are appended in batches
+        to the temporary files path.ids.tmp, path.sizes.tmp, path.refs.tmp and path.tags.tmp (json lines) instead of being kept
+        in memory during the extraction, close sorts them by id and writes the index.
+        """
+        self.path = path
+        self.tmp_paths = [path + suffix for suffix in ('.ids.tmp', '.sizes.tmp', '.refs.tmp', '.tags.tmp')]
+        for tmp_path in self.tmp_paths:
+            open(tmp_path, 'wb').close()
+        self.clear_pending()
+
+
+    def clear_pending(self):
+        self.pending = (array('q'), array('q'), array('q'), [])
+
+
+    def add(self, way_id, refs, tags):
+        """Add a way with its node ids and tags, ways that cannot be buildings are skipped"""
+        if not may_be_building(tags):
+            return
+        ids, sizes, pending_refs, pending_tags = self.pending
+        ids.append(way_id)
+        sizes.append(len(refs))
+        pending_refs.extend(refs)
+        pending_tags.append(json.dumps(tags) + '\n')
+        if len(ids) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        # append the pending ways to the files
+        for tmp_path, values in zip(self.tmp_paths[:3], self.pending[:3]):
+            with open(tmp_path, 'ab') as f:
+                values.tofile(f)
+        with open(self.tmp_paths[3], 'a') as f:
+            f.writelines(self.pending[3])
+        self.clear_pending()
+
+
+    def close(self):
+        self.flush()
+        ids, sizes, refs = (np.fromfile(tmp_path, dtype=np.int64) for tmp_path in self.tmp_paths[:3])
+        with open(self.tmp_paths[3]) as f:
+            tags = [json.loads(line) for line in f]
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=indptr[1:])
+        way_index = WayIndex(ids, indptr, refs, tags)
+        if np.any(np.diff(ids) < 0):  # OSM files list the ways sorted by id
+            way_index = way_index.take(np.argsort(ids, kind='stable'))
+        way_index.save(self.path)
+        for tmp_path in self.tmp_paths:
+            os.remove(tmp_path)
+
+
+def build_way_index(root):
+    return WayIndex.from_ways([(int(c1.attrib['id']), get_nodes(c1), get_tags(c1)) for c1 in root if c1.tag == 'way'])
+
+
+class RowList:
+    """Writer that keeps the rows in a list"""
+    def __init__(self):
+        self.rows = []
+
+
+    def write_line(self, cat, tag, x, y, sqm, element=None):
+        self.rows.append((cat, tag, x, y, sqm, element))
+
+
+def find_element(f, pos, tags, block_size=1 << 20):
+    """Return the byte offset of the first start tag of an element of tags (e.g. b'way') at or after pos in the binary file f, None if there is none"""
+    patterns = [b'<' + tag for tag in tags]
+    overlap = max(len(pattern) for pattern in patterns) + 1
+    while True:
+        f.seek(pos)
+        block = f.read(block_size + overlap)
+        found = []
+        for pattern in patterns:
+            i = block.find(pattern)
+            while i != -1 and i < block_size:
+                # < is escaped in attribute values and text, so it always starts a tag, the name must not continue (e.g. <wayx)
+                if block[i + len(pattern):i + len(pattern) + 1] in (b' ', b'\t', b'\r', b'\n', b'>', b'/'):
+                    found.append(i)
+                    break
+                i = block.find(pattern, i + 1)
+        if found:
+            return pos + min(found)
+        if len(block) <= block_size:
+            return None
+        pos += block_size
+
+
+def find_shards(osm_path, shard_bytes):
+    """
+    Split an OSM file into byte ranges of about shard_bytes that start at an element and return (node shards, way shards) as
+    lists of (start, stop). The way shards hold the ways and relations, which follow the nodes in OSM files.
+    """
+    with open(osm_path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(size - 4096, 0))
+        tail = f.read()
+        if tail.rfind(b'</osm>') == -1:
+            raise ValueError(f"{osm_path} does not end with </osm>")
+        end = size - len(tail) + tail.rfind(b'</osm>')
+        first_way = find_element(f, 0, (b'way', b'relation'))
+        first_way = end if first_way is None else min(first_way, end)
+        first_node = find_element(f, 0, (b'node',))
+        first_node = first_way if first_node is None else min(first_node, first_way)
+
+        def split(start, stop, tags):
+            bounds = [start]
+            for pos in range(start + shard_bytes, stop, shard_bytes):
+                if pos > bounds[-1]:  # else the previous shard was extended past pos to the next element
+                    next_element = find_element(f, pos, tags)
+                    bounds.append(stop if next_element is None else min(next_element, stop))
+            bounds.append(stop)
+            return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+        return split(first_node, first_way, (b'node',)), split(first_way, end, (b'way', b'relation'))
+
+
+def parse_shard(osm_path, start, stop, block_size=1 << 20):
+    """Yield the elements of the byte range start:stop of an OSM file, which is parsed incrementally, each element is cleared after use"""
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parser.feed(b'<osm>')
+    root = None
+    def elements():
+        nonlocal root
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+            elif elem.tag in ('node', 'way', 'relation'):
+                yield elem
+                elem.clear()
+                root.clear()
+    with open(osm_path, 'rb') as f:
+        f.seek(start)
+        while start < stop:
+            data = f.read(min(block_size, stop - start))
+            start += len(data)
+            parser.feed(data)
+            yield from elements()
+    parser.feed(b'</osm>')
+    parser.close()
+    yield from elements()
+
+
+# OSM file and node coordinates of the worker process, set by the pool initializer, without node coordinates the workers
+# extract node shards
+worker_osm_path = None
+worker_node_list = None
+
+
+def init_worker(osm_path, node_store_path=None, node_list=None):
+    global worker_osm_path, worker_node_list
+    worker_osm_path = osm_path
+    worker_node_list = NodeStore.open(node_store_path) if node_store_path is not None else node_list
+
+
+def extract_shard(shard):
+    """
+    Stream-parse the byte range shard = (start, stop) of the OSM file and return the house, shop and leisure rows, each in
+    element order, the ids and coordinates of the nodes (of a node shard) and the ways that may be buildings as list of
+    (way id, node ids, tags).
+    """
+    outs = (RowList(), RowList(), RowList())
+    batches = [PolygonBatch(out) for out in outs]
+    node_ids = array('q')
+    node_coords = array('d')
+    ways = []
+    for elem in parse_shard(worker_osm_path, *shard):
+        if elem.tag == 'node':
+            if worker_node_list is not None:
+                raise ValueError(f"node {elem.attrib['id']} follows the ways in {worker_osm_path}, the nodes must come first")
+            node_ids.append(int(elem.attrib['id']))
+            node_coords.extend((float(elem.attrib['lon']), float(elem.attrib['lat'])))
+        tags = get_tags(elem)
+        if elem.tag == 'way' and may_be_building(tags):
+            ways.append((int(elem.attrib['id']), get_nodes(elem), tags))
+        vertices = []
+        def get_vertices():
+            if not vertices:
+                vertices.append(get_vertices_from_way(elem, worker_node_list))
+            return vertices[0]
+        for extract_element, batch in zip((extract_house_element, extract_shop_element, extract_leisure_element), batches):
+            batch.start_element(elem)
+            extract_element(elem, tags, get_vertices, batch)
+    for batch in batches:
+        batch.flush()
+    return ([out.rows for out in outs], np.frombuffer(node_ids, dtype=np.int64),
+            np.frombuffer(node_coords, dtype=np.float64).reshape(-1, 2), ways)
+
+
+def extract_parallel(osm_path, out, node_store_path=None, ways=None, num_processes=None, shard_bytes=1 << 24):
+    """
+    Extract all buildings like extract_houses, extract_shops and extract_leisure one after another, but in a pool of
+    num_processes processes (default: number of cpus) that each stream-parse shards of about shard_bytes bytes of the OSM file.
+    The node shards are parsed first and their coordinates collected in the returned NodeStore, then the way shards. The
+    shards are merged in order, so the output is the same as that of the sequential extraction.
+    node_store_path -- keep the node coordinates in files with this prefix instead of in memory, see NodeStore
+    ways            -- WayIndexWriter to which the ways are added, see WayIndex
+    """
+    node_shards, way_shards = find_shards(osm_path, shard_bytes)
+    node_list = NodeStore(node_store_path)
+    shop_rows = []
+    leisure_rows = []
+    with multiprocessing.Pool(num_processes, initializer=init_worker, initargs=(osm_path,)) as pool:
+        for (_, shops, leisure), node_ids, node_coords, _ in pool.imap(extract_shard, node_shards):
+            node_list.extend(node_ids, node_coords)
+            shop_rows.extend(shops)
+            leisure_rows.extend(leisure)
+    node_list.finish()  # sort the nodes once, not in every worker
+    # workers map an on disk store, an in memory store is passed to them
+    initargs = (osm_path, node_store_path) if node_store_path is not None else (osm_path, None, node_list)
+    with multiprocessing.Pool(num_processes, initializer=init_worker, initargs=initargs) as pool:
+        for (houses, shops, leisure), _, _, shard_ways in pool.imap(extract_shard, way_shards):
+            for row in houses:
+                out.write_line(*row)
+            shop_rows.extend(shops)
+            leisure_rows.extend(leisure)
+            if ways is not None:
+                for way in shard_ways:
+                    ways.add(*way)
+    for row in shop_rows + leisure_rows:
+        out.write_line(*row)
+    return node_list
+
+
+def extract_streaming(osm_path, out, node_store_path=None, ways=None):
+    """
+    Extract all buildings in one pass over the OSM file with incremental parsing. Every element is classified once by all
+    extract_*_element functions and cleared afterwards, such that only the node coordinates are kept.
+    The buildings are written in the order of the elements, instead of houses, shops and leisure locations one after another.
+    node_store_path -- keep the node coordinates in files with this prefix instead of in memory, see NodeStore
+    ways            -- WayIndexWriter to which the ways are added, see WayIndex
+    """
+    node_list = NodeStore(node_store_path)
+    batch = PolygonBatch(out)
+    root = None
+    for event, elem in ET.iterparse(osm_path, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            continue
+        if elem.tag not in ('node', 'way', 'relation'):
+            continue  # children of the elements, e.g. tag and nd, are processed with their element
+        if elem.tag == 'node':
+            node_list.add(int(elem.attrib['id']), float(elem.attrib['lon']), float(elem.attrib['lat']))
+        tags = get_tags(elem)
+        if ways is not None and elem.tag == 'way':
+            ways.add(int(elem.attrib['id']), get_nodes(elem), tags)
+        vertices = []
+        def get_vertices():
+            # the polygon of a way is resolved at most once, even if the way is written as house and location
+            if not vertices:
+                vertices.append(get_vertices_from_way(elem, node_list))
+            return vertices[0]
+        batch.start_element(elem)
+        extract_house_element(elem, tags, get_vertices, batch)
+        extract_shop_element(elem, tags, get_vertices, batch)
+        extract_leisure_element(elem, tags, get_vertices, batch)
+        elem.clear()
+        root.clear()  # drop the references of the root to the processed elements
+    batch.flush()
+    if node_store_path is not None and not node_list.is_finished():
+        node_list.finish()  # write the remaining nodes to the files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="extract houses and locations of an OSM file")
+    parser.add_argument('osm_file')
+    parser.add_argument('outfile', help=f"building store if it ends with {BUILDING_STORE_SUFFIX}, else csv")
+    parser.add_argument('--stream', action='store_true', help="single pass with incremental parsing and bounded memory")
+    parser.add_argument('--node-store', help="prefix of files that keep the node coordinates on disk instead of in memory")
+    parser.add_argument('--processes', type=int, nargs='?', const=0,
+                        help="stream-parse shards of the file in a pool of processes, without number: one per cpu")
+    parser.add_argument('--state', help="write the node coordinates (STATE.nodes.ids, STATE.nodes.coords) and the ways that may "
+                                        "be buildings (STATE.ways), which update_buildings.py needs to apply OSM change files")
+    args = parser.parse_args()
+    if args.state is not None:
+        if not args.outfile.endswith(BUILDING_STORE_SUFFIX):
+            parser.error(f"--state needs a building store output file ({BUILDING_STORE_SUFFIX})")
+        if args.node_store is not None:
+            parser.error("--state keeps the node coordinates in STATE.nodes, --node-store is not needed")
+        args.node_store = args.state + '.nodes'
 
-    extract_houses(root, node_list, outpath)
-    extract_shops(root, node_list, outpath)
-    extract_leisure(root, node_list, outpath)
+    out = open_output(args.outfile)
+    if args.stream or args.processes is not None:
+        ways = WayIndexWriter(args.state + '.ways') if args.state is not None else None
+        if args.processes is not None:
+            extract_parallel(args.osm_file, out, args.node_store, ways, args.processes or None)
+        else:
+            extract_streaming(args.osm_file, out, args.node_store, ways)
+        if ways is not None:
+            ways.close()
+    else:
+        root = ET.parse(args.osm_file).getroot()
+        node_list = build_node_store(root, args.node_store)
+        extract_houses(root, node_list, out)
+        extract_shops(root, node_list, out)
+        extract_leisure(root, node_list, out)
+        if args.state is not None:
+            if not node_list.is_finished():
+                node_list.finish()
+            build_way_index(root).save(args.state + '.ways')
+    out.close()
@@ -1,9 +1,7 @@
+import os
 import sys
-import xml.etree.ElementTree as ET
-import pyproj
-from shapely import ops
-from functools import partial
-from shapely.geometry import Polygon, Point
+from array import array
+import numpy as np
 import random
 
 
@@ -11,27 +9,224 @@ def build_node_list(root):
     return {int(c1.attrib['id']):(float(c1.attrib['lon']), float(c1.attrib['lat'])) for c1 in root if c1.tag == 'node'}
 
 
+class NodeStore:
+    chunk_size = 1 << 20  # nodes buffered before they are appended to the files of an on disk store
+
+    def __init__(self, path=None):
+        """
+        Coordinates of OSM nodes as sorted int64 id array and float64 (nodes x 2) array of longitude, latitude, in place of the
+        node dict of build_node_list. Nodes are added one by one and looked up in bulk per way with binary search.
+        path -- prefix of the files path.ids and path.coords that back the store as memory maps, None: in memory.
+                OSM files list the nodes sorted by id, only unsorted input is sorted in memory.
+        """
+        self.path = path
+        self.ids = np.empty(0, dtype=np.int64)
+        self.coords = np.empty((0, 2), dtype=np.float64)
+        self.pending_ids = array('q')
+        self.pending_coords = array('d')
+        self.num_stored = 0  # nodes in the files of an on disk store
+        if path is not None:
+            for suffix in ('.ids', '.coords'):
+                open(path + suffix, 'wb').close()
+
+
+    @classmethod
+    def open(cls, path):
+        """Open the files path.ids and path.coords of an on disk store that was finished before"""
+        store = cls()
+        store.path = path
+        store.num_stored = os.path.getsize(path + '.ids') // 8
+        if store.num_stored > 0:
+            store.ids = np.memmap(path + '.ids', dtype=np.int64, mode='r', shape=(store.num_stored,))
+            store.coords = np.memmap(path + '.coords', dtype=np.float64, mode='r', shape=(store.num_stored, 2))
+        return store
+
+
+    def __len__(self):
+        return max(len(self.ids), self.num_stored) + len(self.pending_ids)
+
+
+    def is_finished(self):
+        """Return whether all added nodes are available for lookup, else finish needs to be called"""
+        # nodes flushed to the files of an on disk store are not mapped before finish
+        return len(self.pending_ids) == 0 and (self.path is None or len(self.ids) == self.num_stored)
+
+
+    def add(self, node_id, lon, lat):
+        self.pending_ids.append(node_id)
+        self.pending_coords.extend((lon, lat))
+        if self.path is not None and len(self.pending_ids) >= self.chunk_size:
+            self.flush()
+
+
+    def extend(self, ids, coords):
+        """Add nodes in bulk, ids is an int64 array and coords a (nodes x 2) float64 array of longitude, latitude"""
+        self.pending_ids.frombytes(np.ascontiguousarray(ids, dtype=np.int64).tobytes())
+        self.pending_coords.frombytes(np.ascontiguousarray(coords, dtype=np.float64).tobytes())
+        if self.path is not None and len(self.pending_ids) >= self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        # append the pending nodes to the files
+        with open(self.path + '.ids', 'ab') as f:
+            self.pending_ids.tofile(f)
+        with open(self.path + '.coords', 'ab') as f:
+            self.pending_coords.tofile(f)
+        self.num_stored += len(self.pending_ids)
+        self.pending_ids = array('q')
+        self.pending_coords = array('d')
+
+
+    def finish(self):
+        """Make the added nodes available for lookup, called by lookup when nodes are pending"""
+        if self.path is not None:
+            self.flush()
+            if self.num_stored == 0:
+                return
+            self.ids = np.memmap(self.path + '.ids', dtype=np.int64, mode='r', shape=(self.num_stored,))
+            self.coords = np.memmap(self.path + '.coords', dtype=np.float64, mode='r', shape=(self.num_stored, 2))
+        else:
+            self.ids = np.concatenate((self.ids, np.frombuffer(self.pending_ids, dtype=np.int64)))
+            self.coords = np.concatenate((self.coords, np.frombuffer(self.pending_coords, dtype=np.float64).reshape(-1, 2)))
+            self.pending_ids = array('q')
+            self.pending_coords = array('d')
+
+        if not self.is_sorted():
+            order = np.argsort(self.ids, kind='stable')
+            ids = self.ids[order]
+            coords = self.coords[order]
+            if self.path is not None:
+                ids.tofile(self.path + '.ids')
+                coords.tofile(self.path + '.coords')
+                self.ids = np.memmap(self.path + '.ids', dtype=np.int64, mode='r', shape=(self.num_stored,))
+                self.coords = np.memmap(self.path + '.coords', dtype=np.float64, mode='r', shape=(self.num_stored, 2))
+            else:
+                self.ids = ids
+                self.coords = coords
+
+
+    def is_sorted(self):
+        # in chunks, such that an on disk store is not read into memory at once
+        for start in range(0, len(self.ids), self.chunk_size):
+            if np.any(np.diff(self.ids[start:start + self.chunk_size + 1]) < 0):
+                return False
+        return True
+
+
+    def update(self, ids, coords, removed_ids=()):
+        """
+        Add the nodes with the sorted ids and their coordinates, which replace stored nodes with the same ids, and remove the
+        nodes removed_ids. The new nodes are merged into the stored ones chunk by chunk, an on disk store is written to new
+        files without reading it into memory.
+        """
+        if not self.is_finished():
+            self.finish()
+        ids = np.asarray(ids, dtype=np.int64)
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        dropped = np.union1d(np.asarray(removed_ids, dtype=np.int64), ids)  # stored nodes that are removed or replaced
+        chunks = []
+        files = None
+        if self.path is not None:
+            # new files replace the old ones, such that arrays mapped from the old files stay valid
+            files = [open(self.path + suffix + '.tmp', 'wb') for suffix in ('.ids', '.coords')]
+        num_nodes = 0
+        num_chunks = max(-(-len(self.ids) // self.chunk_size), 1)
+        new_start = 0
+        for k in range(num_chunks):
+            start, stop = k * self.chunk_size, (k + 1) * self.chunk_size
+            chunk_ids = np.asarray(self.ids[start:stop])
+            chunk_coords = np.asarray(self.coords[start:stop])
+            pos = np.minimum(np.searchsorted(dropped, chunk_ids), max(len(dropped) - 1, 0))
+            keep = dropped[pos] != chunk_ids if len(dropped) > 0 else np.ones(len(chunk_ids), dtype=bool)
+            # the new nodes before the first stored node of the next chunk
+            new_stop = len(ids) if k == num_chunks - 1 else int(np.searchsorted(ids, self.ids[stop]))
+            chunk_ids = np.concatenate((chunk_ids[keep], ids[new_start:new_stop]))
+            chunk_coords = np.concatenate((chunk_coords[keep], coords[new_start:new_stop]))
+            new_start = new_stop
+            order = np.argsort(chunk_ids, kind='stable')
+            num_nodes += len(order)
+            if files is None:
+                chunks.append((chunk_ids[order], chunk_coords[order]))
+            else:
+                chunk_ids[order].tofile(files[0])
+                chunk_coords[order].tofile(files[1])
+        if files is None:
+            self.ids = np.concatenate([chunk_ids for chunk_ids, _ in chunks])
+            self.coords = np.concatenate([chunk_coords for _, chunk_coords in chunks])
+            return
+        for f, suffix in zip(files, ('.ids', '.coords')):
+            f.close()
+            os.replace(self.path + suffix + '.tmp', self.path + suffix)
+        self.num_stored = num_nodes
+        if num_nodes > 0:
+            self.ids = np.memmap(self.path + '.ids', dtype=np.int64, mode='r', shape=(num_nodes,))
+            self.coords = np.memmap(self.path + '.coords', dtype=np.float64, mode='r', shape=(num_nodes, 2))
+        else:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.coords = np.empty((0, 2), dtype=np.float64)
+
+
+    def lookup(self, node_ids):
+        """Return the coordinates of the given node ids as (found nodes x 2) array and a mask of the ids that were found"""
+        if not self.is_finished():
+            self.finish()
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.empty((0, 2), dtype=np.float64), np.zeros(len(node_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.ids, node_ids), len(self.ids) - 1)
+        found = self.ids[pos] == node_ids
+        return self.coords[pos[found]], found
+
+
+def build_node_store(root, path=None):
+    node_store = NodeStore(path)
+    for c1 in root:
+        if c1.tag == 'node':
+            node_store.add(int(c1.attrib['id']), float(c1.attrib['lon']), float(c1.attrib['lat']))
+    return node_store
+
+
 def get_nodes(way):
     return [int(c2.attrib['ref']) for c2 in way if c2.tag == 'nd']
 
 
-def get_polygon_from_way(way, node_list):
+def get_vertices_from_way(way, node_list):
+    """
+    Return the polygon of a way as (nodes x 2) array of longitude, latitude, None if it has too few valid nodes.
+    node_list -- dict of node coordinates of build_node_list or NodeStore
+    """
     node_ids = get_nodes(way)
-    poly_nodes = []
-    for node_id in node_ids:
-        try:
-            poly_nodes.append(node_list[node_id])
-        except KeyError:
-            print(f"Warning: node with key {i} is not found, ignoring it...", file=sys.stderr)
+    if isinstance(node_list, NodeStore):
+        poly_nodes, found = node_list.lookup(node_ids)
+        for node_id in np.asarray(node_ids, dtype=np.int64)[~found].tolist():
+            print(f"Warning: node with key {node_id} is not found, ignoring it...", file=sys.stderr)
+    else:
+        poly_nodes = []
+        for node_id in node_ids:
+            try:
+                poly_nodes.append(node_list[node_id])
+            except KeyError:
+                print(f"Warning: node with key {node_id} is not found, ignoring it...", file=sys.stderr)
     if len(poly_nodes) > 3:
-        return Polygon(poly_nodes)
+        return np.asarray(poly_nodes, dtype=np.float64)
     else:
         print("Warning: location has fewer than 3 valid nodes. Omitting it.", file=sys.stderr)
         return None
 
 
+def get_polygon_from_way(way, node_list):
+    from shapely.geometry import Polygon
+    vertices = get_vertices_from_way(way, node_list)
+    return None if vertices is None else Polygon(vertices)
+
+
 # Credit to jczaplew: https://gis.stackexchange.com/questions/127607/area-in-km-from-polygon-of-coordinates
 def calc_geom_area(poly):
+    # pyproj and shapely are only needed for the single polygon functions, extraction measures with calc_polygons_x_y_sqm
+    import pyproj
+    from shapely import ops
+    from functools import partial
     bounds = poly.bounds
     p = ops.transform(
         partial(
@@ -49,7 +244,51 @@ def get_polygon_x_y_sqm(poly):
     return poly.centroid.x, poly.centroid.y, int(calc_geom_area(poly))
 
 
+# WGS84 ellipsoid
+wgs84_a = 6378137.0
+wgs84_e2 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+
+
+def calc_polygons_x_y_sqm(polygons):
+    """
+    Return the centroids (longitude and latitude arrays) and the areas in sqm (int array) of all polygons at once.
+    polygons -- list of (nodes x 2) arrays of longitude, latitude
+    The area is computed in a local equal-area projection of every polygon, x = N cos(lat0) (lon - lon0), y = M (lat - lat0),
+    with the radii of curvature N and M of the WGS84 ellipsoid at the middle latitude lat0 of the polygon. Within the extent
+    of a building its area error is far below a sqm. Centroids are planar in longitude, latitude like shapely's centroid.
+    """
+    if len(polygons) == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64)
+    sizes = np.array([len(p) for p in polygons], dtype=np.int64)
+    starts = np.cumsum(sizes) - sizes
+    poly = np.repeat(np.arange(len(polygons)), sizes)
+    nodes = np.concatenate(polygons)
+    nxt = np.arange(len(nodes)) + 1  # next node of the ring, the last node is connected to the first
+    nxt[starts + sizes - 1] = starts
+
+    # coordinates relative to the first node of the polygon against cancellation in the shoelace formula
+    base = nodes[starts]
+    lon = nodes[:, 0] - base[poly, 0]
+    lat = nodes[:, 1] - base[poly, 1]
+    cross = lon * lat[nxt] - lon[nxt] * lat
+    area2 = np.bincount(poly, cross, minlength=len(polygons))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.bincount(poly, (lon + lon[nxt]) * cross, minlength=len(polygons)) / (3 * area2)
+        y = np.bincount(poly, (lat + lat[nxt]) * cross, minlength=len(polygons)) / (3 * area2)
+    degenerate = area2 == 0  # no area: mean of the nodes
+    x[degenerate] = (np.bincount(poly, lon, minlength=len(polygons)) / sizes)[degenerate]
+    y[degenerate] = (np.bincount(poly, lat, minlength=len(polygons)) / sizes)[degenerate]
+
+    lat0 = np.radians((np.minimum.reduceat(nodes[:, 1], starts) + np.maximum.reduceat(nodes[:, 1], starts)) / 2)
+    w = 1 - wgs84_e2 * np.sin(lat0)**2
+    scale_x = wgs84_a / np.sqrt(w) * np.cos(lat0) * np.pi / 180  # meters per degree longitude
+    scale_y = wgs84_a * (1 - wgs84_e2) / w**1.5 * np.pi / 180  # meters per degree latitude
+    sqm = np.abs(area2) / 2 * scale_x * scale_y
+    return base[:, 0] + x, base[:, 1] + y, sqm.astype(np.int64)
+
+
 def random_points_within(poly, num_points):
+    from shapely.geometry import Point
     min_x, min_y, max_x, max_y = poly.bounds
     points = []
     while len(points) < num_points:
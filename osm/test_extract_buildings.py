@@ -0,0 +1,138 @@
+import contextlib
+import io
+import random
+import xml.etree.ElementTree as ET
+import numpy as np
+from parse_osm import build_node_store
+from extract_buildings import (extract_houses, extract_shops, extract_leisure, extract_streaming, extract_parallel, find_shards,
+                               RowList, WayIndexWriter, WayIndex, build_way_index)
+
+
+way_tags = [{'building': 'house'}, {'building': 'yes'}, {'building': 'apartments', 'building:levels': '3'},
+            {'building': 'yes', 'shop': 'supermarket'}, {'building': 'retail', 'shop': 'bakery'}, {'amenity': 'restaurant'},
+            {'building': 'yes', 'amenity': 'pub'}, {'leisure': 'fitness_centre'}, {'building': 'garage'}, {'highway': 'residential'},
+            {'building': 'house', 'layer': '1'}]
+node_tags = [{'shop': 'supermarket'}, {'shop': 'clothes'}, {'amenity': 'cafe'}, {'amenity': 'bar'}, {'amenity': 'cinema'},
+             {'amenity': 'bench'}, {}]
+
+
+def osm_root(num_buildings=300, seed=0):
+    """Return a synthetic OSM file: rectangular ways of 4 nodes with building, shop and leisure tags and tagged nodes"""
+    rng = random.Random(seed)
+    root = ET.Element('osm', version='0.6')
+    ET.SubElement(root, 'bounds', minlat='47.8', minlon='13.0', maxlat='47.9', maxlon='13.1')
+    nodes = []
+    ways = []
+    for way_id in range(1, num_buildings + 1):
+        lon, lat = 13 + rng.random() * 0.1, 47.8 + rng.random() * 0.1
+        dlon, dlat = rng.uniform(0.0001, 0.0004), rng.uniform(0.0001, 0.0003)
+        refs = []
+        for corner_lon, corner_lat in ((lon, lat), (lon + dlon, lat), (lon + dlon, lat + dlat), (lon, lat + dlat)):
+            nodes.append((len(nodes) + 1, corner_lon, corner_lat, {}))
+            refs.append(len(nodes))
+        if rng.random() < 0.02:
+            refs[2] = 10**9  # missing node
+        ways.append((way_id, refs + refs[:1], rng.choice(way_tags)))
+    for i in range(num_buildings // 5):
+        nodes.append((len(nodes) + 1, 13 + rng.random() * 0.1, 47.8 + rng.random() * 0.1, rng.choice(node_tags)))
+    for node_id, lon, lat, tags in nodes:
+        node = ET.SubElement(root, 'node', id=str(node_id), lon=repr(lon), lat=repr(lat))
+        for k, v in tags.items():
+            ET.SubElement(node, 'tag', k=k, v=v)
+    for way_id, refs, tags in ways:
+        way = ET.SubElement(root, 'way', id=str(way_id))
+        for ref in refs:
+            ET.SubElement(way, 'nd', ref=str(ref))
+        for k, v in tags.items():
+            ET.SubElement(way, 'tag', k=k, v=v)
+    relation = ET.SubElement(root, 'relation', id='1')
+    ET.SubElement(relation, 'member', type='way', ref='1', role='outer')
+    ET.SubElement(relation, 'tag', k='type', v='multipolygon')
+    return root
+
+
+def write_osm_file(path, root):
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def extract_dom(root):
+    out = RowList()
+    node_list = build_node_store(root)
+    extract_houses(root, node_list, out)
+    extract_shops(root, node_list, out)
+    extract_leisure(root, node_list, out)
+    return out.rows
+
+
+def sorted_rows(rows):
+    # node locations have the coordinates of the OSM file as strings
+    return sorted((cat, tag, float(x), float(y), sqm, element) for cat, tag, x, y, sqm, element in rows)
+
+
+def assert_same_way_index(a, b):
+    assert a.ids.tolist() == b.ids.tolist()
+    assert a.indptr.tolist() == b.indptr.tolist()
+    assert a.refs.tolist() == b.refs.tolist()
+    assert a.tags == b.tags
+
+
+def test_streaming_matches_dom_extraction(tmp_path):
+    root = osm_root()
+    osm_path = str(tmp_path / "region.osm")
+    write_osm_file(osm_path, root)
+    out = RowList()
+    ways = WayIndexWriter(str(tmp_path / "region.ways"))
+    ways.chunk_size = 16  # several batches in the temporary files
+    with contextlib.redirect_stderr(io.StringIO()):
+        dom_rows = extract_dom(root)
+        extract_streaming(osm_path, out, str(tmp_path / "nodes"), ways)
+    ways.close()
+    assert len(dom_rows) > 200
+    assert {row[0] for row in dom_rows} == {'house', 'supermarket', 'shop', 'restaurant', 'nightlife', 'leisure'}
+    assert sorted_rows(out.rows) == sorted_rows(dom_rows)
+    assert_same_way_index(WayIndex.load(str(tmp_path / "region.ways")), build_way_index(root))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['nodes.coords', 'nodes.ids', 'region.osm', 'region.ways']
+
+
+def test_way_index_writer_sorts_the_ways(tmp_path):
+    rng = np.random.default_rng(0)
+    ways = [(int(way_id), rng.integers(1, 100, int(rng.integers(0, 6))).tolist(), {'building': str(way_id)} if way_id % 3 else {})
+            for way_id in rng.permutation(200)]
+    writer = WayIndexWriter(str(tmp_path / "ways"))
+    writer.chunk_size = 7
+    for way in ways:
+        writer.add(*way)
+    writer.close()
+    way_index = WayIndex.load(str(tmp_path / "ways"))
+    assert_same_way_index(way_index, WayIndex.from_ways(ways))
+    assert np.all(np.diff(way_index.ids) > 0)
+
+
+def test_shards_start_at_elements(tmp_path):
+    osm_path = str(tmp_path / "region.osm")
+    write_osm_file(osm_path, osm_root())
+    data = open(osm_path, 'rb').read()
+    node_shards, way_shards = find_shards(osm_path, 1000)
+    assert len(node_shards) > 10 and len(way_shards) > 10
+    shards = node_shards + way_shards
+    assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+    assert shards[0][0] == data.index(b'<node ') and shards[-1][1] == data.rindex(b'</osm>')
+    assert all(data[start:stop].startswith(b'<node ') for start, stop in node_shards)
+    assert all(data[start:stop].startswith((b'<way ', b'<relation ')) for start, stop in way_shards)
+    assert node_shards[-1][1] == data.index(b'<way ')
+
+
+def test_parallel_matches_sequential_extraction(tmp_path):
+    root = osm_root()
+    osm_path = str(tmp_path / "region.osm")
+    write_osm_file(osm_path, root)
+    with contextlib.redirect_stderr(io.StringIO()):
+        sequential_rows = extract_dom(root)
+        for node_store_path in (None, str(tmp_path / "nodes")):
+            out = RowList()
+            ways = WayIndexWriter(str(tmp_path / "region.ways"))
+            node_list = extract_parallel(osm_path, out, node_store_path, ways, num_processes=2, shard_bytes=2000)
+            ways.close()
+            assert out.rows == sequential_rows
+            assert_same_way_index(WayIndex.load(str(tmp_path / "region.ways")), build_way_index(root))
+            assert node_list.ids.tolist() == sorted(int(node.attrib['id']) for node in root.iter('node'))
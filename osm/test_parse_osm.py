@@ -0,0 +1,98 @@
+import contextlib
+import io
+import xml.etree.ElementTree as ET
+import numpy as np
+from parse_osm import calc_polygons_x_y_sqm, wgs84_a, wgs84_e2, NodeStore, build_node_list, build_node_store, get_vertices_from_way
+
+
+def ellipsoid_rectangle_area(lon1, lat1, lon2, lat2):
+    """Exact area in sqm of the rectangle between two meridians and two parallels on the WGS84 ellipsoid"""
+    e = wgs84_e2**0.5
+    def q(lat):
+        s = np.sin(np.radians(lat))
+        return s / (1 - wgs84_e2 * s**2) + np.log((1 + e * s) / (1 - e * s)) / (2 * e)
+    return wgs84_a**2 * (1 - wgs84_e2) / 2 * np.radians(lon2 - lon1) * (q(lat2) - q(lat1))
+
+
+def rectangle(lon, lat, dlon, dlat):
+    return np.array([(lon, lat), (lon + dlon, lat), (lon + dlon, lat + dlat), (lon, lat + dlat), (lon, lat)])
+
+
+def test_area_of_rectangles_matches_the_ellipsoid():
+    corners = [(13.04, 47.8, 0.0007, 0.0004), (-70.6, -33.4, 0.002, 0.001), (24.9, 60.2, 0.0003, 0.0009), (0.0, 0.0, 0.001, 0.001)]
+    polygons = [rectangle(*c) for c in corners]
+    x, y, sqm = calc_polygons_x_y_sqm(polygons)
+    for (lon, lat, dlon, dlat), xi, yi, area in zip(corners, x, y, sqm):
+        assert abs(area - ellipsoid_rectangle_area(lon, lat, lon + dlon, lat + dlat)) <= 1
+        assert np.isclose(xi, lon + dlon / 2, rtol=0, atol=1e-12) and np.isclose(yi, lat + dlat / 2, rtol=0, atol=1e-12)
+
+
+def test_orientation_and_closing_node_do_not_change_the_result():
+    ring = rectangle(13.04, 47.8, 0.0007, 0.0004)
+    x, y, sqm = calc_polygons_x_y_sqm([ring, ring[::-1], ring[:-1], np.roll(ring[:-1], 2, axis=0)])
+    assert len(set(sqm.tolist())) == 1
+    assert np.allclose(x, x[0], rtol=0, atol=1e-12) and np.allclose(y, y[0], rtol=0, atol=1e-12)
+
+
+def test_l_shape_centroid_and_degenerate_polygon():
+    d = 0.0001
+    l_shape = 13.0 + np.array([(0, 0), (2 * d, 0), (2 * d, d), (d, d), (d, 2 * d), (0, 2 * d)])
+    line = np.array([(13.0, 47.0), (13.001, 47.0), (13.002, 47.0), (13.003, 47.0)])
+    x, y, sqm = calc_polygons_x_y_sqm([l_shape, line])
+    # three unit squares with centers (0.5, 0.5), (1.5, 0.5), (0.5, 1.5)
+    assert np.isclose(x[0], 13.0 + 5 / 6 * d, rtol=0, atol=1e-12) and np.isclose(y[0], 13.0 + 5 / 6 * d, rtol=0, atol=1e-12)
+    assert sqm[1] == 0
+    assert np.isclose(x[1], 13.0015) and np.isclose(y[1], 47.0)
+
+
+def test_no_polygons():
+    x, y, sqm = calc_polygons_x_y_sqm([])
+    assert len(x) == len(y) == len(sqm) == 0
+
+
+def random_nodes(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(10 * n, n, replace=False).astype(np.int64)
+    return {node_id: (13 + rng.random(), 47 + rng.random()) for node_id in ids.tolist()}
+
+
+def check_lookup(node_store, nodes, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = [rng.integers(0, 10 * len(nodes), 20).tolist() for _ in range(50)] + [[], list(nodes)[:5]]
+    for query in queries:
+        coords, found = node_store.lookup(query)
+        assert found.tolist() == [node_id in nodes for node_id in query]
+        assert coords.tolist() == [list(nodes[node_id]) for node_id in query if node_id in nodes]
+
+
+def test_node_store_lookup_matches_dict(tmp_path):
+    nodes = random_nodes(5000)
+    in_memory = NodeStore()
+    on_disk = NodeStore(str(tmp_path / "nodes"))
+    on_disk.chunk_size = 1000  # several flushes to the files
+    for node_id, (lon, lat) in nodes.items():  # not sorted by id
+        in_memory.add(node_id, lon, lat)
+        on_disk.add(node_id, lon, lat)
+    check_lookup(in_memory, nodes)
+    check_lookup(on_disk, nodes)
+    assert isinstance(on_disk.ids, np.memmap)
+    check_lookup(NodeStore.open(str(tmp_path / "nodes")), nodes)
+
+
+def test_way_vertices_from_node_store_match_dict():
+    nodes = random_nodes(500)
+    root = ET.Element('osm')
+    for node_id, (lon, lat) in sorted(nodes.items()):
+        ET.SubElement(root, 'node', id=str(node_id), lon=repr(lon), lat=repr(lat))
+    rng = np.random.default_rng(2)
+    for way_id in range(30):
+        way = ET.SubElement(root, 'way', id=str(way_id))
+        for ref in rng.choice(list(nodes) + [-1, -2], int(rng.integers(2, 8))).tolist():
+            ET.SubElement(way, 'nd', ref=str(ref))
+    node_dict = build_node_list(root)
+    node_store = build_node_store(root)
+    with contextlib.redirect_stderr(io.StringIO()):
+        for way in root.iter('way'):
+            from_dict = get_vertices_from_way(way, node_dict)
+            from_store = get_vertices_from_way(way, node_store)
+            assert (from_dict is None and from_store is None) or from_dict.tolist() == from_store.tolist()
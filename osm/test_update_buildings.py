@@ -0,0 +1,135 @@
+import contextlib
+import copy
+import io
+import xml.etree.ElementTree as ET
+import numpy as np
+from parse_osm import NodeStore, build_node_store
+from building_store import BuildingStore, OSM_TYPES
+from extract_buildings import BuildingStoreWriter, WayIndexWriter, WayIndex, extract_streaming, build_way_index
+from update_buildings import update_buildings
+from test_extract_buildings import osm_root, write_osm_file, assert_same_way_index
+
+
+def extract_with_state(osm_path, store_path, state):
+    out = BuildingStoreWriter(store_path)
+    ways = WayIndexWriter(state + '.ways')
+    extract_streaming(osm_path, out, state + '.nodes', ways)
+    ways.close()
+    out.close()
+
+
+def store_rows(store):
+    return sorted(zip(np.array(store.types, dtype=object)[store.type], np.array(store.tags, dtype=object)[store.tag],
+                      store.x.tolist(), store.y.tolist(), store.sqm.tolist(), store.osm_type.tolist(), store.osm_id.tolist()))
+
+
+def element(tag, elem_id, attrib=(), tags=(), refs=()):
+    elem = ET.Element(tag, id=str(elem_id), **dict(attrib))
+    for ref in refs:
+        ET.SubElement(elem, 'nd', ref=str(ref))
+    for k, v in dict(tags).items():
+        ET.SubElement(elem, 'tag', k=k, v=v)
+    return elem
+
+
+def changes_of(root):
+    """Return a list of (action, element) changes of the OSM file root, which apply to it with apply_changes"""
+    nodes = {int(e.attrib['id']): e for e in root.iter('node')}
+    ways = {int(e.attrib['id']): e for e in root.iter('way')}
+    def moved(node_id, dlon):
+        node = copy.deepcopy(nodes[node_id])
+        node.set('lon', repr(float(node.attrib['lon']) + dlon))
+        return node
+    house_way = next(w for w in ways.values() if {t.attrib['v'] for t in w.iter('tag')} == {'house'})
+    house_nodes = [int(nd.attrib['ref']) for nd in house_way.iter('nd')]
+    shop_node = next(n for n in nodes.values() if any(t.attrib['k'] == 'shop' for t in n.iter('tag')))
+    other_way = next(w for w in ways.values() if w is not house_way and w.find('tag') is not None)
+    retagged = copy.deepcopy(other_way)
+    for tag in list(retagged.iter('tag')):
+        retagged.remove(tag)
+    ET.SubElement(retagged, 'tag', k='shop', v='supermarket')
+    new_node_ids = [10**6 + i for i in range(4)] + [0]  # one new id below all others
+    lon, lat = 13.05, 47.85
+    corners = [(lon, lat), (lon + 0.0003, lat), (lon + 0.0003, lat + 0.0002), (lon, lat + 0.0002), (lon + 0.0001, lat)]
+    created = [element('node', node_id, {'lon': repr(x), 'lat': repr(y)}) for node_id, (x, y) in zip(new_node_ids, corners)]
+    created.append(element('way', 10**6, tags={'building': 'house'}, refs=new_node_ids[:4] + new_node_ids[:1]))
+    created.append(element('node', 10**6 + 10, {'lon': '13.01', 'lat': '47.81'}, {'amenity': 'restaurant'}))
+    deleted_way = next(w for w in ways.values() if w is not house_way and w is not other_way and w.find('tag') is not None)
+    return ([('create', e) for e in created] +
+            [('modify', moved(house_nodes[1], 0.0002)), ('modify', retagged), ('modify', moved(int(shop_node.attrib['id']), 0.001))] +
+            [('delete', element('way', deleted_way.attrib['id'])), ('delete', element('node', house_nodes[2]))])
+
+
+def write_change_file(path, changes):
+    root = ET.Element('osmChange', version='0.6')
+    for action, elem in changes:
+        ET.SubElement(root, action).append(elem)
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def apply_changes(root, changes):
+    """Return the OSM file with the changes applied, nodes before ways, sorted by id"""
+    elements = {(e.tag, int(e.attrib['id'])): e for e in root if e.tag in ('node', 'way', 'relation')}
+    for action, elem in changes:
+        key = (elem.tag, int(elem.attrib['id']))
+        if action == 'delete':
+            del elements[key]
+        else:
+            elements[key] = elem
+    new_root = ET.Element('osm', version='0.6')
+    for key in sorted(elements, key=lambda key: (['node', 'way', 'relation'].index(key[0]), key[1])):
+        new_root.append(elements[key])
+    return new_root
+
+
+def test_update_matches_extraction_of_changed_file(tmp_path):
+    root = osm_root()
+    changes = changes_of(root)
+    changed_root = apply_changes(root, changes)
+    osm_path, changed_path, change_path = (str(tmp_path / name) for name in ("old.osm", "new.osm", "changes.osc"))
+    write_osm_file(osm_path, root)
+    write_osm_file(changed_path, changed_root)
+    write_change_file(change_path, changes)
+    state = str(tmp_path / "state")
+    with contextlib.redirect_stderr(io.StringIO()):
+        extract_with_state(osm_path, str(tmp_path / "old.buildings"), state)
+        extract_with_state(changed_path, str(tmp_path / "new.buildings"), str(tmp_path / "expected"))
+        store = BuildingStore.load(str(tmp_path / "old.buildings"), mmap=False)
+        node_list = NodeStore.open(state + '.nodes')
+        node_list.chunk_size = 64  # merge the changed nodes in many chunks
+        updated, way_index, removed, added = update_buildings(store, node_list, WayIndex.load(state + '.ways'), change_path)
+
+    expected = BuildingStore.load(str(tmp_path / "new.buildings"))
+    assert store_rows(updated) == store_rows(expected)
+    assert len(updated) == len(store) - len(removed) + len(added)
+    assert set(store_rows(removed)) <= set(store_rows(store)) and set(store_rows(added)) <= set(store_rows(expected))
+    assert {('way', 10**6), ('node', 10**6 + 10)} <= {(OSM_TYPES[t], i) for t, i in zip(added.osm_type, added.osm_id)}
+    assert_same_way_index(way_index, build_way_index(changed_root))
+    expected_nodes = build_node_store(changed_root)
+    expected_nodes.finish()
+    assert node_list.ids.tolist() == expected_nodes.ids.tolist()
+    assert node_list.coords.tolist() == expected_nodes.coords.tolist()
+    assert NodeStore.open(state + '.nodes').ids.tolist() == expected_nodes.ids.tolist()
+
+
+def test_node_store_update_in_memory_matches_on_disk(tmp_path):
+    rng = np.random.default_rng(0)
+    ids = np.sort(rng.choice(100000, 3000, replace=False))
+    coords = rng.random((len(ids), 2))
+    in_memory = NodeStore()
+    on_disk = NodeStore(str(tmp_path / "nodes"))
+    on_disk.chunk_size = 100
+    for node_list in (in_memory, on_disk):
+        node_list.extend(ids, coords)
+        node_list.finish()
+    new_ids = np.sort(np.concatenate((rng.choice(ids, 200, replace=False), rng.choice(np.arange(100000, 101000), 50, replace=False))))
+    new_coords = rng.random((len(new_ids), 2)) + 10
+    removed = rng.choice(ids, 100, replace=False)
+    nodes = dict(zip(ids.tolist(), coords.tolist()))
+    for node_id in removed.tolist():
+        del nodes[node_id]
+    nodes.update(zip(new_ids.tolist(), new_coords.tolist()))
+    for node_list in (in_memory, on_disk):
+        node_list.update(new_ids, new_coords, removed)
+        assert node_list.ids.tolist() == sorted(nodes)
+        assert node_list.coords.tolist() == [nodes[node_id] for node_id in sorted(nodes)]
@@ -0,0 +1,117 @@
+# Incremental update of a building store of extract_buildings.py with an OSM change file (osmChange), e.g. a diff of the
+# replication service of openstreetmap.org or the output of osmium derive-changes for two extracts of a region. Only the
+# buildings of created, modified and deleted elements and of the ways with changed nodes are extracted again:
+#
+#   python extract_buildings.py region.osm buildings.buildings --state state/region
+#   python update_buildings.py buildings.buildings state/region changes.osc --changes changes.csv
+#
+# The changes csv lists the removed and added buildings with their OSM element, such that spatial indexes and caches that
+# depend on the buildings can be updated where buildings changed instead of being rebuilt.
+
+import csv
+import argparse
+import xml.etree.ElementTree as ET
+import numpy as np
+from extract_buildings import *
+from building_store import OSM_TYPES
+
+
+CHANGES_FIELDS = ['change', 'osm_type', 'osm_id', 'building_type', 'tag', 'longitude', 'latitude', 'sqm']
+
+
+def read_change_file(path):
+    """
+    Return the changed nodes and ways of an osmChange file as dicts id -> element, with None for deleted elements.
+    The actions apply in file order, the last action on an element wins.
+    """
+    nodes = {}
+    ways = {}
+    for action in ET.parse(path).getroot():
+        if action.tag not in ('create', 'modify', 'delete'):
+            continue
+        for elem in action:
+            changed = {'node': nodes, 'way': ways}.get(elem.tag)
+            if changed is not None:  # relations are not extracted
+                changed[int(elem.attrib['id'])] = None if action.tag == 'delete' else elem
+    return nodes, ways
+
+
+def update_node_store(node_list, nodes):
+    """Apply the changed nodes (dict id -> element, None for deleted nodes) to a finished NodeStore"""
+    changed = sorted((node_id, float(node.attrib['lon']), float(node.attrib['lat'])) for node_id, node in nodes.items() if node is not None)
+    deleted = [node_id for node_id, node in nodes.items() if node is None]
+    node_list.update(np.array([node_id for node_id, _, _ in changed], dtype=np.int64),
+                     np.array([(lon, lat) for _, lon, lat in changed], dtype=np.float64).reshape(-1, 2),
+                     np.array(deleted, dtype=np.int64))
+
+
+def update_buildings(store, node_list, way_index, change_path):
+    """
+    Apply an osmChange file to the buildings of an extraction with state (see extract_buildings.py --state) and return
+    (store, way_index, removed, added): the updated store in Hilbert order, the updated WayIndex and the removed and added
+    buildings as BuildingStore. The node coordinates of node_list are updated in place.
+    A building of a modified element is removed and added again, if it is still a building.
+    """
+    if store.osm_id is None:
+        raise ValueError("the building store has no OSM elements, extract it with extract_buildings.py --state")
+    nodes, ways = read_change_file(change_path)
+    update_node_store(node_list, nodes)
+    changed_nodes = np.fromiter(nodes.keys(), dtype=np.int64, count=len(nodes))
+    changed_ways = np.fromiter(ways.keys(), dtype=np.int64, count=len(ways))
+    way_index = way_index.replace_ways(changed_ways, [(way_id, get_nodes(way), get_tags(way))
+                                                      for way_id, way in ways.items() if way is not None])
+
+    # ways that are extracted again: the changed ways and the ways with changed nodes
+    affected_ways = np.union1d(changed_ways, way_index.ways_with_nodes(changed_nodes))
+    pos = np.minimum(np.searchsorted(way_index.ids, affected_ways), max(len(way_index) - 1, 0))
+    in_index = way_index.ids[pos] == affected_ways if len(way_index) > 0 else np.zeros(len(affected_ways), dtype=bool)
+    elements = [node for node in nodes.values() if node is not None] + [way_index.element(i) for i in pos[in_index].tolist()]
+
+    out = BuildingStoreWriter(None)
+    batch = PolygonBatch(out)
+    for c1 in elements:
+        tags = get_tags(c1)
+        batch.start_element(c1)
+        extract_house_element(c1, tags, lambda: get_vertices_from_way(c1, node_list), batch)
+        extract_shop_element(c1, tags, lambda: get_vertices_from_way(c1, node_list), batch)
+        extract_leisure_element(c1, tags, lambda: get_vertices_from_way(c1, node_list), batch)
+    batch.flush()
+    added = out.store()
+
+    removed = (((store.osm_type == OSM_TYPES.index('node')) & np.isin(store.osm_id, changed_nodes)) |
+               ((store.osm_type == OSM_TYPES.index('way')) & np.isin(store.osm_id, affected_ways)))
+    updated = BuildingStore.concat([store.take(np.flatnonzero(~removed)), added]).sorted_spatially()
+    return updated, way_index, store.take(np.flatnonzero(removed)), added
+
+
+def write_changes(path, removed, added):
+    """Write the removed and added buildings to a csv with the fields CHANGES_FIELDS"""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CHANGES_FIELDS)
+        for change, buildings in (('removed', removed), ('added', added)):
+            writer.writerows(zip([change] * len(buildings), np.array(OSM_TYPES, dtype=object)[buildings.osm_type],
+                                 buildings.osm_id.tolist(), np.array(buildings.types, dtype=object)[buildings.type],
+                                 np.array(buildings.tags, dtype=object)[buildings.tag], buildings.x.tolist(), buildings.y.tolist(),
+                                 buildings.sqm.tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="apply an OSM change file to a building store of extract_buildings.py --state")
+    parser.add_argument('building_store')
+    parser.add_argument('state', help="STATE of extract_buildings.py --state, it is updated to the changed OSM data")
+    parser.add_argument('change_file', help="osmChange file (.osc)")
+    parser.add_argument('--out', help="write the updated buildings to this building store instead of building_store")
+    parser.add_argument('--changes', help="write the removed and added buildings to this csv")
+    args = parser.parse_args()
+
+    store = BuildingStore.load(args.building_store, mmap=False)
+    node_list = NodeStore.open(args.state + '.nodes')
+    way_index = WayIndex.load(args.state + '.ways')
+    store, way_index, removed, added = update_buildings(store, node_list, way_index, args.change_file)
+    outpath = args.out or args.building_store
+    store.save(outpath)
+    way_index.save(args.state + '.ways')
+    if args.changes is not None:
+        write_changes(args.changes, removed, added)
+    print(f"{len(removed)} buildings removed, {len(added)} added, {len(store)} buildings written to {outpath}")
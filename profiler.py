@@ -0,0 +1,83 @@
+# Per phase instrumentation of run_sim.
+# Pass a PhaseProfiler as profiler to run_sim to record the wall time and work counters of every phase of every round.
+# Without a profiler run_sim only checks for None at the phase boundaries.
+
+import time
+import numpy as np
+
+
+PHASES = [
+    'setup',               # parameter updates, quarantine release, visiting relatives and infectious sets of the round
+    'household',
+    'testing',
+    'office',
+    'school',
+    'interhousehold',
+    'visit_registration',  # drawing and registering the visits of all agents in locations
+    'location_spread',
+    'state_advance'        # classification of the infected agents, state transitions and round information
+]
+PHASE_IDX = {phase: i for i, phase in enumerate(PHASES)}
+
+COUNTERS = [
+    'edges_examined',      # neighbor entries of the infectious agents looked at during spreading
+    'random_draws',
+    'visits_registered',   # susceptible and infectious visits registered in locations
+    'agents_quarantined'
+]
+COUNTER_IDX = {counter: i for i, counter in enumerate(COUNTERS)}
+
+
+class PhaseProfiler:
+    def __init__(self, callback=None):
+        """
+        Records per round and phase the wall time in seconds into self.times (rounds x phases) and the work counters into
+        self.counters (rounds x phases x counters).
+        callback -- optional function callback(rnd, times, counters) called with the rows of every finished round
+        """
+        self.callback = callback
+        self.times = None
+        self.counters = None
+        self.rnd = None
+
+
+    def start_run(self, sim_iters):
+        self.times = np.zeros((sim_iters, len(PHASES)), dtype=np.float64)
+        self.counters = np.zeros((sim_iters, len(PHASES), len(COUNTERS)), dtype=np.int64)
+
+
+    def start_round(self, rnd):
+        self.rnd = rnd
+        self.phase = PHASE_IDX['setup']
+        self.phase_start = time.perf_counter()
+
+
+    def enter(self, phase):
+        """End the current phase and start the given one"""
+        now = time.perf_counter()
+        self.times[self.rnd, self.phase] += now - self.phase_start
+        self.phase = PHASE_IDX[phase]
+        self.phase_start = now
+
+
+    def count(self, counter, num):
+        """Add num to a counter of the current phase"""
+        self.counters[self.rnd, self.phase, COUNTER_IDX[counter]] += num
+
+
+    def end_round(self):
+        now = time.perf_counter()
+        self.times[self.rnd, self.phase] += now - self.phase_start
+        if self.callback is not None:
+            self.callback(self.rnd, self.times[self.rnd], self.counters[self.rnd])
+
+
+    def phase_times(self):
+        """Total wall time per phase over all rounds"""
+        return dict(zip(PHASES, self.times.sum(axis=0)))
+
+
+    def phase_counters(self):
+        """Total of every counter per phase over all rounds"""
+        totals = self.counters.sum(axis=0)
+        return {phase: dict(zip(COUNTERS, totals[i].tolist())) for i, phase in enumerate(PHASES)}
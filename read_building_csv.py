@@ -1,16 +1,17 @@
-import csv
-import os
+import json
+import hashlib
 import numpy as np
 import random
-import pickle
-import heapq
 import itertools
+from pathlib import Path
 from collections import Counter
-from epsim import Location
+from epsim import Location, LocationTable
+from array_file import write_array_file, read_array_file
+from building_store import read_buildings
 
-# Read csv file of buildings and compute nearest locations.
-# The format is:
-# building_type,longitude,latitude,sqm
+# Read the buildings (csv or building store, see building_store.py) and compute nearest locations.
+# The csv format is:
+# building_type,tag,longitude,latitude,sqm
 
 
 def calc_dist(x1, y1, x2, y2):
@@ -21,99 +22,283 @@ def calc_dist_cheap(x1, y1, x2, y2):
     return np.abs(x1-x2) + np.abs(y1-y2)
 
 
-def calc_dist_house(loc, house_loc):
-    return calc_dist(house_loc.x, house_loc.y, loc.x, loc.y)
+class GridIndex:
+    def __init__(self, x, y, points_per_cell=2):
+        """
+        Uniform grid over the points (x, y) for batched k nearest neighbor queries, the cell size is chosen such that a cell
+        contains about points_per_cell points.
+        """
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.min_x = self.x.min()
+        self.min_y = self.y.min()
+        side = max(self.x.max() - self.min_x, self.y.max() - self.min_y, 1e-9)
+        self.cell_size = max((side**2 * points_per_cell / len(self.x))**0.5, 1e-9)
+        self.nx = int((self.x.max() - self.min_x) / self.cell_size) + 1
+        self.ny = int((self.y.max() - self.min_y) / self.cell_size) + 1
 
+        # points sorted by cell, the points of cell c are order[cell_start[c]:cell_start[c+1]]
+        cells = self.cell_ids(*self.cell_coords(self.x, self.y))
+        self.order = np.argsort(cells, kind='stable')
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.nx * self.ny), out=self.cell_start[1:])
 
-class HouseLocation:
-    def __init__(self, x, y, sqm):
-        self.x = x
-        self.y = y
-        self.sqm = sqm
 
+    def cell_coords(self, x, y):
+        # points outside of the grid are clipped to its border cells
+        cx = np.clip(((x - self.min_x) / self.cell_size).astype(np.int64), 0, self.nx - 1)
+        cy = np.clip(((y - self.min_y) / self.cell_size).astype(np.int64), 0, self.ny - 1)
+        return cx, cy
 
-class PreprocLocation:
-    def __init__(self, tag, x, y, sqm, idx):
-        self.tag = tag
-        self.x = x
-        self.y = y
-        self.sqm = sqm
-        self.idx = idx
 
+    def cell_ids(self, cx, cy):
+        return cx * self.ny + cy
 
-def get_visit_locs_supermarket(house_loc, locs):
-    # choose 3 nearest locations
-    return heapq.nsmallest(3, locs, key=lambda loc: calc_dist_house(loc, house_loc))
 
-def get_visit_locs_shop(house_loc, locs):
-    # choose 5 tags at random with tags weighted by occurances, pick neastest location per chosen tag
-    tag_counts = Counter([loc.tag for loc in locs])
-    chosen_tags = random.choices(list(tag_counts.keys()), weights=list(tag_counts.values()), k=5)
-    return [min({loc: calc_dist_house(loc, house_loc) for loc in [loc for loc in locs if loc.tag == tag]}.items(), key=lambda x: x[1])[0]
-            for tag in chosen_tags]
+    def query(self, qx, qy, k):
+        """
+        Return the indices of the k nearest points of every query point as (queries x k) array, ordered by distance and
+        ties by point index, like heapq.nsmallest over the points in order. Fewer than k points: all points are returned.
+        """
+        qx = np.asarray(qx, dtype=np.float64)
+        qy = np.asarray(qy, dtype=np.float64)
+        k = min(k, len(self.x))
+        nearest = np.empty((len(qx), k), dtype=np.int64)
+        pending = np.arange(len(qx))
+        r = 1
+        while len(pending) > 0:
+            # candidates: all points in the cells within r rings around the cell of the query
+            cx, cy = self.cell_coords(qx[pending], qy[pending])
+            offsets = np.arange(-r, r + 1)
+            block_x = (cx[:, np.newaxis] + np.repeat(offsets, len(offsets))).ravel()
+            block_y = (cy[:, np.newaxis] + np.tile(offsets, len(offsets))).ravel()
+            inside = (block_x >= 0) & (block_x < self.nx) & (block_y >= 0) & (block_y < self.ny)
+            block_cells = self.cell_ids(block_x[inside], block_y[inside])
+            starts = self.cell_start[block_cells]
+            counts = self.cell_start[block_cells + 1] - starts
+            total = int(counts.sum())
+            cand_query = np.repeat(np.repeat(np.arange(len(pending)), len(offsets)**2)[inside], counts)
+            cand = self.order[np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)]
+            dist = calc_dist(qx[pending][cand_query], qy[pending][cand_query], self.x[cand], self.y[cand])
 
-def get_visit_locs_restaurant(house_loc, locs):
-    # choose 5 locations uniformly at random
-    return random.choices(locs, k=5)
+            # k nearest candidates per query, ties by point index
+            sort = np.lexsort((cand, dist, cand_query))
+            cand_query = cand_query[sort]
+            num_cands = np.bincount(cand_query, minlength=len(pending))
+            rank = np.arange(total) - np.repeat(np.cumsum(num_cands) - num_cands, num_cands)
+            kth_dist = np.full(len(pending), np.inf)
+            kth_dist[cand_query[rank == k - 1]] = dist[sort][rank == k - 1]
 
-def get_visit_locs_leisure(house_loc, locs):
-    return get_visit_locs_shop(house_loc, locs)
+            # points outside of the block are at least r cells away, the k nearest are certain if the k-th candidate is closer
+            done = kth_dist < r * self.cell_size
+            if r >= max(self.nx, self.ny):
+                done[:] = True  # the block covers the whole grid
+            take = (rank < k) & done[cand_query]
+            nearest[pending[done]] = cand[sort][take].reshape(-1, k)
+            pending = pending[~done]
+            r += 1
+        return nearest
 
-def get_visit_locs_nightlife(house_loc, locs):
-    return get_visit_locs_restaurant(house_loc, locs)
 
-get_visit_locs = {
-    'supermarket': get_visit_locs_supermarket,
-    'shop': get_visit_locs_shop,
-    'restaurant': get_visit_locs_restaurant,
-    'leisure': get_visit_locs_leisure,
-    'nightlife': get_visit_locs_nightlife
+def tag_index(locs):
+    """Return the tags of the locations with their counts (in order of occurrence) and the locations of every tag"""
+    tag_counts = Counter(loc.tag for loc in locs)
+    tags = list(tag_counts.keys())
+    tag_locs = {tag: [] for tag in tags}
+    for i, loc in enumerate(locs):
+        tag_locs[loc.tag].append(i)
+    return tags, list(itertools.accumulate(tag_counts.values())), {tag: np.array(idx, dtype=np.int64) for tag, idx in tag_locs.items()}
+
+
+sqm_per_household = 90  # ~90 sqm per household for multihousehold houses, see [1] in read_building_csv
+
+# visit locations of a house per location type:
+# 'nearest': the k nearest locations
+# 'nearest_per_tag': choose k tags at random with tags weighted by occurances, the nearest location per chosen tag
+# 'uniform': k locations uniformly at random
+visit_loc_rules = {
+    'supermarket': ('nearest', 3),
+    'shop': ('nearest_per_tag', 5),
+    'restaurant': ('uniform', 5),
+    'leisure': ('nearest_per_tag', 5),
+    'nightlife': ('uniform', 5)
 }
 
 
-def read_building_csv(e, csvpath):
-    if os.path.isfile(csvpath + ".p"):
-        pickle_data = pickle.load(open(csvpath + ".p", "rb"))
-        house_locs = pickle_data['house_locs']
-        locations = pickle_data['locations']
-    else:
-        house_locs = []
-        locations = {}
-        loc_idx = 0
-        with open(csvpath) as f:
-            csvreader = csv.reader(f)
-            fields = next(csvreader)
-            assert(fields == ['building_type', 'tag', 'longitude', 'latitude', 'sqm'])
-            for row in csvreader:
-                loc_type = row[0]
-                tag = row[1]
-                x = float(row[2])
-                y = float(row[3])
-                sqm = int(row[4])
-                if loc_type == 'house':
-                    house_locs.append(HouseLocation(x, y, sqm))
-                else:
-                    if loc_type not in locations:
-                        locations[loc_type] = []
-                    locations[loc_type].append(PreprocLocation(tag, x, y, sqm, loc_idx))
-                    loc_idx += 1
-
-        pickle_data = {'house_locs': house_locs, 'locations': locations}
-        pickle.dump(pickle_data, open(csvpath + ".p", "wb"))
-
-    e.locations = {loc_type: [Location(loc_type, loc.tag, loc.x, loc.y, loc.sqm) for loc in locs]
-                   for loc_type, locs in locations.items()}
+def choose_visit_locs(house_xy, locations, rng=random):
+    """
+    Return the visit locations of the houses at house_xy (houses x 2 array) per location type, as (houses x k) array of indices
+    into the location list of the location type. Nearest locations are found with a GridIndex per location type and tag for
+    all houses at once.
+    """
+    # random choices first, house by house in the order of the location types
+    tags = {}
+    draws = {}
+    for loc_type, locs in locations.items():
+        rule, k = visit_loc_rules[loc_type]
+        if rule == 'nearest_per_tag':
+            tags[loc_type] = tag_index(locs)
+        if rule != 'nearest':
+            draws[loc_type] = []
+    for house in range(len(house_xy)):
+        for loc_type in draws.keys():
+            rule, k = visit_loc_rules[loc_type]
+            if rule == 'nearest_per_tag':
+                loc_tags, cum_weights, _ = tags[loc_type]
+                draws[loc_type].append(rng.choices(range(len(loc_tags)), cum_weights=cum_weights, k=k))
+            else:
+                draws[loc_type].append(rng.choices(range(len(locations[loc_type])), k=k))
+
+    visit_locs = {}
+    for loc_type, locs in locations.items():
+        rule, k = visit_loc_rules[loc_type]
+        if rule == 'nearest':
+            index = GridIndex([loc.x for loc in locs], [loc.y for loc in locs])
+            visit_locs[loc_type] = index.query(house_xy[:, 0], house_xy[:, 1], k)
+        elif rule == 'nearest_per_tag':
+            chosen_tags = np.array(draws[loc_type], dtype=np.int64).reshape(len(house_xy), k)
+            visit_locs[loc_type] = np.empty_like(chosen_tags)
+            loc_tags, _, tag_locs = tags[loc_type]
+            for t, tag in enumerate(loc_tags):
+                houses, slots = np.nonzero(chosen_tags == t)
+                if len(houses) == 0:
+                    continue
+                idx = tag_locs[tag]
+                index = GridIndex([locs[i].x for i in idx], [locs[i].y for i in idx])
+                visit_locs[loc_type][houses, slots] = idx[index.query(house_xy[houses, 0], house_xy[houses, 1], 1)[:, 0]]
+        else:
+            visit_locs[loc_type] = np.array(draws[loc_type], dtype=np.int64).reshape(len(house_xy), k)
+    return visit_locs
+
+
+# Cache of the preprocessed buildings in an array file (see array_file.py), the file name is the hash of the cache key:
+# content of the csv, state of the rng, number of households and the parameters of the building assignment.
+# A changed csv or parameter gives a new key, such that a stale cache can not be used. On a hit the rng is set to the state
+# it has after the building assignment, so the result is the same as without cache.
+BUILDINGS_CACHE_MAGIC = b"EPSIMBLD"
+BUILDINGS_CACHE_VERSION = 1
+
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def buildings_cache_key(csvpath, rng, num_households):
+    return {'version': BUILDINGS_CACHE_VERSION, 'csv_sha256': file_hash(csvpath),
+            'rng_state': hashlib.sha256(repr(rng.getstate()).encode()).hexdigest(), 'num_households': num_households,
+            'sqm_per_household': sqm_per_household, 'visit_loc_rules': {loc_type: list(rule) for loc_type, rule in visit_loc_rules.items()}}
+
+
+def write_buildings_cache(path, key, e, house_x, house_y, house_sqm, rng):
+    loc_types = list(e.locations.keys())
+    locs = [loc for loc_type in loc_types for loc in e.locations[loc_type]]
+    tags = list(dict.fromkeys(loc.tag for loc in locs))
+    tag_ids = {tag: i for i, tag in enumerate(tags)}
+    arrays = {
+        'house_x': house_x,
+        'house_y': house_y,
+        'house_sqm': house_sqm,
+        'loc_type': e.location_table.type,
+        'loc_tag': np.array([tag_ids[loc.tag] for loc in locs], dtype=np.int32),
+        'loc_x': np.array([loc.x for loc in locs], dtype=np.float64),
+        'loc_y': np.array([loc.y for loc in locs], dtype=np.float64),
+        'loc_sqm': np.array([loc.sqm for loc in locs], dtype=np.int64),
+        'house_households_indptr': np.cumsum([0] + [len(households) for households in e.house_households], dtype=np.int64),
+        'house_households': np.array([hh for households in e.house_households for hh in households], dtype=np.int64)
+    }
+    for loc_type, house_visit_loc_idx in e.house_visit_loc_idx.items():
+        arrays['house_visit_loc_idx_' + loc_type] = house_visit_loc_idx
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    write_array_file(path, BUILDINGS_CACHE_MAGIC, BUILDINGS_CACHE_VERSION, arrays,
+                     {'key': key, 'loc_types': loc_types, 'tags': tags, 'rng_state': rng.getstate()})
+
+
+def read_buildings_cache(path, key, e, rng):
+    """Set the preprocessed buildings of the cache file on e and return the number of houses, None if the file does not match key"""
+    arrays, meta = read_array_file(path, BUILDINGS_CACHE_MAGIC, BUILDINGS_CACHE_VERSION)
+    if meta['key'] != key:
+        return None
+    loc_type, loc_tag, loc_x, loc_y, loc_sqm = (arrays[name].tolist() for name in ['loc_type', 'loc_tag', 'loc_x', 'loc_y', 'loc_sqm'])
+    e.locations = {loc_type: [] for loc_type in meta['loc_types']}
+    for i in range(len(loc_type)):
+        t = meta['loc_types'][loc_type[i]]
+        e.locations[t].append(Location(t, meta['tags'][loc_tag[i]], loc_x[i], loc_y[i], loc_sqm[i]))
+    e.location_table = LocationTable(e.locations)
+
+    indptr = arrays['house_households_indptr'].tolist()
+    households = arrays['house_households'].tolist()
+    e.house_households = [households[indptr[h]:indptr[h + 1]] for h in range(len(indptr) - 1)]
+    e.house_visit_loc_idx = {loc_type: arrays['house_visit_loc_idx_' + loc_type] for loc_type in meta['loc_types']}
+    version, internal_state, gauss_next = meta['rng_state']
+    rng.setstate((version, tuple(internal_state), gauss_next))
+    return len(arrays['house_x'])
+
+
+def set_house_visit_locs(e):
+    """Set the visit Location objects per house and the agents living in houses from house_visit_loc_idx and house_households"""
+    locs = [loc for loc_type in e.location_table.loc_types for loc in e.locations[loc_type]]
+    visit_loc_idx = {loc_type: house_visit_loc_idx.tolist() for loc_type, house_visit_loc_idx in e.house_visit_loc_idx.items()}
+    e.house_visit_locs = [{loc_type: [locs[i] for i in visit_loc_idx[loc_type][house]] for loc_type in visit_loc_idx.keys()}
+                          for house in range(len(e.house_households))]
+
+    # house of every agent, such that the visits of all agents can be drawn with a few array operations per round
+    e.visit_agents = np.array([agent for house in e.house_households for hh in house for agent in e.households[hh]], dtype=np.int64)
+    e.visit_agent_house = np.array([h for h, house in enumerate(e.house_households) for hh in house for agent in e.households[hh]],
+                                   dtype=np.int64)
+
+
+def read_building_csv(e, csvpath, rng=None, cache_dir=None):
+    """
+    Read the buildings csv, distribute the households of e to the houses and choose the visit locations of every house.
+    csvpath   -- buildings csv or building store file (see building_store.py)
+    rng       -- random.Random of the building assignment (e.g. RNGStreams.python('buildings')), None: global random module
+    cache_dir -- directory of the cache of preprocessed buildings (e.g. "building_cache"), None: no cache. The cache is only
+                 used with an explicit rng, since the assignment with the unseeded global random module differs on every call.
+    """
+    if rng is None:
+        rng = random
+        cache_dir = None
+
+    cache_path = None
+    if cache_dir is not None:
+        key = buildings_cache_key(csvpath, rng, len(e.households))
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+        cache_path = Path(cache_dir) / f"buildings_{digest}.bin"
+        if cache_path.is_file():
+            num_houses = read_buildings_cache(cache_path, key, e, rng)
+            if num_houses is not None:
+                set_house_visit_locs(e)
+                print(f"read in {num_houses} houses and {e.location_table.num_locs} other locations from {cache_path}")
+                return
+
+    buildings = read_buildings(csvpath)
+    houses = buildings.rows_of_type('house')
+    loc_types = [loc_type for loc_type in buildings.types if loc_type != 'house']
+    e.locations = {}
+    for loc_type in loc_types:
+        rows = buildings.rows_of_type(loc_type)
+        tags = np.array(buildings.tags, dtype=object)[buildings.tag[rows]].tolist()
+        e.locations[loc_type] = [Location(loc_type, tag, x, y, sqm) for tag, x, y, sqm in
+                                 zip(tags, buildings.x[rows].tolist(), buildings.y[rows].tolist(), buildings.sqm[rows].tolist())]
+    e.location_table = LocationTable(e.locations)
 
     # distribute households to houses
     # [1] https://www.statistik.at/web_de/statistiken/menschen_und_gesellschaft/wohnen/wohnsituation/081235.html
-    random.shuffle(house_locs)
+    house_order = list(range(len(houses)))
+    rng.shuffle(house_order)
+    houses = houses[house_order]
+    house_x, house_y, house_sqm = buildings.x[houses], buildings.y[houses], buildings.sqm[houses]
     house_households = []
     household_i = 0
-    for house_i, house_loc in enumerate(house_locs):
+    for house_i, sqm in enumerate(house_sqm.tolist()):
         if household_i > len(e.households) - 1:
-            print(f"{len(house_locs) - house_i} houses remain empty")
+            print(f"{len(houses) - house_i} houses remain empty")
             break
-        num_households = int(house_loc.sqm / 90) + 1  # ~90 sqm per household for multihousehold houses [1]
+        num_households = int(sqm / sqm_per_household) + 1
         if household_i + num_households > len(e.households):
             num_households = len(e.households) - household_i
         house_households.append([i for i in range(household_i, household_i + num_households)])
@@ -122,14 +307,18 @@ def read_building_csv(e, csvpath):
     if household_i < len(e.households) - 1:
         print(f"{len(e.households) - 1 - household_i} households did not get a house, they are randomly distributed to occupied houses")
         while household_i < len(e.households) - 1:
-            random.choice(house_households).append(household_i)
+            rng.choice(house_households).append(household_i)
             household_i += 1
     
     e.house_households = house_households
 
-    # get visit locations for every house
-    e.house_visit_locs = [{loc_type: get_visit_locs[loc_type](house_loc, locs)
-                           for loc_type, locs in e.locations.items()}
-                          for house_loc in house_locs]
+    # get visit locations for every occupied house as LocationTable indices per location type
+    house_xy = np.column_stack((house_x, house_y))[:len(house_households)]
+    visit_locs = choose_visit_locs(house_xy, e.locations, rng)
+    e.house_visit_loc_idx = {loc_type: np.array([loc.idx for loc in locs], dtype=np.int64)[visit_locs[loc_type]]
+                             for loc_type, locs in e.locations.items()}
+    set_house_visit_locs(e)
 
-    print(f"read in {len(house_locs)} houses and {sum(len(locs) for loc_type, locs in locations.items())} other locations")
+    if cache_path is not None:
+        write_buildings_cache(cache_path, key, e, house_x, house_y, house_sqm, rng)
+    print(f"read in {len(houses)} houses and {e.location_table.num_locs} other locations")
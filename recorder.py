@@ -0,0 +1,192 @@
+# Columnar recording of simulation results.
+# A run is stored as two fixed dtype arrays: metrics (rounds x metrics) and states (rounds x states), instead of a list of dicts.
+# ResultStore appends runs to .npy files on disk, which load as memory mapped (runs x rounds x ...) arrays for analysis.
+
+from pathlib import Path
+import numpy as np
+
+
+# per round information of run_sim in the order of its info dict, without 'states'
+METRICS = [
+    'infected',
+    'infected_in_household',
+    'infected_in_school',
+    'infected_in_office',
+    'infected_in_interhousehold',
+    'infected_by_children',
+    'infected_children',
+    'infected_by_adults',
+    'infected_adults',
+    'quarantined_by_detection',
+    'quarantined_by_test',
+    'infected_in_supermarket',
+    'infected_in_shop',
+    'infected_in_restaurant',
+    'infected_in_leisure',
+    'infected_in_nightlife'
+]
+METRIC_IDX = {metric: i for i, metric in enumerate(METRICS)}
+
+
+class RunRecorder:
+    def __init__(self):
+        """Records the per round information of one run into preallocated arrays, pass it as recorder to run_sim"""
+        self.metrics = None
+        self.states = None
+
+
+    def start_run(self, sim_iters, num_states):
+        self.metrics = np.zeros((sim_iters, len(METRICS)), dtype=np.int64)
+        self.states = np.zeros((sim_iters, num_states), dtype=np.int64)
+
+
+    def record(self, rnd, info):
+        self.states[rnd] = info['states']
+        self.metrics[rnd] = [info[metric] for metric in METRICS]
+
+
+    def record_end(self, rnd, info):
+        """Record info for all rounds from rnd on, after the simulation ended early"""
+        self.states[rnd:] = info['states']
+        self.metrics[rnd:] = [info[metric] for metric in METRICS]
+
+
+    @classmethod
+    def from_info_per_rnd(cls, info_per_rnd):
+        recorder = cls()
+        recorder.start_run(len(info_per_rnd), len(info_per_rnd[0]['states']))
+        for rnd, info in enumerate(info_per_rnd):
+            recorder.record(rnd, info)
+        return recorder
+
+
+    def to_info_per_rnd(self):
+        return [dict({'states': tuple(int(num) for num in self.states[rnd])},
+                     **{metric: int(self.metrics[rnd, i]) for i, metric in enumerate(METRICS)})
+                for rnd in range(len(self.metrics))]
+
+
+    def save(self, path):
+        np.savez(path, metrics=self.metrics, states=self.states)
+
+
+    @classmethod
+    def load(cls, path):
+        recorder = cls()
+        with np.load(path) as data:
+            recorder.metrics = data['metrics']
+            recorder.states = data['states']
+        return recorder
+
+
+class NpyAppender:
+    header_size = 128  # fixed size of the .npy header (incl. magic string), such that the shape can be rewritten in place
+
+    def __init__(self, path, dtype, row_shape):
+        """Append rows to a .npy file of shape (rows, *row_shape), the file is created if it does not exist"""
+        self.path = Path(path)
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        if self.path.is_file():
+            with open(self.path, 'rb') as f:
+                np.lib.format.read_magic(f)
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                if f.tell() != self.header_size or fortran_order or dtype != self.dtype or shape[1:] != self.row_shape:
+                    raise ValueError(f"{self.path} is not an appendable array of dtype {self.dtype} and row shape {self.row_shape}")
+                self.num_rows = shape[0]
+        else:
+            self.num_rows = 0
+            with open(self.path, 'wb') as f:
+                self.write_header(f)
+
+
+    def write_header(self, f):
+        header = repr({'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                       'shape': (self.num_rows,) + self.row_shape})
+        header = header.ljust(self.header_size - 10 - 1) + '\n'  # 10 bytes magic string, version and header length
+        f.seek(0)
+        f.write(np.lib.format.magic(1, 0))
+        f.write(np.uint16(len(header)).tobytes())
+        f.write(header.encode('latin1'))
+
+
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=self.dtype)
+        if rows.shape[1:] != self.row_shape:
+            raise ValueError(f"rows of shape {rows.shape[1:]} can not be appended to {self.path} with row shape {self.row_shape}")
+        with open(self.path, 'r+b') as f:
+            # write behind the last complete row, a partially written append gets overwritten
+            f.seek(self.header_size + self.num_rows * rows[0:1].nbytes)
+            f.write(rows.tobytes())
+            f.truncate()
+            self.num_rows += len(rows)
+            self.write_header(f)
+
+
+class ResultStore:
+    def __init__(self, path):
+        """
+        Append-only store of many runs in directory path:
+        metrics.npy (runs x rounds x metrics), states.npy (runs x rounds x states) and keys.npy (runs), where the key of a run
+        is e.g. the index of its parameter combination. All runs of a store need the same number of rounds and states.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.metrics = None
+        self.states = None
+        self.keys = None
+
+
+    def append(self, recorder, key=0):
+        """Append the run of a RunRecorder, or of an info_per_rnd list"""
+        if not isinstance(recorder, RunRecorder):
+            recorder = RunRecorder.from_info_per_rnd(recorder)
+        if self.metrics is None:
+            self.metrics = NpyAppender(self.path / "metrics.npy", np.int64, recorder.metrics.shape)
+            self.states = NpyAppender(self.path / "states.npy", np.int64, recorder.states.shape)
+            self.keys = NpyAppender(self.path / "keys.npy", np.int64, ())
+        self.metrics.append(recorder.metrics[np.newaxis])
+        self.states.append(recorder.states[np.newaxis])
+        self.keys.append([key])
+
+
+def load_results(path, mmap_mode='r'):
+    """Load the runs of a ResultStore as (metrics, states, keys) arrays, memory mapped by default"""
+    path = Path(path)
+    return (np.load(path / "metrics.npy", mmap_mode=mmap_mode), np.load(path / "states.npy", mmap_mode=mmap_mode),
+            np.load(path / "keys.npy", mmap_mode=mmap_mode))
+
+
+def runs_of_key(metrics, states, keys, key):
+    """Select the metrics and states of all runs with the given key"""
+    selected = np.flatnonzero(keys == key)
+    return metrics[selected], states[selected]
+
+
+# analysis helpers on columnar results, metrics: (runs x rounds x metrics), states: (runs x rounds x states)
+
+def metric(metrics, name):
+    """Return the (... x rounds) array of one metric"""
+    return metrics[..., METRIC_IDX[name]]
+
+
+def get_cumulative(metrics, name, rnds=slice(None)):
+    """Sum of a metric over the given rounds, per run"""
+    return metric(metrics, name)[..., rnds].sum(axis=-1)
+
+
+def mean_over_runs(metrics):
+    """Mean of every metric per round over all runs"""
+    mean_metrics = np.asarray(metrics).mean(axis=0)
+    return {name: mean_metrics[:, i] for i, name in enumerate(METRICS)}
+
+
+def mean_states_per_round_over_runs(states):
+    """Mean number of agents per state and round over all runs (rounds x states)"""
+    return np.asarray(states).mean(axis=0)
+
+
+def mean_cumulative_over_runs(metrics):
+    """Mean over all runs of the sum of every metric over all rounds"""
+    mean_cumulative = np.asarray(metrics).sum(axis=-2).mean(axis=0)
+    return {name: mean_cumulative[i] for i, name in enumerate(METRICS)}
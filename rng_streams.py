@@ -0,0 +1,62 @@
+# Seeded random number streams.
+# Every subsystem (graph generation, building assignment, initial seeding and each spread phase) draws from its own generator.
+# All generators are derived from one seed with numpy's SeedSequence, so a run is reproducible from its seed, runs with different
+# seeds are independent, and two scenarios run with the same seed use common random numbers: a changed parameter in one phase
+# does not shift the random numbers drawn in the other phases.
+
+import random
+import numpy as np
+
+
+STREAMS = [
+    'graph',           # EpsimGraph
+    'buildings',       # read_building_csv
+    'seeding',         # immune and starting agents
+    'household',
+    'testing',
+    'office',          # spread and detection in offices
+    'school',          # spread and detection in schools
+    'interhousehold',  # choice of the visiting relatives and spread between them
+    'locations'        # visits and spread in locations
+]
+
+
+class RNGStreams:
+    def __init__(self, seed=None):
+        """
+        seed -- int (or sequence of ints) from which all streams are derived, None: fresh entropy.
+                The entropy actually used is stored in self.seed, such that also unseeded runs can be repeated.
+        """
+        seed_seq = np.random.SeedSequence(seed)
+        self.seed = seed_seq.entropy
+        self.numpy_rngs = {}  # stream -> numpy Generator
+        self.python_rngs = {}  # stream -> random.Random, for the code working on python sets and lists
+        for stream, stream_seed_seq in zip(STREAMS, seed_seq.spawn(len(STREAMS))):
+            self.numpy_rngs[stream] = np.random.default_rng(stream_seed_seq)
+            self.python_rngs[stream] = random.Random(int.from_bytes(stream_seed_seq.generate_state(4).tobytes(), 'little'))
+
+
+    def numpy(self, stream):
+        return self.numpy_rngs[stream]
+
+
+    def python(self, stream):
+        return self.python_rngs[stream]
+
+
+    def get_state(self):
+        """Return the states of all generators as json serializable dict"""
+        return {stream: {'numpy': self.numpy_rngs[stream].bit_generator.state, 'python': self.python_rngs[stream].getstate()}
+                for stream in STREAMS}
+
+
+    def set_state(self, state):
+        for stream in STREAMS:
+            self.numpy_rngs[stream].bit_generator.state = state[stream]['numpy']
+            version, internal_state, gauss_next = state[stream]['python']
+            self.python_rngs[stream].setstate((version, tuple(internal_state), gauss_next))
+
+
+def make_streams(seed):
+    """Return seed if it already is an RNGStreams object, else new RNGStreams from the seed"""
+    return seed if isinstance(seed, RNGStreams) else RNGStreams(seed)
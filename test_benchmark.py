@@ -0,0 +1,30 @@
+import csv
+import json
+import contextlib
+import io
+from benchmark import run_stages, write_synthetic_buildings_csv, bboxes, house_sqm_per_person
+
+
+def test_synthetic_buildings_csv(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    num_houses = write_synthetic_buildings_csv(csv_path, 20000, bboxes['small'])
+    with open(csv_path) as f:
+        rows = list(csv.DictReader(f))
+    houses = [row for row in rows if row['building_type'] == 'house']
+    assert len(houses) == num_houses
+    assert {row['building_type'] for row in rows} == {'house', 'supermarket', 'shop', 'restaurant', 'leisure', 'nightlife'}
+    min_x, min_y, max_x, max_y = bboxes['small']
+    assert all(min_x <= float(row['longitude']) <= max_x and min_y <= float(row['latitude']) <= max_y for row in rows)
+    assert abs(sum(float(row['sqm']) for row in houses) / 20000 - house_sqm_per_person) < 0.1 * house_sqm_per_person
+
+
+def test_run_stages_writes_one_line_per_stage(tmp_path):
+    out_path = tmp_path / "bench.jsonl"
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        run_stages('small', 'vec', 3, 2, tmp_path / "data", out_path, 0, lazy_locations=True)
+    with open(out_path) as f:
+        records = [json.loads(line) for line in f]
+    assert [record['stage'] for record in records] == ['write_synthetic_buildings_csv', 'EpsimGraph', 'to_csr', 'EpsimVec',
+                                                       'read_building_csv_cold', 'read_building_csv_cached', 'run_sim', 'run_sim_lazy',
+                                                       'run_sim', 'run_sim_lazy']
+    assert all(record['preset'] == 'small' and record['wall_time_s'] >= 0 and record['peak_rss_mb'] > 0 for record in records)
@@ -0,0 +1,57 @@
+import random
+import numpy as np
+from building_store import BuildingStore, read_buildings, CSV_FIELDS
+
+
+def write_buildings_csv(path, n=300):
+    rng = random.Random(0)
+    rows = []
+    for i in range(n):
+        building_type = rng.choice(['house', 'supermarket', 'shop', 'restaurant'])
+        rows.append((building_type, rng.choice(['yes', 'apartments', building_type]), 13 + rng.random() * 0.05,
+                     47.8 + rng.random() * 0.05, rng.randint(20, 400)))
+    with open(path, 'w') as f:
+        f.write(",".join(CSV_FIELDS) + "\n")
+        for row in rows:
+            f.write(",".join(map(str, row)) + "\n")
+    return rows
+
+
+def store_rows(store):
+    return list(zip(np.array(store.types, dtype=object)[store.type], np.array(store.tags, dtype=object)[store.tag],
+                    store.x.tolist(), store.y.tolist(), store.sqm.tolist()))
+
+
+def test_csv_to_store_round_trip(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    rows = write_buildings_csv(csv_path)
+    store = BuildingStore.from_csv(csv_path)
+    assert store_rows(store) == rows
+
+    store_path = tmp_path / "buildings.buildings"
+    store.sorted_spatially().save(store_path)
+    loaded = read_buildings(store_path)
+    assert isinstance(loaded.x, np.memmap)
+    assert sorted(store_rows(loaded)) == sorted(rows)
+    assert sorted(store_rows(read_buildings(csv_path))) == sorted(rows)
+
+    csv_again = tmp_path / "again.csv"
+    loaded.write_csv(csv_again)
+    assert sorted(store_rows(BuildingStore.from_csv(csv_again))) == sorted(rows)
+
+
+def test_rows_of_type_matches_csv(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    rows = write_buildings_csv(csv_path)
+    store = BuildingStore.from_csv(csv_path)
+    for building_type in ['house', 'supermarket', 'shop', 'restaurant', 'school']:
+        assert store.rows_of_type(building_type).tolist() == [i for i, row in enumerate(rows) if row[0] == building_type]
+
+
+def test_sorted_spatially_keeps_nearby_rows_together(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    write_buildings_csv(csv_path, 2000)
+    store = BuildingStore.from_csv(csv_path)
+    def mean_step(s):
+        return np.mean(np.hypot(np.diff(s.x), np.diff(s.y)))
+    assert mean_step(store.sorted_spatially()) < mean_step(store) / 5
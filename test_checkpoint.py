@@ -0,0 +1,43 @@
+import contextlib
+import io
+from gengraph import EpsimGraph
+from epsim import Epsim
+from epsim_vec import EpsimVec
+from checkpoint import Checkpoint
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+def make_sim():
+    graph = EpsimGraph(2000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+    return Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                 graph.interhousehold_nbrs)
+
+
+def test_resume_fresh_epsim_from_checkpoint_file(tmp_path):
+    params = default_sim_params(30)
+    params['p_detect_adult_dict'] = {0: 0.9}  # quarantine agents before the checkpoint
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = make_sim()
+        info_per_rnd = sim.run_sim(**params, checkpoint_rnds={15}, seed=3)
+        checkpoint = sim.checkpoints[15]
+        assert (checkpoint.quarantine_counter >= 0).any()
+        checkpoint.save(tmp_path / "checkpoint.npz")
+
+        resumed = make_sim().run_sim(**params, resume_from=Checkpoint.load(tmp_path / "checkpoint.npz"))
+    assert resumed == info_per_rnd
+
+
+def test_fork_from_checkpoint():
+    params = dict(default_sim_params(30), p_spread_household_dict={0: 0.2}, p_spread_office_dict={0: 0.05})
+    with contextlib.redirect_stdout(io.StringIO()):
+        for sim in (make_sim(), EpsimVec(EpsimGraph(2000, 0.5, 0.3, rng=RNGStreams(1).python('graph')).to_csr())):
+            info_per_rnd = sim.run_sim(**params, checkpoint_rnds={5, 15}, seed=4)
+            checkpoints = sim.checkpoints
+            assert sim.run_sim(**params, resume_from=checkpoints[15]) == info_per_rnd
+
+            # the fork shares the rounds before the checkpoint and continues with its own parameters
+            fork = sim.run_sim(**dict(params, p_spread_household_dict={0: 0.2, 5: 0.5}), resume_from=checkpoints[5])
+            assert fork[:5] == info_per_rnd[:5]
+            assert sum(info['infected_in_household'] for info in fork[5:]) \
+                > sum(info['infected_in_household'] for info in info_per_rnd[5:])
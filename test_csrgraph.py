@@ -0,0 +1,70 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from gengraph import EpsimGraph
+from epsim import Epsim
+from epsim_vec import EpsimVec
+from csrgraph import CSRGraph, ROLE_CHILD, ROLE_ADULT
+from array_file import write_array_file
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+def make_graph():
+    return EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+
+
+def test_csr_graph_matches_nbrs_dicts():
+    graph = make_graph()
+    csr_graph = graph.to_csr()
+    nbrs_dicts = {
+        'household': graph.household_nbrs,
+        'school_standard': graph.school_nbrs_standard,
+        'school_split_0': graph.school_nbrs_split[0],
+        'school_split_1': graph.school_nbrs_split[1],
+        'office': graph.office_nbrs,
+        'interhousehold': graph.interhousehold_nbrs
+    }
+    for edge_type, nbrs_dict in nbrs_dicts.items():
+        nbrs = csr_graph.nbrs(edge_type)
+        assert sorted(nbrs) == sorted(nbrs_dict)
+        assert all(nbrs[agent] == sorted(nbrs_dict[agent]) for agent in nbrs_dict)
+        assert -1 not in nbrs and csr_graph.num_ids not in nbrs
+
+    children = set(graph.school_nbrs_standard) | set(graph.school_nbrs_split[0]) | set(graph.school_nbrs_split[1])
+    assert set(csr_graph.agents_with_role(ROLE_CHILD).tolist()) == children
+    assert set(csr_graph.agents_with_role(ROLE_ADULT).tolist()) == set(graph.office_nbrs)
+
+
+def test_gather_concatenates_rows():
+    csr_graph = make_graph().to_csr()
+    nbrs = csr_graph.nbrs('office')
+    agents = np.arange(0, csr_graph.num_ids, 7)
+    # agents without an office entry (children) have an empty row
+    assert nbrs.gather(agents).tolist() == [nbr for agent in agents.tolist() for nbr in nbrs.row(agent)]
+    assert [nbr for agent in agents.tolist() if agent in nbrs for nbr in nbrs[agent]] == nbrs.gather(agents).tolist()
+
+
+def test_graph_file_round_trip(tmp_path):
+    graph = make_graph()
+    path = tmp_path / "graph.bin"
+    graph.write_graph_file(path)
+    csr_graph = graph.to_csr()
+    for mmap in (True, False):
+        loaded = CSRGraph.load(path, mmap)
+        assert (loaded.roles == csr_graph.roles).all() and loaded.num_ids == csr_graph.num_ids
+        for edge_type in csr_graph.indptr:
+            assert (loaded.indptr[edge_type] == csr_graph.indptr[edge_type]).all()
+            assert (loaded.indices[edge_type] == csr_graph.indices[edge_type]).all()
+    assert not CSRGraph.load(path).indices['household'].flags.writeable
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        info_per_rnd = Epsim.from_graph_file(path).run_sim(**default_sim_params(20), seed=1)
+        assert info_per_rnd == Epsim(csr_graph).run_sim(**default_sim_params(20), seed=1)
+        assert EpsimVec.from_graph_file(path).run_sim(**default_sim_params(20), seed=1) \
+            == EpsimVec(csr_graph).run_sim(**default_sim_params(20), seed=1)
+
+    write_array_file(tmp_path / "other.bin", b"EPSIMXXX", 1, {'roles': csr_graph.roles})
+    with pytest.raises(ValueError):
+        CSRGraph.load(tmp_path / "other.bin")
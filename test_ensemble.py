@@ -0,0 +1,23 @@
+import contextlib
+import io
+from gengraph import EpsimGraph
+from epsim_vec import EpsimVec
+from ensemble import run_ensemble_per_param_combi
+from read_building_csv import read_building_csv
+from rng_streams import RNGStreams
+from benchmark import default_sim_params, write_synthetic_buildings_csv, bboxes
+
+
+def test_ensemble_runs_like_sequential_runs(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    write_synthetic_buildings_csv(csv_path, 3000, bboxes['small'])
+    param_combis = [default_sim_params(30), dict(default_sim_params(30), p_spread_household_dict={0: 0.3})]
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+        sim = EpsimVec(graph.to_csr())
+        read_building_csv(sim, str(csv_path), rng=RNGStreams(1).python('buildings'))
+        runs = run_ensemble_per_param_combi(sim, param_combis, 2, num_processes=2, seed=7)
+        # workers run on the shared world arrays, with the seed (seed, run) of every run
+        sequential = [[sim.run_sim(**sim_params, seed=[7, run]) for run in range(2)] for sim_params in param_combis]
+    assert runs == sequential
+    assert runs[0][0] != runs[0][1]
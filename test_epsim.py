@@ -0,0 +1,132 @@
+import contextlib
+import io
+import numpy as np
+from gengraph import EpsimGraph
+from epsim import Epsim, Location, LocationTable
+from read_building_csv import read_building_csv
+from rng_streams import RNGStreams, make_streams
+from benchmark import default_sim_params, write_synthetic_buildings_csv, bboxes
+
+
+def make_sim(n=3000):
+    graph = EpsimGraph(n, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+    return Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                 graph.interhousehold_nbrs)
+
+
+def make_sim_with_buildings(tmp_path, n=3000):
+    csv_path = tmp_path / "buildings.csv"
+    write_synthetic_buildings_csv(csv_path, n, bboxes['small'])
+    sim = make_sim(n)
+    read_building_csv(sim, str(csv_path), rng=RNGStreams(1).python('buildings'))
+    return sim
+
+
+def test_location_table_spread():
+    locations = {'supermarket': [Location('supermarket', 'supermarket', 0, 0, 13)],
+                 'shop': [Location('shop', 'bakery', 1, 1, 13), Location('shop', 'kiosk', 2, 2, 13)]}
+    table = LocationTable(locations)
+    assert [loc.idx for loc in locations['shop']] == [1, 2]
+    table.set_rates(1.0, {'supermarket': 1, 'shop': 1})
+
+    # infection probability: visit minutes * infectious minutes / (8h * 12h) for 13 sqm and contact multiplier 1
+    num_agents = 20000
+    agents = np.arange(num_agents)
+    table.register_infectious_visits(np.array([0, 1]), np.array([0.3 * 12*60, 0.6 * 12*60]))
+    table.register_visits(agents, np.zeros(num_agents, dtype=np.int64), np.full(num_agents, 8*60.0))
+    table.register_visits(agents, np.ones(num_agents, dtype=np.int64), np.full(num_agents, 8*60.0))
+    table.register_visits(agents, np.full(num_agents, 2), np.full(num_agents, 8*60.0))
+    infected = table.spread(np.random.default_rng(0))
+
+    # an agent infected in several location types counts for the first type
+    assert len(np.intersect1d(infected['supermarket'], infected['shop'])) == 0
+    assert abs(len(infected['supermarket']) / num_agents - 0.3) < 0.02
+    assert abs(len(infected['shop']) / num_agents - 0.7 * 0.6) < 0.02
+    assert table.visit_agents == [] and not table.infec_minutes.any()
+
+
+def test_draw_visits_at_favourite_locations(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = make_sim_with_buildings(tmp_path)
+    params = default_sim_params(1)
+    sim.avg_visit_times = params['avg_visit_times']
+    sim.need_minutes = params['need_minutes']
+    sim.streams = make_streams(0)
+
+    # the index matrix holds the LocationTable indices of the favourite Location objects of every house
+    for loc_type, house_visit_loc_idx in sim.house_visit_loc_idx.items():
+        assert house_visit_loc_idx.tolist() == [[loc.idx for loc in visit_locs[loc_type]] for visit_locs in sim.house_visit_locs]
+
+    num_rnds = 20
+    visits = [sim.draw_visits() for rnd in range(num_rnds)]
+    agents = np.concatenate([agents for agents, _, _ in visits])
+    locs = np.concatenate([locs for _, locs, _ in visits])
+    minutes = np.concatenate([minutes for _, _, minutes in visits])
+    agent_house = np.full(sim.num_ids, -1)
+    agent_house[sim.visit_agents] = sim.visit_agent_house
+    assert (agent_house[agents] >= 0).all()
+
+    table = sim.location_table
+    for t, loc_type in enumerate(table.loc_types):
+        of_type = table.type[locs] == t
+        # every visit is at one of the favourite locations of the house of the agent, with the average visit time
+        assert (sim.house_visit_loc_idx[loc_type][agent_house[agents[of_type]]] == locs[of_type][:, np.newaxis]).any(axis=1).all()
+        assert (minutes[of_type] == params['avg_visit_times'][loc_type]).all()
+        # visit probability per round: needed minutes per week / (visit time * 7)
+        visit_prob = params['need_minutes'][loc_type] / (params['avg_visit_times'][loc_type] * 7)
+        assert abs(np.count_nonzero(of_type) / (num_rnds * len(sim.visit_agents)) - visit_prob) < 0.01
+
+
+def test_quarantine_release_day_buckets():
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = make_sim()
+    rng = np.random.default_rng(0)
+    sim.reset_quarantine()
+    admissions = {}  # reference: agent -> round of its last admission
+    for rnd in range(40):
+        sim.release_quarantined(rnd)
+        # agents are quarantined for the 10 rounds from their admission on
+        expected = sorted(agent for agent, admission_rnd in admissions.items() if rnd - admission_rnd < 10)
+        assert sorted(sim.quarantined) == expected
+        assert np.flatnonzero(sim.is_quarantined).tolist() == expected
+        for agent in rng.integers(sim.num_ids, size=50).tolist():
+            sim.admit_quarantine(agent, rnd)  # also agents already in quarantine, whose quarantine starts again
+            admissions[agent] = rnd
+
+
+def test_role_masks_and_infectious_sets():
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = make_sim()
+        children = set(sim.school_nbrs_standard) | set(sim.school_nbrs_split[0]) | set(sim.school_nbrs_split[1])
+        assert all(sim.is_child_agent(agent) == (agent in children) for agent in sim.household_nbrs)
+        assert all(sim.is_adult_agent(agent) == (agent in sim.office_nbrs) for agent in sim.household_nbrs)
+
+        # the incrementally maintained sets equal the sets computed from the agent states, at the end of every run length
+        for sim_iters in (5, 12, 20):
+            sim.run_sim(**default_sim_params(sim_iters), seed=1)
+            all_infectious = set().union(*(sim.agents_in_state[s] for s in sim.states_infectious))
+            assert sim.all_infectious == all_infectious
+            assert sim.all_infectious_children == all_infectious & children
+            assert sim.all_infectious_adults == all_infectious & set(sim.office_nbrs)
+            assert sim.all_infectious_children_standard == all_infectious & set(sim.school_nbrs_standard)
+            assert len(all_infectious) > 0
+
+
+def test_lazy_locations_match_full_evaluation(tmp_path):
+    loc_counters = ['infected_in_supermarket', 'infected_in_shop', 'infected_in_restaurant', 'infected_in_leisure', 'infected_in_nightlife']
+    params = default_sim_params(10)
+    seeds = range(30)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = make_sim_with_buildings(tmp_path, 1500)
+        def location_infections(lazy_locations, lazy_max_reachable=0.25):
+            sim.lazy_max_reachable = lazy_max_reachable
+            return np.array([[sum(info[counter] for info in sim.run_sim(**params, seed=seed, lazy_locations=lazy_locations))
+                              for counter in loc_counters] for seed in seeds], dtype=np.float64)
+        full = location_infections(False)
+        # default threshold and only the houses that reach an infectious location, also when most houses do
+        lazy_runs = [location_infections(True), location_infections(True, np.inf)]
+    assert not sim.house_mask.any() and not sim.row_mask.any()
+    assert full.sum(axis=1).min() > 0
+    for lazy in lazy_runs:
+        std_err = np.sqrt(full.var(axis=0) / len(seeds) + lazy.var(axis=0) / len(seeds))
+        assert (np.abs(full.mean(axis=0) - lazy.mean(axis=0)) < 4 * std_err + 1).all()
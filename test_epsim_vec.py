@@ -0,0 +1,36 @@
+import contextlib
+import io
+import numpy as np
+from gengraph import EpsimGraph
+from epsim import Epsim
+from epsim_vec import EpsimVec
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+COUNTERS = ['infected', 'infected_in_household', 'infected_in_school', 'infected_in_office', 'quarantined_by_test']
+
+
+def total_counters(sim, params, seeds):
+    """Return the totals of COUNTERS over all rounds per seed (seeds x counters)"""
+    totals = []
+    for seed in seeds:
+        info_per_rnd = sim.run_sim(**params, seed=seed)
+        totals.append([sum(info[counter] for info in info_per_rnd) for counter in COUNTERS])
+    return np.array(totals, dtype=np.float64)
+
+
+def test_vec_engine_matches_set_engine_statistics():
+    params = default_sim_params(60)
+    params.update(p_spread_household_dict={0: 0.2}, p_spread_school_dict={0: 0.05}, p_spread_office_dict={0: 0.05})
+    seeds = range(20)
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(5000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+        totals_set = total_counters(Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split,
+                                          graph.office_nbrs, graph.interhousehold_nbrs), params, seeds)
+        totals_vec = total_counters(EpsimVec(graph.to_csr()), params, seeds)
+
+    # the engines draw different random numbers, their means agree within a few standard errors
+    std_err = np.sqrt(totals_set.var(axis=0) / len(seeds) + totals_vec.var(axis=0) / len(seeds))
+    assert (totals_set[:, 0] > 0).all()
+    assert (np.abs(totals_set.mean(axis=0) - totals_vec.mean(axis=0)) < 4 * std_err + 1).all()
@@ -0,0 +1,77 @@
+import contextlib
+import io
+from collections import Counter
+import numpy as np
+from gengraph import EpsimGraph, grid_nbrs, grid_edges
+from epsim import Epsim
+from csrgraph import CSRGraph
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+def degree_distribution(nbrs_dict):
+    degrees = Counter(len(nbrs) for nbrs in nbrs_dict.values())
+    return {degree: count / len(nbrs_dict) for degree, count in degrees.items()}
+
+
+def test_vectorized_graph_has_the_distributions_of_the_original():
+    graph = EpsimGraph(50000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+    vectorized = EpsimGraph(50000, 0.5, 0.3, rng=RNGStreams(1).python('graph'), vectorized=True)
+
+    # household, office and class structure only depend on the cluster sizes, the interhousehold links are random
+    for attr in ['household_nbrs', 'office_nbrs', 'school_nbrs_standard']:
+        assert degree_distribution(getattr(vectorized, attr)) == degree_distribution(getattr(graph, attr))
+    for i in range(2):
+        assert degree_distribution(vectorized.school_nbrs_split[i]) == degree_distribution(graph.school_nbrs_split[i])
+    assert abs(len(vectorized.interhousehold_nbrs) / len(graph.interhousehold_nbrs) - 1) < 0.01
+    expected = degree_distribution(graph.interhousehold_nbrs)
+    for degree, share in degree_distribution(vectorized.interhousehold_nbrs).items():
+        assert abs(share - expected.get(degree, 0)) < 0.01
+
+    # households, offices and classes are undirected, household_nbrs has an entry for every node
+    for nbrs_dict in [vectorized.household_nbrs, vectorized.office_nbrs, vectorized.school_nbrs_standard]:
+        assert all(agent in nbrs_dict[nbr] for agent, nbrs in nbrs_dict.items() for nbr in nbrs)
+    assert set(vectorized.household_nbrs) == vectorized.adult_nodes | vectorized.child_nodes
+
+
+def test_vectorized_graph_is_emitted_as_csr():
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(1).python('graph'), vectorized=True)
+        csr_graph = graph.to_csr()
+        from_nbrs = CSRGraph.from_nbrs(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split,
+                                       graph.office_nbrs, graph.interhousehold_nbrs)
+        assert (csr_graph.roles == from_nbrs.roles).all()
+        assert all((csr_graph.indptr[edge_type] == from_nbrs.indptr[edge_type]).all()
+                   and (csr_graph.indices[edge_type] == from_nbrs.indices[edge_type]).all() for edge_type in csr_graph.indptr)
+
+        # the CSRNbrs views can be passed to Epsim like neighbor dicts
+        sim = Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                    graph.interhousehold_nbrs)
+        assert sim.csr_graph is csr_graph
+        assert sim.run_sim(**default_sim_params(20), seed=1) == Epsim(csr_graph).run_sim(**default_sim_params(20), seed=1)
+
+
+def brute_force_grid_nbrs(grids, skip):
+    # every node of a grid cell gets the nodes of the (up to 8) adjacent cells, cells with (i+j) % 2 == skip are left out
+    nbrs_dict = {}
+    for grid in grids.tolist():
+        l = len(grid)
+        for i in range(l):
+            for j in range(l):
+                if (i + j) % 2 == skip:
+                    continue
+                nbrs_dict[grid[i][j]] = {grid[i + di][j + dj] for di in (-1, 0, 1) for dj in (-1, 0, 1)
+                                         if (di, dj) != (0, 0) and 0 <= i + di < l and 0 <= j + dj < l and (i + di + j + dj) % 2 != skip}
+    return nbrs_dict
+
+
+def test_stencil_grid_nbrs_match_brute_force():
+    rng = np.random.default_rng(0)
+    for l in (1, 2, 5, 6):
+        grids = rng.permutation(7 * l * l).reshape(7, l, l)
+        for skip in (0, 1, 2):
+            expected = brute_force_grid_nbrs(grids, skip)
+            assert grid_nbrs(grids, skip) == expected
+            src, dst, nodes = grid_edges(grids, skip)
+            assert sorted(nodes.tolist()) == sorted(expected)
+            assert sorted(zip(src.tolist(), dst.tolist())) == sorted((node, nbr) for node, nbrs in expected.items() for nbr in nbrs)
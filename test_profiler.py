@@ -0,0 +1,27 @@
+import contextlib
+import io
+from gengraph import EpsimGraph
+from epsim import Epsim
+from epsim_vec import EpsimVec
+from profiler import PhaseProfiler, PHASES
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+def test_profiled_run_counts_work_without_changing_the_run():
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+        for sim in (Epsim(graph.to_csr()), EpsimVec(graph.to_csr())):
+            rounds = []
+            profiler = PhaseProfiler(callback=lambda rnd, times, counters: rounds.append(rnd))
+            info_per_rnd = sim.run_sim(**default_sim_params(20), seed=2, profiler=profiler)
+            assert sim.run_sim(**default_sim_params(20), seed=2) == info_per_rnd
+
+            assert rounds == list(range(20))
+            assert profiler.times.shape == (20, len(PHASES)) and (profiler.times >= 0).all()
+            counters = profiler.phase_counters()
+            assert counters['household']['edges_examined'] > 0 and counters['household']['random_draws'] > 0
+            assert counters['setup']['random_draws'] > 0  # visiting relatives
+            assert all(counters[phase]['visits_registered'] == 0 for phase in PHASES if phase != 'visit_registration')
+            assert sum(counters[phase]['agents_quarantined'] for phase in PHASES) \
+                >= sum(info['quarantined_by_detection'] + info['quarantined_by_test'] for info in info_per_rnd)
@@ -0,0 +1,79 @@
+import contextlib
+import io
+import random
+import numpy as np
+from gengraph import EpsimGraph
+from epsim import Epsim
+from read_building_csv import read_building_csv, GridIndex, calc_dist
+from rng_streams import RNGStreams
+
+
+def write_buildings_csv(path):
+    rng = random.Random(0)
+    with open(path, 'w') as f:
+        f.write("building_type,tag,longitude,latitude,sqm\n")
+        for i in range(400):
+            f.write(f"house,yes,{13 + rng.random() * 0.05},{47.8 + rng.random() * 0.05},{rng.randint(60, 300)}\n")
+        for loc_type in ['supermarket', 'shop', 'restaurant', 'leisure', 'nightlife']:
+            for i in range(8):
+                f.write(f"{loc_type},{loc_type},{13 + rng.random() * 0.05},{47.8 + rng.random() * 0.05},200\n")
+
+
+def make_sim():
+    graph = EpsimGraph(500, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+    return Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                 graph.interhousehold_nbrs)
+
+
+def test_cache_is_skipped_with_default_rng(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    write_buildings_csv(csv_path)
+    cache_dir = tmp_path / "cache"
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = make_sim()
+        read_building_csv(sim, str(csv_path), cache_dir=cache_dir)
+        read_building_csv(sim, str(csv_path), cache_dir=cache_dir)
+    assert not cache_dir.exists() or not any(cache_dir.iterdir())
+
+
+def test_cache_is_hit_with_seeded_rng(tmp_path):
+    csv_path = tmp_path / "buildings.csv"
+    write_buildings_csv(csv_path)
+    cache_dir = tmp_path / "cache"
+    outputs = []
+    house_households = []
+    for i in range(2):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            sim = make_sim()
+            read_building_csv(sim, str(csv_path), rng=RNGStreams(2).python('buildings'), cache_dir=cache_dir)
+        outputs.append(output.getvalue())
+        house_households.append(sim.house_households)
+    assert len(list(cache_dir.iterdir())) == 1
+    assert "from " + str(next(cache_dir.iterdir())) in outputs[1]
+    assert house_households[0] == house_households[1]
+
+
+def test_grid_index_query_matches_brute_force():
+    rng = np.random.default_rng(0)
+    # clustered points with duplicates (distance ties), queries inside and outside of the points' bounding box
+    x = np.round(np.concatenate([rng.normal(13, 0.01, 300), rng.uniform(12.9, 13.1, 100)]), 3)
+    y = np.round(np.concatenate([rng.normal(47.8, 0.01, 300), rng.uniform(47.7, 47.9, 100)]), 3)
+    qx = rng.uniform(12.8, 13.2, 500)
+    qy = rng.uniform(47.6, 48.0, 500)
+    for points_per_cell in (1, 2, 10):
+        index = GridIndex(x, y, points_per_cell)
+        for k in (1, 3, 5):
+            dist = calc_dist(qx[:, np.newaxis], qy[:, np.newaxis], x, y)
+            expected = np.lexsort((np.broadcast_to(np.arange(len(x)), dist.shape), dist), axis=1)[:, :k]
+            assert (index.query(qx, qy, k) == expected).all()
+    assert index.query(qx[:2], qy[:2], 1000).shape == (2, len(x))
+
+
+def test_cache_is_off_by_default(tmp_path, monkeypatch):
+    csv_path = tmp_path / "buildings.csv"
+    write_buildings_csv(csv_path)
+    monkeypatch.chdir(tmp_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        read_building_csv(make_sim(), str(csv_path), rng=RNGStreams(2).python('buildings'))
+    assert [path.name for path in tmp_path.iterdir()] == ["buildings.csv"]
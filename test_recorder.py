@@ -0,0 +1,33 @@
+import contextlib
+import io
+import numpy as np
+from gengraph import EpsimGraph
+from epsim import Epsim
+from recorder import RunRecorder, ResultStore, load_results, runs_of_key, get_cumulative
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+def test_recorder_matches_info_per_rnd(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+        sim = Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                    graph.interhousehold_nbrs)
+        runs = []
+        for seed in range(3):
+            recorder = RunRecorder()
+            info_per_rnd = sim.run_sim(**default_sim_params(30), recorder=recorder, seed=seed)
+            assert recorder.to_info_per_rnd() == info_per_rnd
+            runs.append(info_per_rnd)
+
+    store = ResultStore(tmp_path / "results")
+    for seed, info_per_rnd in enumerate(runs):
+        store.append(info_per_rnd, key=seed % 2)
+    # a new store appends to the existing files
+    ResultStore(tmp_path / "results").append(RunRecorder.from_info_per_rnd(runs[0]), key=2)
+
+    metrics, states, keys = load_results(tmp_path / "results")
+    assert metrics.shape == (4, 30, 16) and states.shape == (4, 30, 7) and keys.tolist() == [0, 1, 0, 2]
+    selected_metrics, _ = runs_of_key(metrics, states, keys, 0)
+    assert get_cumulative(selected_metrics, 'infected').tolist() == [sum(info['infected'] for info in runs[seed]) for seed in (0, 2)]
+    assert np.array_equal(states[3], [info['states'] for info in runs[0]])
@@ -0,0 +1,45 @@
+import contextlib
+import io
+from gengraph import EpsimGraph
+from epsim import Epsim
+from rng_streams import RNGStreams, STREAMS
+from benchmark import default_sim_params
+
+
+def test_streams_are_reproducible_and_independent():
+    streams = RNGStreams(1)
+    draws = {stream: (streams.numpy(stream).random(3).tolist(), streams.python(stream).random()) for stream in STREAMS}
+    assert len(set(draw for _, draw in draws.values())) == len(STREAMS)
+
+    again = RNGStreams(1)
+    assert all(again.numpy(stream).random(3).tolist() == draws[stream][0] for stream in STREAMS)
+    assert all(again.python(stream).random() == draws[stream][1] for stream in STREAMS)
+    assert RNGStreams(2).python('household').random() != draws['household'][1]
+
+    # unseeded streams keep their entropy, such that they can be repeated
+    unseeded = RNGStreams()
+    repeated = RNGStreams(unseeded.seed)
+    assert unseeded.numpy('locations').random() == repeated.numpy('locations').random()
+
+    # the state of all streams round trips through get_state and set_state
+    state = streams.get_state()
+    expected = [streams.python(stream).random() for stream in STREAMS]
+    streams.set_state(state)
+    assert [streams.python(stream).random() for stream in STREAMS] == expected
+
+
+def test_run_sim_with_seed_is_reproducible():
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(1).python('graph'))
+        sim = Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                    graph.interhousehold_nbrs)
+        info_per_rnd = sim.run_sim(**default_sim_params(30), seed=3)
+        assert sim.run_sim(**default_sim_params(30), seed=3) == info_per_rnd
+        assert sim.run_sim(**default_sim_params(30), seed=4) != info_per_rnd
+        unseeded = sim.run_sim(**default_sim_params(30))
+        assert sim.run_sim(**default_sim_params(30), seed=sim.streams.seed) == unseeded
+
+        # common random numbers: a changed office parameter does not change the draws of the household phase before it
+        other = sim.run_sim(**dict(default_sim_params(30), p_spread_office_dict={0: 0.5}), seed=3)
+    assert other[0]['infected_in_household'] == info_per_rnd[0]['infected_in_household']
+    assert other[0]['infected_in_office'] != info_per_rnd[0]['infected_in_office']
@@ -0,0 +1,50 @@
+import contextlib
+import io
+import pickle
+from gengraph import EpsimGraph
+from epsim import Epsim
+from epsim_vec import EpsimVec
+from world_cache import create_world, prepare_world, clear_memory_cache
+from rng_streams import RNGStreams
+from benchmark import default_sim_params
+
+
+def test_pickled_world_runs_like_fresh_world():
+    for engine in (Epsim, EpsimVec):
+        with contextlib.redirect_stdout(io.StringIO()):
+            fresh = create_world(engine, 3000, 0.5, 0.3, None, 0)
+            loaded = pickle.loads(pickle.dumps(fresh))
+            info_fresh = fresh.run_sim(**default_sim_params(40), seed=5)
+            info_loaded = loaded.run_sim(**default_sim_params(40), seed=5)
+        assert sum(info['infected'] for info in info_fresh) > 0
+        assert info_loaded == info_fresh
+
+
+def test_dict_graph_runs_like_csr_graph():
+    with contextlib.redirect_stdout(io.StringIO()):
+        graph = EpsimGraph(3000, 0.5, 0.3, rng=RNGStreams(0).python('graph'))
+        sim_dict = Epsim(graph.household_nbrs, graph.school_nbrs_standard, graph.school_nbrs_split, graph.office_nbrs,
+                         graph.interhousehold_nbrs)
+        sim_csr = Epsim(graph.to_csr())
+        info_dict = sim_dict.run_sim(**default_sim_params(40), seed=5)
+        info_csr = sim_csr.run_sim(**default_sim_params(40), seed=5)
+    assert sum(info['infected'] for info in info_dict) > 0
+    assert info_csr == info_dict
+
+
+def test_prepare_world_reuses_cached_world(tmp_path):
+    with contextlib.redirect_stdout(io.StringIO()):
+        world = prepare_world(3000, 0.5, 0.3, seed=1, engine=Epsim, cache_dir=tmp_path)
+        assert prepare_world(3000, 0.5, 0.3, seed=1, engine=Epsim, cache_dir=tmp_path) is world
+        assert len(list(tmp_path.iterdir())) == 1
+
+        # a new process only finds the disk cache
+        clear_memory_cache()
+        loaded = prepare_world(3000, 0.5, 0.3, seed=1, engine=Epsim, cache_dir=tmp_path)
+        assert loaded is not world
+        assert loaded.run_sim(**default_sim_params(30), seed=2) == world.run_sim(**default_sim_params(30), seed=2)
+
+        # other parameters give another world
+        assert prepare_world(3000, 0.5, 0.3, seed=2, engine=Epsim, cache_dir=tmp_path).households != world.households
+        assert len(list(tmp_path.iterdir())) == 2
+    clear_memory_cache()
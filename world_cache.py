@@ -0,0 +1,80 @@
+# Cache of prepared worlds: the graph, the Epsim object (households, clusters) and the building assignment of read_building_csv
+# (house_households, house_visit_locs, ...) are created once per parameter set and reused by all runs.
+# run_sim resets all per run state itself, so the same prepared Epsim can run any number of simulations.
+
+import os
+import pickle
+import hashlib
+from pathlib import Path
+from gengraph import EpsimGraph
+from epsim_vec import EpsimVec
+from read_building_csv import read_building_csv
+from rng_streams import RNGStreams
+
+
+worlds = {}  # in memory cache: world key -> prepared Epsim
+
+
+def world_key(engine, n, sigma_office, perc_split_classes, buildings_csv, seed):
+    # a changed buildings csv has a new size or modification time and results in a new key
+    if buildings_csv is not None:
+        stat = os.stat(buildings_csv)
+        buildings_csv = (str(Path(buildings_csv).resolve()), stat.st_size, stat.st_mtime_ns)
+    return (engine.__name__, n, sigma_office, perc_split_classes, buildings_csv, seed)
+
+
+def create_world(engine, n, sigma_office, perc_split_classes, buildings_csv, seed, print_progress=False):
+    # graph generation and building assignment use their own streams, the random state of the simulation runs is left untouched
+    streams = RNGStreams(seed)
+    epsim_graph = EpsimGraph(n, sigma_office, perc_split_classes, print_progress, rng=streams.python('graph'))
+    if issubclass(engine, EpsimVec):
+        sim = engine(epsim_graph.to_csr())
+    else:
+        sim = engine(epsim_graph.household_nbrs, epsim_graph.school_nbrs_standard, epsim_graph.school_nbrs_split,
+                     epsim_graph.office_nbrs, epsim_graph.interhousehold_nbrs)
+    if buildings_csv is not None:
+        read_building_csv(sim, buildings_csv, rng=streams.python('buildings'))
+    return sim
+
+
+def prepare_world(n, sigma_office, perc_split_classes, buildings_csv=None, seed=0, engine=EpsimVec, cache_dir="world_cache",
+                  print_progress=False):
+    """
+    Return a prepared simulation for the given world parameters, from the in memory cache, the disk cache or newly created.
+    The returned object is shared by all callers with the same parameters, run_sim can be called on it repeatedly.
+
+    n, sigma_office, perc_split_classes -- see EpsimGraph
+    buildings_csv  -- path of the buildings csv for read_building_csv, None: no location simulation
+    seed           -- seed of graph generation and building assignment, different seeds give different worlds
+    engine         -- Epsim or EpsimVec
+    cache_dir      -- directory of the disk cache, None: only cache in memory
+    """
+    key = world_key(engine, n, sigma_office, perc_split_classes, buildings_csv, seed)
+    if key in worlds:
+        return worlds[key]
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"world_{hashlib.sha1(repr(key).encode()).hexdigest()[:16]}.p"
+
+    if cache_path is not None and cache_path.is_file():
+        with open(cache_path, 'rb') as f:
+            sim = pickle.load(f)
+        sim.streams = RNGStreams()  # do not replay the random numbers of the pickled generators
+        if print_progress:
+            print(f"loaded prepared world from {cache_path}")
+    else:
+        sim = create_world(engine, n, sigma_office, perc_split_classes, buildings_csv, seed, print_progress)
+        if cache_path is not None:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, 'wb') as f:
+                pickle.dump(sim, f, protocol=pickle.HIGHEST_PROTOCOL)
+            if print_progress:
+                print(f"{cache_path} written")
+
+    worlds[key] = sim
+    return sim
+
+
+def clear_memory_cache():
+    worlds.clear()